@@ -0,0 +1,263 @@
+import json
+import threading
+from collections import OrderedDict
+
+import instrument
+import singleflight
+import streaming
+
+# --- AI 景點建議 (快取 + 一天一次批次) ---
+# 同一個景點的建議對每個人都一樣，所以依 (景點, 國家, prompt 版本) 快取：
+# 前面一層記憶體 LRU，後面一層 SqliteCache 存在硬碟 (重開也還在)。
+# 改了 prompt 內容記得把 PROMPT_VERSION 加一，舊的快取就會自然失效。
+# 快取還沒有、但別的 session 正在問同一個景點 (或同一組景點) 時，等那一次的結果就好 (single-flight)。
+
+PROMPT_VERSION = 1
+ADVICE_TTL = 30 * 24 * 3600
+FAILED_TEXT = "暫時無法獲取建議"
+
+
+def advice_prompt(spot_name, country):
+    return f"我正在規劃去 {country} 旅遊，景點是 {spot_name}。請提供 50 字以內的簡短介紹與建議 像是一定要點那些餐點 看那些東西等等。"
+
+
+def day_advice_prompt(spot_names, country):
+    spots = "\n".join(f"- {s}" for s in spot_names)
+    return (
+        f"我正在規劃去 {country} 旅遊，以下是今天的景點：\n{spots}\n"
+        "請針對每一個景點提供 50 字以內的簡短介紹與建議 像是一定要點那些餐點 看那些東西等等。\n"
+        "請直接輸出 JSON 物件，key 是上面列出的景點名稱 (完全照抄)，value 是建議文字。"
+    )
+
+
+class AdviceCache:
+    def __init__(self, disk_cache=None, max_memory=512):
+        self.disk = disk_cache
+        self.max_memory = max_memory
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(spot_name, country):
+        return (spot_name, country, PROMPT_VERSION)
+
+    def get(self, spot_name, country):
+        key = self.key(spot_name, country)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                text = self._memory[key]
+                instrument.event("gemini", "advice", cache="hit")
+                return text
+        text = self.disk.get(key) if self.disk is not None else None
+        if text is not None:
+            self._remember(key, text)
+        return instrument.cache_result("gemini", "advice", text)
+
+    def set(self, spot_name, country, text):
+        key = self.key(spot_name, country)
+        self._remember(key, text)
+        if self.disk is not None:
+            self.disk.set(key, text, ADVICE_TTL)
+
+    def _remember(self, key, text):
+        with self._lock:
+            self._memory[key] = text
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory:
+                self._memory.popitem(last=False)
+
+
+def flight_key(spot_name, country):
+    return ("advice", spot_name, country, PROMPT_VERSION)
+
+
+def day_flight_key(spot_names, country):
+    # 同一組景點不管順序 (串流版會把 focus 排第一個) 都算同一個請求
+    return ("day_advice", tuple(sorted(spot_names)), country, PROMPT_VERSION)
+
+
+def get_advice(model, spot_name, country, cache=None):
+    if cache is not None:
+        text = cache.get(spot_name, country)
+        if text is not None:
+            return text
+    try:
+        text = singleflight.do(flight_key(spot_name, country), lambda: model.generate_content(advice_prompt(spot_name, country)).text)
+    except Exception as e:
+        # 失敗的結果不快取
+        return f"{FAILED_TEXT}：{e}"
+    if cache is not None:
+        cache.set(spot_name, country, text)
+    return text
+
+
+def _ask_day(model, spot_names, country):
+    response = model.generate_content(
+        day_advice_prompt(spot_names, country),
+        generation_config={"response_mime_type": "application/json"},
+    )
+    return json.loads(response.text)
+
+
+def get_day_advice(model, spot_names, country, cache=None):
+    # 一天的景點一次問完，回傳 {景點: 建議}；快取有的不再問，全部命中就 0 次呼叫
+    spot_names = list(dict.fromkeys(s for s in spot_names if s))
+    result = {}
+    if cache is not None:
+        for spot in spot_names:
+            text = cache.get(spot, country)
+            if text is not None:
+                result[spot] = text
+    missing = [s for s in spot_names if s not in result]
+    if not missing:
+        return result
+    if len(missing) == 1:
+        result[missing[0]] = get_advice(model, missing[0], country, cache)
+        return result
+
+    try:
+        answers = singleflight.do(day_flight_key(missing, country), _ask_day, model, missing, country)
+    except Exception as e:
+        for spot in missing:
+            result[spot] = f"{FAILED_TEXT}：{e}"
+        return result
+
+    for spot in missing:
+        text = answers.get(spot) if isinstance(answers, dict) else None
+        if isinstance(text, str) and text.strip():
+            result[spot] = text.strip()
+            if cache is not None:
+                cache.set(spot, country, result[spot])
+        else:
+            # 模型漏掉的景點再單獨問一次
+            result[spot] = get_advice(model, spot, country, cache)
+    return result
+
+
+# --- 串流版本：第一批文字一到就先顯示 ---
+# 回傳的 generator 每次 yield 新增的文字片段 (可以直接丟給 st.write_stream)。
+# 中途被關掉 (使用者換頁造成 rerun) 就不寫快取，下次重新問。
+# 別的 session 正在問同一件事時不另外開串流，等它問完直接顯示完整結果；
+# 它半途被關掉的話再自己問。
+
+def _wait_flight(flight):
+    # 回傳 (結果, 是否要自己重新問)
+    try:
+        return flight.wait(), False
+    except singleflight.Abandoned:
+        return None, True
+
+
+def stream_advice(model, spot_name, country, cache=None, cancelled=None):
+    if cache is not None:
+        text = cache.get(spot_name, country)
+        if text is not None:
+            yield text
+            return
+    key = flight_key(spot_name, country)
+    flight, leader = singleflight.join(key)
+    if not leader:
+        try:
+            text, retry = _wait_flight(flight)
+        except Exception as e:
+            yield f"{FAILED_TEXT}：{e}"
+            return
+        if not retry:
+            yield text
+            return
+        # 自己重新問，但不再跟別人共用 (避免兩邊互等)
+        flight = None
+
+    parts = []
+    result = error = None
+    try:
+        response = model.generate_content(advice_prompt(spot_name, country), stream=True)
+        for chunk in streaming.iter_text(response, cancelled):
+            parts.append(chunk)
+            yield chunk
+        if cancelled is None or not cancelled():
+            result = "".join(parts)
+    except Exception as e:
+        error = e
+        yield f"{FAILED_TEXT}：{e}"
+    finally:
+        if flight is not None:
+            if result is not None:
+                singleflight.finish(key, flight, result)
+            else:
+                # 被關掉 (沒有 error) 的話，等待中的人改成自己問
+                singleflight.finish(key, flight, error=error if error is not None else singleflight.Abandoned())
+    if cache is not None and result:
+        cache.set(spot_name, country, result)
+
+
+def stream_day_advice(model, spot_names, country, focus, cache=None, cancelled=None):
+    # 跟 get_day_advice 一樣一次問完整天，但把 focus 景點排第一個，
+    # 一邊收 JSON 一邊把 focus 的建議串流出來；收完後整天的結果寫進快取
+    if cache is not None:
+        text = cache.get(focus, country)
+        if text is not None:
+            yield text
+            return
+    spot_names = list(dict.fromkeys(s for s in spot_names if s))
+    missing = [focus] + [s for s in spot_names if s != focus and (cache is None or cache.get(s, country) is None)]
+    if len(missing) == 1:
+        yield from stream_advice(model, focus, country, cache, cancelled)
+        return
+
+    key = day_flight_key(missing, country)
+    flight, leader = singleflight.join(key)
+    if not leader:
+        try:
+            answers, retry = _wait_flight(flight)
+        except Exception as e:
+            yield f"{FAILED_TEXT}：{e}"
+            return
+        text = answers.get(focus) if isinstance(answers, dict) else None
+        if not retry and isinstance(text, str) and text.strip():
+            yield text.strip()
+            return
+        # leader 半途放棄或漏掉 focus：單獨問這一個景點
+        yield from stream_advice(model, focus, country, cache, cancelled)
+        return
+
+    shown = ""
+    buffer = ""
+    answers = error = None
+    try:
+        response = model.generate_content(
+            day_advice_prompt(missing, country),
+            generation_config={"response_mime_type": "application/json"},
+            stream=True,
+        )
+        for chunk in streaming.iter_text(response, cancelled):
+            buffer += chunk
+            fields, _ = streaming.parse_partial_object(buffer)
+            text = fields.get(focus)
+            if isinstance(text, str) and len(text) > len(shown):
+                yield text[len(shown):]
+                shown = text
+        fields, complete = streaming.parse_partial_object(buffer)
+        if complete:
+            answers = fields
+    except Exception as e:
+        error = e
+        if not shown:
+            yield f"{FAILED_TEXT}：{e}"
+    finally:
+        if answers is not None:
+            singleflight.finish(key, flight, answers)
+        else:
+            singleflight.finish(key, flight, error=error if error is not None else singleflight.Abandoned())
+
+    if answers is None:
+        return
+    if cache is not None:
+        for spot in missing:
+            text = answers.get(spot)
+            if isinstance(text, str) and text.strip():
+                cache.set(spot, country, text.strip())
+    if not shown:
+        # 模型漏掉 focus 景點就單獨再問一次
+        yield from stream_advice(model, focus, country, cache, cancelled)
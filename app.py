@@ -1,95 +1,83 @@
 import streamlit as st
-import gspread
 import pandas as pd
-from oauth2client.service_account import ServiceAccountCredentials
-import google.generativeai as genai
-import json
-from PIL import Image
-import requests
-
-# --- 1. 初始化 Google Sheets ---
-def init_gspread():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    creds_info = st.secrets["gcp_service_account"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_info, scope)
-    return gspread.authorize(creds)
-
-# --- 初始化 Gemini ---
-def init_gemini(api_key):
-    genai.configure(api_key=api_key)
-    # 嘗試使用最標準的名稱，如果 flash 不行，也可以試試 gemini-pro
-    return genai.GenerativeModel('models/gemini-2.5-flash')
-
-GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
-model = init_gemini(GEMINI_API_KEY)
-
-def get_ai_advice(spot_name, country):
-    prompt = f"我正在規劃去 {country} 旅遊，景點是 {spot_name}。請提供 50 字以內的簡短介紹與建議 像是一定要點那些餐點 看那些東西等等。"
+import uuid
+from datetime import datetime, timedelta
+from disk_cache import data_path
+import storage
+import archive
+import advice
+import clients
+import travel
+import itinerary
+import itinerary_io
+import intervals
+import bundle
+import expenses
+import receipts
+import route
+import booking
+import geo
+import instrument
+import scheduler
+import singleflight
+
+# 外部服務的 client 都在 clients.py 裡用 st.cache_resource 建立，每個 process 只做一次；
+# Gemini / PIL 等比較重的 SDK 第一次用到才載入
+def show_stream(chunks, placeholder):
+    # 一段一段更新同一個 st.info；使用者中途換頁時 Streamlit 會中斷這次執行，
+    # finally 會關掉 generator (連帶關掉 Gemini 串流)，不會在背景繼續讀
+    text = ""
     try:
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        return f"暫時無法獲取建議：{e}"
+        for chunk in chunks:
+            text += chunk
+            placeholder.info(text + " ▌")
+    finally:
+        chunks.close()
+    placeholder.info(text)
+    return text
 
 
 # 幣值映射表
 CURRENCY_MAP = {"日本 (Japan)": "JPY", "美國 (USA)": "USD", "韓國 (South Korea)": "KRW", "台灣 (Taiwan)": "TWD", "泰國 (Thailand)": "THB"}
+CURRENCIES = ["TWD", "JPY", "USD", "KRW", "THB", "EUR"]
 
-# AI 辨識收據功能
-def analyze_receipt(image_file):
-    if image_file:
-        model = genai.GenerativeModel('gemini-1.5-flash') # 使用 flash 處理圖片速度快且便宜
-        img = Image.open(image_file)
-        prompt = "請分析這張收據，並以 JSON 格式回傳：{'item': '項目名稱', 'amount': 數字金額, 'category': '交通/住宿/飲食/購物/其他'}"
-        response = model.generate_content([prompt, img])
-        # ... 解析 JSON 邏輯 (同先前解析航班) ...
-
-def get_travel_time(origin, destination, country):
-    GOOGLE_MAPS_API_KEY = st.secrets["GOOGLE_MAPS_API_KEY"]
-    
-    # 為了準確性，搜尋時加入國家名稱
-    origin_query = f"{country} {origin}"
-    dest_query = f"{country} {destination}"
-    
-    url = f"https://maps.googleapis.com/maps/api/distancematrix/json"
-    params = {
-        "origins": origin_query,
-        "destinations": dest_query,
-        "mode": "transit", # 設定為大眾運輸
-        "language": "zh-TW",
-        "key": GOOGLE_MAPS_API_KEY
-    }
-    
+# AI 辨識收據功能：先轉正、縮圖、壓縮再上傳，多張同時辨識，同一張照片不會重複辨識
+def analyze_receipts(uploaded_files):
+    files = [(f.name, f.getvalue()) for f in uploaded_files]
+    return receipts.analyze_receipts(clients.get_vision_model(), files, clients.get_receipt_cache())
+
+# 訂位確認信解析：先用正規表示式抓航班，需要時才用 Gemini (JSON 模式 + schema)；同樣的內容只解析一次
+# 串流時每收到一段就把目前拿到的欄位顯示在 placeholder 上
+def get_travel_meta_json(raw_text, travel_start, placeholder=None):
+    on_partial = placeholder.json if placeholder is not None else None
     try:
-        response = requests.get(url, params=params).json()
-        if response['status'] == 'OK':
-            element = response['rows'][0]['elements'][0]
-            if element['status'] == 'OK':
-                duration = element['duration']['text'] # 例如: "25 分鐘"
-                distance = element['distance']['text'] # 例如: "5.2 公里"
-                return f"{duration} ({distance})"
-        return "無法計算交通 (請檢查地點名稱)"
-    except:
-        return "計算超時"
-
-
-client = init_gspread()
+        return booking.parse_booking(clients.get_model(), raw_text, travel_start, clients.get_booking_cache(), on_partial)
+    except Exception as e:
+        st.error(f"AI 解析出錯：{e}")
+        return None
+
+def get_travel_meta_batch(raw_texts, travel_start):
+    # 多筆訂位一次解析 (最多一次 Gemini 呼叫)
+    try:
+        return booking.parse_bookings(clients.get_model(), raw_texts, travel_start, clients.get_booking_cache())
+    except Exception as e:
+        st.error(f"AI 解析出錯：{e}")
+        return [None] * len(raw_texts)
+
 SHEET_ID = "19xCUkRCOw5gdTPNPNWyhX2KOz88JjjmT1Nl3EFHLMIw" 
-spreadsheet = client.open_by_key(SHEET_ID)
 
-try:
-    index_ws = spreadsheet.worksheet("Index")
-except:
-    # 這裡定義你要求的所有結構化欄位
-    headers = [
-        "名稱", "開始日期", "結束日期", "國家", 
-        "航班號", "出發機場", "出發時間", "抵達機場", "抵達時間",
-        "酒店名稱", "酒店地址", "入住日期", "退房日期"
-    ]
-    index_ws = spreadsheet.add_worksheet(title="Index", rows="100", cols=len(headers))
-    index_ws.append_row(headers)
+# 這次 rerun 的編號：之後所有 Sheets / Maps / Gemini 呼叫都記在這個編號底下 (側邊欄除錯面板)
+rerun_id = instrument.begin_rerun()
 
-# @st.cache_data(ttl=3600)
+# 所有讀寫都走本機 store，背景 worker 負責跟 Google Sheets 同步
+store = clients.get_store(SHEET_ID)
+sync_start_error = None
+try:
+    sync = clients.get_sync_worker(SHEET_ID)
+except Exception as e:
+    # 連不上 Google (例如沒網路) 也能用本機資料繼續看
+    sync = None
+    sync_start_error = e
 
 
 # 國家建議清單
@@ -206,8 +194,8 @@ section[data-testid="stSidebar"] p {
 with st.sidebar:
     st.title("🗂️ 旅程管理")
     
-    # 功能 1: 顯示所有歷史旅程 (排除預設的 Sheet1)
-    all_sheets = [s.title for s in spreadsheet.worksheets() if s.title != "Sheet1"]
+    # 功能 1: 顯示所有歷史旅程 (來自 Index 表)
+    all_sheets = store.list_trips()
     
     st.subheader("📜 歷史旅程")
     if all_sheets:
@@ -217,6 +205,21 @@ with st.sidebar:
         st.info("尚無存檔旅程")
         selected_trip = None
 
+    # 結束日期已經過了的旅程：封存成本機 Parquet 檔並從試算表移除，旅程列表與同步都不用再帶著它們
+    finished_trips = archive.finished_trips(store)
+    if finished_trips:
+        with st.expander(f"📦 封存已結束的旅程（{len(finished_trips)}）"):
+            to_archive = st.multiselect("要封存的旅程", finished_trips, default=finished_trips)
+            st.caption("封存後會從 Google 試算表刪除，之後在「🗄️ 封存的旅程」查看")
+            if st.button("確認封存", disabled=not to_archive):
+                with st.spinner("封存中..."):
+                    try:
+                        archive.archive_trips(store, to_archive, sync)
+                    except archive.ArchiveError as e:
+                        st.error(str(e))
+                    else:
+                        st.rerun()
+
     st.divider()
 
     # 功能 2: 建立新旅程 (唯一可以編輯日期與國家的地方)
@@ -231,13 +234,9 @@ with st.sidebar:
         new_country = st.selectbox("選擇國家", options=country_list)
         total_days = (new_end - new_start).days + 1
         if st.button("確認建立新旅程"):
-            if new_name and new_name not in all_sheets:
-                new_ws = spreadsheet.add_worksheet(title=new_name, rows="100", cols="6")
-                # 標題要跟後面的 df 呼叫名稱完全一致
-                new_ws.append_row(["日期", "開始時間", "結束時間", "活動", "地圖連結", "備註"]) 
-
-                # Index 表紀錄
-                index_ws.append_row([new_name, str(new_start), str(new_end), new_country, "", ""])
+            if new_name and new_name not in all_sheets and not store.has_sheet(new_name):
+                # 建立行程表 + Index 表紀錄 (背景同步時會合併成一次寫入)
+                store.create_trip(new_name, new_start, new_end, new_country)
                 st.success(f"✅ {new_name} 已建立！")
                 st.rerun()
             else:
@@ -246,22 +245,21 @@ with st.sidebar:
 # --- 4. 主畫面: 詳細行程規劃 (Itinerary) ---
 if selected_trip:
         
-    current_sheet = spreadsheet.worksheet(selected_trip)
+    # 第一次打開這個旅程時先把遠端資料同步下來 (旅行模式只看離線包，不等網路)
+    if sync is not None and not st.session_state.get(f"travel_mode_{selected_trip}"):
+        try:
+            sync.ensure(selected_trip, storage.expense_sheet(selected_trip))
+        except Exception as e:
+            sync.last_error = e
+
     # 1. 抓取 Index 表中的基本資訊
-    index_all = index_ws.get_all_values()
-    index_df = pd.DataFrame(index_all[1:], columns=index_all[0])
-    
-    # 找到對應那一列的資料
-    this_trip_info = index_df[index_df["名稱"] == selected_trip]
-    if not this_trip_info.empty:
-        basic_data = this_trip_info.iloc[0].tolist()
-    else:
+    basic_data = store.get_trip(selected_trip)
+    if basic_data is None:
         st.error("找不到該旅程的基本資訊")
         st.stop()
 
     # 2. 進行日期運算 (basic_data[1]是開始, basic_data[2]是結束)
     # 注意：Index 表的順序是 [名稱, 開始, 結束, 國家, 航班, 酒店]
-    from datetime import datetime, timedelta
     start_date_str = basic_data[1]
     end_date_str = basic_data[2]
     country_name = basic_data[3]
@@ -274,7 +272,7 @@ if selected_trip:
     st.info(f"📅 期間：{basic_data[1]} ~ {basic_data[2]} | 🌍 國家/天數：{basic_data[3]}/ {duration}天")
 
     @st.dialog("✈️ 編輯航班資訊")
-    def edit_flights(trip_sheet):
+    def edit_flights(trip_name):
         with st.form("flight_form", clear_on_submit=True):
             st.subheader("新增一段航班")
             f_no = st.text_input("航班號 (例如: BR198)")
@@ -290,16 +288,16 @@ if selected_trip:
             if st.form_submit_button("確認新增航班"):
                 if f_no and f_dep_t:
                     # 直接寫入該旅程的行程表
-                    trip_sheet.append_row([
+                    store.append_items(trip_name, [[
                         f_date, f_dep_t, f_arr_t, 
                         f"✈️ 航班: {f_no} ({f_dep} 🛫 {f_arr})", 
                         "", "航班資訊"
-                    ])
+                    ]])
                     st.success("✅ 航班已加入行程！")
                     st.rerun() # 跳回主畫面
 
     @st.dialog("🏨 編輯飯店資訊")
-    def edit_hotels(trip_sheet):
+    def edit_hotels(trip_name):
         with st.form("hotel_form", clear_on_submit=True):
             st.subheader("新增飯店入住紀錄")
             h_name = st.text_input("飯店名稱")
@@ -311,11 +309,11 @@ if selected_trip:
                 h_out = st.date_input("退房日期")
             
             if st.form_submit_button("確認儲存飯店"):
-                # 將飯店資訊存入行程
-                # 入住日
-                trip_sheet.append_row([str(h_in), "15:00", "23:59", f"🏨 入住: {h_name}", "", h_addr])
-                # 退房日
-                trip_sheet.append_row([str(h_out), "00:00", "11:00", f"🔑 退房: {h_name}", "", ""])
+                # 將飯店資訊存入行程 (入住日 + 退房日一次寫入)
+                store.append_items(trip_name, [
+                    [str(h_in), "15:00", "23:59", f"🏨 入住: {h_name}", "", h_addr],
+                    [str(h_out), "00:00", "11:00", f"🔑 退房: {h_name}", "", ""],
+                ])
                 st.success("✅ 飯店資訊已儲存！")
                 st.rerun()
 
@@ -374,76 +372,137 @@ if selected_trip:
         #         st.rerun()
 
 
-    st.title(f"📍 {selected_trip}")
-    # 5. 在主頁面放置按鈕
-    c1, c2, c3 = st.columns(3)
-    with c1:
-        if st.button("✈️ 加航班", use_container_width=True):
-            edit_flights(current_sheet)
-    with c2:
-        if st.button("🏨 加飯店", use_container_width=True):
-            edit_hotels(current_sheet)
-    with c3:
-        if st.button("💵 記帳", use_container_width=True, type="primary"):
-            add_expense_dialog(selected_trip, country_name)
+    @st.dialog("🧾 貼上訂位確認信", width="large")
+    def import_bookings_dialog(trip_name):
+        st.caption("航班或飯店的確認信都可以，一次貼好幾筆時每筆之間用一行 --- 隔開")
+        raw = st.text_area("訂位內容", height=200, key="booking_raw")
+        if st.button("🔍 解析", use_container_width=True):
+            texts = booking.split_bookings(raw)
+            if len(texts) == 1:
+                # 只有一筆：串流顯示解析進度
+                metas = [get_travel_meta_json(texts[0], basic_data[1], st.empty())]
+            else:
+                # 好幾筆：合併成一次 Gemini 呼叫
+                with st.spinner(f"解析 {len(texts)} 筆訂位中..."):
+                    metas = get_travel_meta_batch(texts, basic_data[1])
+            st.session_state.booking_rows = [r for meta in metas for r in booking.to_items(meta, basic_data[1])]
+            if texts and not st.session_state.booking_rows:
+                st.warning("沒有解析出航班或飯店資訊")
+        rows = st.session_state.get("booking_rows")
+        if rows:
+            st.caption("確認內容 (航班日期預設為出發日，可以直接修改)")
+            edited = st.data_editor(pd.DataFrame(rows, columns=storage.ITEM_HEADERS), hide_index=True, num_rows="dynamic", use_container_width=True)
+            if st.button("✅ 加入行程", type="primary", use_container_width=True):
+                store.append_items(trip_name, edited.fillna("").astype(str).values.tolist())
+                del st.session_state.booking_rows
+                st.success(f"✅ 已加入 {len(edited)} 筆！")
+                st.rerun()
 
-    
     @st.dialog("💰 新增花費")
     def add_expense_dialog(trip_name, country):
-        expense_ws_name = f"{trip_name}_Expenses"
-        
-        # 檢查或建立記帳表
-        try:
-            exp_ws = spreadsheet.worksheet(expense_ws_name)
-        except:
-            exp_ws = spreadsheet.add_worksheet(title=expense_ws_name, rows="100", cols="5")
-            exp_ws.append_row(["款項敘述", "類別", "花費", "幣值", "日期"])
+        # 根據國家預設幣值；日期預設今天 (旅程中) 或出發日
+        default_curr = CURRENCY_MAP.get(country, "TWD")
+        today = datetime.now().strftime("%Y-%m-%d")
+        default_day = date_range.index(today) if today in date_range else 0
+
+        # 第一區：收據 (可以一次上傳多張，AI 辨識後核對再整批記帳)
+        uploaded_files = st.file_uploader("📸 上傳收據/發票 (可多張，AI 自動填入)", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True)
+        if uploaded_files and st.button("🤖 AI 辨識收據", use_container_width=True):
+            with st.spinner("辨識中..."):
+                st.session_state.receipt_results = analyze_receipts(uploaded_files)
+
+        receipt_results = st.session_state.get("receipt_results")
+        if receipt_results:
+            for r in receipt_results:
+                if r["error"]:
+                    st.warning(f"{r['name']}：{r['error']}")
+            ok_rows = [r for r in receipt_results if not r["error"]]
+            if ok_rows:
+                edited = st.data_editor(
+                    pd.DataFrame(ok_rows)[["item", "amount", "category"]],
+                    column_config={
+                        "item": st.column_config.TextColumn("款項敘述"),
+                        "amount": st.column_config.NumberColumn("花費", min_value=0.0),
+                        "category": st.column_config.SelectboxColumn("類別", options=receipts.CATEGORIES),
+                    },
+                    hide_index=True,
+                    key="receipt_editor",
+                )
+                r_curr = st.selectbox("收據幣值", CURRENCIES, index=CURRENCIES.index(default_curr), key="receipt_curr")
+                r_date = st.selectbox("收據日期", options=date_range, index=default_day, key="receipt_date")
+                if st.button("✅ 全部記帳", use_container_width=True, type="primary"):
+                    store.append_expenses(trip_name, [
+                        [r["item"], r["category"], float(r["amount"]), r_curr, r_date]
+                        for r in pd.DataFrame(edited).to_dict("records")
+                    ])
+                    del st.session_state.receipt_results
+                    st.success(f"✅ 已記錄 {len(edited)} 筆！")
+                    st.rerun()
+        st.divider()
 
+        # 第二區：手動輸入
         with st.form("expense_form"):
-            uploaded_file = st.file_uploader("📸 上傳收據/發票 (AI 自動填入)", type=['png', 'jpg', 'jpeg'])
-            # 這裡可加入 AI 解析邏輯...
-            
             desc = st.text_input("款項敘述")
             cat = st.selectbox("類別", ["交通", "住宿", "飲食", "購物", "其他"])
             amount = st.number_input("輸入花費", min_value=0.0)
-            submitted = st.form_submit_button("確認新增")
             
-            # 根據國家預設幣值
-            default_curr = CURRENCY_MAP.get(country, "TWD")
-            curr = st.selectbox("選擇幣值", ["TWD", "JPY", "USD", "KRW", "THB", "EUR"], index=["TWD", "JPY", "USD", "KRW", "THB", "EUR"].index(default_curr))
+            curr = st.selectbox("選擇幣值", CURRENCIES, index=CURRENCIES.index(default_curr))
+            spend_date = st.selectbox("日期", options=date_range, index=default_day)
+            submitted = st.form_submit_button("確認新增")
             
             if submitted:
                 if desc and amount > 0:
-                    # 執行寫入 Google Sheets 的動作
-                    exp_ws.append_row([desc, "類別", amount, "幣值", "日期"])
+                    # 記帳表不存在的話同步時會自動建立
+                    store.append_expenses(trip_name, [[desc, cat, amount, curr, spend_date]])
                     st.success("✅ 已記錄！")
                     st.rerun()
                 else:
                     st.error("請填寫完整資訊")
 
+    st.title(f"📍 {selected_trip}")
+    # 5. 在主頁面放置按鈕
+    c1, c2, c3, c4 = st.columns(4)
+    with c1:
+        if st.button("✈️ 加航班", use_container_width=True):
+            edit_flights(selected_trip)
+    with c2:
+        if st.button("🏨 加飯店", use_container_width=True):
+            edit_hotels(selected_trip)
+    with c3:
+        if st.button("🧾 貼訂位", use_container_width=True):
+            import_bookings_dialog(selected_trip)
+    with c4:
+        if st.button("💵 記帳", use_container_width=True, type="primary"):
+            add_expense_dialog(selected_trip, country_name)
+
     def show_expense_summary(trip_name):
-        expense_ws_name = f"{trip_name}_Expenses"
-        try:
-            exp_ws = spreadsheet.worksheet(expense_ws_name)
-            data = exp_ws.get_all_values()
-            if len(data) > 1:
-                df_exp = pd.DataFrame(data[1:], columns=data[0])
-                df_exp["花費"] = pd.to_numeric(df_exp["花費"], errors='coerce')
-                
-                total_cost = df_exp["花費"].sum()
-                
-                st.metric("💰 旅程總花費", f"{total_cost:,.0f}")
-                
-                # 顯示各類別佔比
-                cat_sum = df_exp.groupby("類別")["花費"].sum()
-                cols = st.columns(len(cat_sum))
-                for idx, (cat, val) in enumerate(cat_sum.items()):
+        if not store.has_sheet(storage.expense_sheet(trip_name)):
+            st.caption("尚未建立記帳本")
+            return
+        # 帳本只在有新增時加上新的那幾筆，不同幣值透過匯率表換成台幣後再加總
+        ledger = expenses.get_ledger(store, trip_name, clients.get_fx_table())
+        if ledger.count:
+            total_cost = ledger.total_home
+            
+            st.metric(f"💰 旅程總花費 ({ledger.home})", f"{total_cost:,.0f}")
+            # 各幣值原始金額
+            st.caption(" · ".join(f"{curr} {val:,.0f}" for curr, val in ledger.by_currency.items()))
+            if ledger.unconverted:
+                st.caption(f"⚠️ 匯率表沒有這些幣值，未計入總額：{', '.join(ledger.unconverted)}")
+            
+            # 顯示各類別佔比
+            if total_cost > 0:
+                cols = st.columns(len(ledger.by_category))
+                for idx, (cat, val) in enumerate(ledger.by_category.items()):
                     percent = (val / total_cost) * 100
                     cols[idx].caption(f"**{cat}**\n{percent:.0f}%")
-            else:
-                st.caption("尚無消費記錄")
-        except:
-            st.caption("尚未建立記帳本")
+
+            # 每日花費
+            daily = ledger.daily_series()
+            if not daily.empty:
+                st.bar_chart(daily)
+        else:
+            st.caption("尚無消費記錄")
 
     
 
@@ -451,65 +510,201 @@ if selected_trip:
     show_expense_summary(selected_trip)
 
     st.subheader("📅 行程詳情")
-    all_values = current_sheet.get_all_values()
-    if len(all_values) > 1:
-        df = pd.DataFrame(all_values[1:], columns=["日期", "開始時間", "結束時間", "活動", "地圖連結", "備註"])
-    else:
-        df = pd.DataFrame(columns=["日期", "開始時間", "結束時間", "活動", "地圖連結", "備註"])
-
-    tabs = st.tabs([f"Day {i+1} ({d})" for i, d in enumerate(date_range)])
-
-    for i, date_str in enumerate(date_range):
-        with tabs[i]:
-            day_items = df[df["日期"] == date_str].copy()
-            # st.caption(f"📍 本日住宿：{get_today_hotel(date_str, items_list)}")
-       
-            if not day_items.empty:
-                # 確保時間格式正確並排序
-                day_items['temp_time'] = pd.to_datetime(day_items['開始時間'], format='%H:%M', errors='coerce')
-                day_items = day_items.sort_values(by='temp_time')
-                items_list = day_items.to_dict('records')
+    # 整張行程表一次整理好 (解析時間、排序、分天、相鄰路線)，資料沒變就直接重用
+    trip_plan = itinerary.get_itinerary(store, selected_trip)
+    # 住宿 / 航班 / 有時間的行程的區間索引：查今晚住哪、哪些行程撞時間 (新增列時只插入新的區間)
+    schedule = intervals.get_schedule(store, selected_trip)
+
+    def get_today_hotel(date_str):
+        return "、".join(schedule.hotels_on(date_str)) or "尚未設定"
+
+    # 路線在背景並行查詢；換了旅程就取消上一趟還沒開始的查詢
+    travel_client = clients.get_travel_client()
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    geocoder = clients.get_geocoder(SHEET_ID)
+    travel_owner = (st.session_state.session_id, selected_trip)
+    previous_owner = st.session_state.get("travel_owner")
+    if previous_owner and previous_owner != travel_owner:
+        travel_client.cancel(previous_owner)
+    st.session_state.travel_owner = travel_owner
+
+    # --- 準備出發：整趟旅程先算好存成離線包，旅行模式只讀離線包 ---
+    def fetch_bundle_legs(pairs):
+        near = {} if st.session_state.get("precise_transit") else geo.near_legs(pairs, geocoder.coords([n for p in pairs for n in p], country_name))
+        legs = travel_client.legs([p for p in pairs if p not in near], country_name, timeout=60.0, owner=travel_owner)
+        legs.update({p: geo.estimate_text(km) for p, km in near.items()})
+        return legs
+
+    def fetch_bundle_advice(spot_names):
+        return advice.get_day_advice(clients.get_model(), spot_names, country_name, clients.get_advice_cache())
+
+    trip_bundle = bundle.load(selected_trip)
+    m1, m2 = st.columns([2, 1])
+    with m2:
+        if st.button("📦 準備出發", use_container_width=True, help="先把交通、AI 建議、記帳統計打包好，路上網路不好也能看"):
+            with st.spinner("打包整趟旅程中（只查有變動的部分）…"):
+                ledger = expenses.get_ledger(store, selected_trip, clients.get_fx_table()) if store.has_sheet(storage.expense_sheet(selected_trip)) else None
+                trip_bundle, seconds = bundle.prepare(
+                    selected_trip, country_name, store.get_items_with_ids(selected_trip),
+                    fetch_bundle_legs, fetch_bundle_advice, bundle.expense_summary(ledger) if ledger else None,
+                )
+            stats = trip_bundle.stats
+            st.success(f"✅ 已打包（{seconds:.1f} 秒；變動 {stats['rows_changed']} 列，查了 {stats['legs_fetched']} 段交通、{stats['advice_fetched']} 個景點）")
+    with m1:
+        travel_mode = st.toggle("🧳 旅行模式（只讀離線包，不連網路）", key=f"travel_mode_{selected_trip}", disabled=trip_bundle is None)
+    if trip_bundle is not None:
+        changed = trip_bundle.changes(store.get_items(selected_trip))
+        st.caption(
+            f"📦 離線包第 {trip_bundle.revision} 版（{trip_bundle.built_at}，{trip_bundle.size / 1024:.0f} KB）"
+            + (f"｜之後有 {changed} 列行程變動，再按一次「準備出發」更新" if changed else "")
+        )
+    offline = trip_bundle if travel_mode else None
+
+    # 只建立使用者正在看的那一天 (st.fragment：切換天數、按 AI 建議都只重跑這一塊)
+    @st.fragment
+    def render_card(row, idx, date_str, items_list):
+        # 使用 container 建立彩色活動塊
+        # 這裡可以根據活動類型手動加上不同顏色（進階功能）
+        with st.container(border=True):
+            # 第一行：活動名稱與連結
+            st.markdown(f"#### 📍 {row['活動']}")
+            
+            # 第二行：備註與 AI 建議
+            if row['備註']:
+                st.markdown(f"*{row['備註']}*")
+
+            overlaps = schedule.conflicts(row['row_id'])
+            if overlaps:
+                st.warning("⚠️ 時間重疊：" + "、".join(
+                    f"{schedule.rows[k][0]} {schedule.rows[k][1]} {schedule.rows[k][3]}" for k in overlaps
+                ))
+            
+            # 按鈕列
+            btn_col1, btn_col2 = st.columns([1, 1])
+            with btn_col1:
+                st.link_button("🗺️ 地圖導航", row['地圖連結'], use_container_width=True)
+            with btn_col2:
+                if offline is not None:
+                    # 旅行模式：建議已經在離線包裡
+                    tip = offline.advice(row['活動'])
+                    if tip:
+                        st.caption(f"✨ {tip}")
+                elif st.button("✨ AI 建議", key=f"ai_btn_{date_str}_{idx}", use_container_width=True):
+                    # 整天一次問，但這張卡片的建議排第一個、邊收邊顯示
+                    show_stream(
+                        advice.stream_day_advice(clients.get_model(), [r['活動'] for r in items_list], country_name, row['活動'], clients.get_advice_cache()),
+                        st.empty(),
+                    )
+
+    @st.fragment
+    def render_day_view():
+        day_labels = {d: f"Day {i+1} ({d})" for i, d in enumerate(date_range)}
+        date_str = st.radio("選擇天數", date_range, format_func=day_labels.get, horizontal=True,
+                            key=f"day_{selected_trip}", label_visibility="collapsed")
+        day_index = date_range.index(date_str)
+
+        if offline is not None:
+            # 旅行模式：行程與交通都從離線包拿，不呼叫任何外部服務
+            items_list = offline.items(date_str)
+            day_legs = offline.legs(date_str)
+        else:
+            # 有座標的地點先用直線距離估算 (整趟旅程一次算完)，很近的路段直接顯示估計的步行時間，不查 Maps
+            precise = st.toggle("🚆 精確交通資訊（每一段都查 Google Maps）", key="precise_transit")
+            near = {} if precise else geo.near_legs(trip_plan.all_pairs(), geocoder.coords(trip_plan.df["活動"], country_name))
+
+            # 前後一天的路線丟到背景查，切換到隔壁天時通常已經在快取裡
+            # (這一天自己的路線由下面的 legs 用前景優先順序查，不跟背景工作排隊)
+            nearby = [d for d in date_range[max(0, day_index - 1):day_index + 2] if d != date_str]
+            travel_client.prefetch([p for d in nearby for p in trip_plan.pairs(d) if p not in near], country_name, owner=travel_owner)
+
+            items_list = trip_plan.items(date_str)
+            # 只等這一天要顯示的路線，最多等幾秒
+            day_pairs = trip_plan.pairs(date_str)
+            day_legs = travel_client.legs([p for p in day_pairs if p not in near], country_name, timeout=4.0, owner=travel_owner)
+            day_legs.update({p: geo.estimate_text(near[p]) for p in day_pairs if p in near})
+        if len(schedule.stays):
+            st.caption(f"📍 本日住宿：{get_today_hotel(date_str)}")
+
+        if items_list:
+            for idx, row in enumerate(items_list):
+                # 建立行事曆風格的佈局
+                # 左邊 col1 放時間軸，右邊 col2 放活動內容
+                col1, col2 = st.columns([1, 4])
+                
+                with col1:
+                    # 顯示開始與結束時間，並加粗
+                    st.markdown(f"**{row['開始時間']}**")
+                    st.markdown(f"至 {row['結束時間']}")
+                    # 視覺上的時間軸線
+                    st.markdown("---")
                 
-                for idx, row in enumerate(items_list):
-                    # 建立行事曆風格的佈局
-                    # 左邊 col1 放時間軸，右邊 col2 放活動內容
-                    col1, col2 = st.columns([1, 4])
-                    
-                    with col1:
-                        # 顯示開始與結束時間，並加粗
-                        st.markdown(f"**{row['開始時間']}**")
-                        st.markdown(f"至 {row['結束時間']}")
-                        # 視覺上的時間軸線
-                        st.markdown("---")
-                    
-                    with col2:
-                        # 使用 container 建立彩色活動塊
-                        # 這裡可以根據活動類型手動加上不同顏色（進階功能）
-                        with st.container(border=True):
-                            # 第一行：活動名稱與連結
-                            st.markdown(f"#### 📍 {row['活動']}")
-                            
-                            # 第二行：備註與 AI 建議
-                            if row['備註']:
-                                st.markdown(f"*{row['備註']}*")
-                            
-                            # 按鈕列
-                            btn_col1, btn_col2 = st.columns([1, 1])
-                            with btn_col1:
-                                st.link_button("🗺️ 地圖導航", row['地圖連結'], use_container_width=True)
-                            with btn_col2:
-                                if st.button("✨ AI 建議", key=f"ai_btn_{date_str}_{idx}", use_container_width=True):
-                                    advice = get_ai_advice(row['活動'], country_name)
-                                    st.info(advice)
-
-                    # 交通接駁資訊（顯示在兩個活動卡片之間）
-                    if idx < len(items_list) - 1:
-                        next_row = items_list[idx+1]
-                        travel_info = get_travel_time(row['活動'], next_row['活動'], country_name)
-                        # 模擬行事曆中的交通小圖示
-                        st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp; 🚌 <small>{travel_info}</small>", unsafe_allow_html=True)
+                with col2:
+                    render_card(row, idx, date_str, items_list)
+
+                # 交通接駁資訊（顯示在兩個活動卡片之間）
+                if idx < len(items_list) - 1:
+                    next_row = items_list[idx+1]
+                    travel_info = day_legs.get((row['活動'], next_row['活動']), travel.UNKNOWN_ROUTE)
+                    # 模擬行事曆中的交通小圖示
+                    st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp; 🚌 <small>{travel_info}</small>", unsafe_allow_html=True)
+            if offline is None and len(items_list) >= 3 and st.button("🧭 最佳化這一天的順序", key=f"optimize_{date_str}", use_container_width=True):
+                optimize_day_dialog(date_str)
+        else:
+            st.info("📅 這天還沒有安排行程，點擊下方「添加新景點」開始規劃！")
+
+    @st.dialog("🧭 最佳化這一天的順序", width="large")
+    def optimize_day_dialog(date_str):
+        items_list = trip_plan.items(date_str)
+        fixed = st.multiselect(
+            "固定時間的行程（航班、飯店、預約，不會被移動）",
+            options=list(range(len(items_list))),
+            default=[i for i, r in enumerate(items_list) if route.is_fixed(r)],
+            format_func=lambda i: f"{items_list[i]['開始時間']} {items_list[i]['活動']}",
+        )
+        # 一次查整天兩兩之間的交通時間 (快取有的不再查)，再用啟發式演算法排順序
+        # 很近的兩點用估計的步行時間，不算進 Distance Matrix 的 elements
+        places = [route.place_of(r) for r in items_list]
+        known = {}
+        if not st.session_state.get("precise_transit"):
+            pairs = [(o, d) for o in places for d in places if o != d]
+            known = {p: geo.walking_minutes(km) * 60 for p, km in geo.near_legs(pairs, geocoder.coords(places, country_name)).items()}
+        with st.spinner("查詢交通時間中…"):
+            travel_times = travel_client.durations(places, country_name, known=known)
+        result = route.optimize_day(items_list, travel_times, set(fixed))
+        st.caption(f"🚌 交通時間：{result['travel_before']} 分鐘 → {result['travel_after']} 分鐘（計算 {result['ms']:.0f} ms）")
+        if result["unknown"]:
+            st.caption(f"⚠️ 有 {result['unknown']} 段查不到交通時間，先以 {route.UNKNOWN_TRAVEL} 分鐘估算")
+        if result["late_after"]:
+            st.warning(f"照新順序走，固定行程總共會遲到約 {result['late_after']} 分鐘")
+        if result["overflow"]:
+            names = "、".join(items_list[i]["活動"] for i in result["overflow"])
+            st.warning(f"照新順序走，這些行程會排到半夜之後（時間先停在 23:59）：{names}")
+
+        updates = route.reordered_rows(items_list, result, date_str)
+        if not updates:
+            st.success("目前的順序已經是最好的了！")
+            return
+        preview = []
+        for i in result["order"]:
+            row = items_list[i]
+            if i in result["times"]:
+                start, end = result["times"][i]
+                when = f"{route.hhmm(start)} ~ {route.hhmm(end)}"
             else:
-                st.info("📅 這天還沒有安排行程，點擊下方「添加新景點」開始規劃！")
+                when = f"{row['開始時間']} ~ {row['結束時間']}"
+            preview.append({
+                "時間": when,
+                "活動": row["活動"],
+                "": "📌 固定" if i in fixed else "",
+            })
+        st.dataframe(pd.DataFrame(preview), hide_index=True, use_container_width=True)
+        if st.button("✅ 套用新順序", type="primary", use_container_width=True):
+            # 所有變動的列一起改，背景同步時合併成一次 batch_update
+            store.update_items(selected_trip, updates)
+            st.rerun()
+
+    render_day_view()
 
     # for date_str in date_range:
     #     with st.expander(f"📅 {date_str}", expanded=True):
@@ -558,50 +753,116 @@ if selected_trip:
             n = st.text_area("備註")
             map_url = st.text_input("地圖連結 ", placeholder="https://maps.google.com/...") 
             if not map_url:
-                import urllib.parse
-                map_url = f"https://www.google.com/maps/search/?api=1&query={urllib.parse.quote(f'{country_name} {s}')}"
+                map_url = itinerary_io.map_url(country_name, s)
             
             if st.form_submit_button("確認新增"):
                 if d and t_start and s:
-                    current_sheet.append_row([d, t_start, t_end, s, map_url, n])
+                    store.append_items(selected_trip, [[d, t_start, t_end, s, map_url, n]])
                     st.success("已加入行程！")
                     st.rerun()
                 else:
                     st.error("請至少填寫開始時間與景點名稱")
     
-    if st.button("➕ 添加新景點", use_container_width=True):
-      add_item_dialog()
+    @st.dialog("📥 匯入行程 (ICS / CSV)")
+    def import_items_dialog():
+        uploaded = st.file_uploader("行事曆 (.ics) 或表格 (.csv)", type=["ics", "csv"])
+        st.caption("CSV 需要表頭：日期、開始時間、結束時間、活動、地圖連結、備註 (也接受 date / start / end / name / url / notes)")
+        if uploaded is None:
+            return
+        # 邊讀邊檢查；日期要在旅程期間內，已經有的同名同時間項目會略過
+        rows, errors, duplicates = itinerary_io.parse_import(
+            uploaded, uploaded.name, country_name, date_range, existing=store.get_items(selected_trip),
+        )
+        for line, message in errors:
+            st.warning(f"第 {line} 行：{message}")
+        if duplicates:
+            st.caption(f"已經在行程裡的 {duplicates} 筆會略過")
+        if not rows:
+            st.info("沒有可以匯入的項目")
+            return
+        st.dataframe(pd.DataFrame(rows, columns=storage.ITEM_HEADERS)[["日期", "開始時間", "結束時間", "活動"]], hide_index=True)
+        if st.button(f"✅ 匯入 {len(rows)} 筆", type="primary", use_container_width=True):
+            # 整批加入，背景同步時一次寫進試算表
+            store.append_items(selected_trip, rows)
+            st.rerun()
+
+    b1, b2 = st.columns([3, 1])
+    with b1:
+        if st.button("➕ 添加新景點", use_container_width=True):
+            add_item_dialog()
+    with b2:
+        if st.button("📥 匯入", use_container_width=True):
+            import_items_dialog()
+
+    # 匯出：按下去才一段一段產生檔案 (不在每次 rerun 組整份行事曆)
+    def export_ics():
+        return itinerary_io.spool(itinerary_io.export_ics(selected_trip, trip_plan.df[storage.ITEM_HEADERS].itertuples(index=False)))
+
+    def export_csv():
+        return itinerary_io.spool(itinerary_io.export_csv(trip_plan.df[storage.ITEM_HEADERS].itertuples(index=False)), bom=True)
+
+    with st.expander("📤 匯出行程"):
+        e1, e2 = st.columns(2)
+        e1.download_button("📅 行事曆 (.ics)", export_ics, file_name=f"{selected_trip}.ics", mime="text/calendar", use_container_width=True)
+        e2.download_button("📄 表格 (.csv)", export_csv, file_name=f"{selected_trip}.csv", mime="text/csv", use_container_width=True)
 
 
 with st.sidebar:
     st.divider()
-    
-    def get_travel_meta_json(raw_text, travel_start):
-        
-        prompt = f"""
-        請分析以下旅遊資訊（包含航班或酒店）並轉換為結構化 JSON。
-        參考開始日期：{travel_start}
-        輸入內容：{raw_text}
-        
-        請嚴格遵守以下 JSON 格式：
-        {{
-            "航班號": "...", "出發機場": "...", "出發時間": "HH:MM", 
-            "抵達機場": "...", "抵達時間": "HH:MM",
-            "酒店名稱": "...", "酒店地址": "...", "入住日期": "YYYY-MM-DD", "退房日期": "YYYY-MM-DD"
-        }}
-        如果資訊中沒有提到某項，請填入空字串 ""。請直接輸出純 JSON 字串。
-        """
-        try:
-            response = model.generate_content(prompt)
-            clean_text = response.text.replace('```json', '').replace('```', '').strip()
-            return json.loads(clean_text)
-        except Exception as e:
-            st.error(f"AI 解析出錯：{e}")
-            return None
-    
-        
-
-
-
-
-
+    # 同步狀態：畫面讀的是本機資料，這裡顯示跟 Google Sheets 的同步情況
+    if sync is None:
+        st.caption(f"📴 離線模式：資料先存在本機{f'（{sync_start_error}）' if sync_start_error else ''}")
+    elif sync.last_error is not None:
+        st.caption(f"⚠️ 同步失敗，稍後自動重試：{sync.last_error}")
+    elif sync.last_sync:
+        st.caption(f"🔄 上次同步：{datetime.fromtimestamp(sync.last_sync):%H:%M:%S}")
+    for conflict in store.unseen_conflicts():
+        st.warning(f"「{conflict['sheet']}」第 {conflict['position'] + 2} 列同時被別人修改，已採用試算表上的版本（你的版本：{' / '.join(map(str, conflict['local']))}）")
+    # 交通快取命中率：每次命中就省下一個 Distance Matrix element 的費用
+    travel_stats = clients.get_travel_cache().stats()
+    st.caption(f"🚌 交通快取：命中 {travel_stats['hits']} / 未命中 {travel_stats['misses']}（共 {travel_stats['size']} 筆）")
+
+
+
+# --- 封存的旅程：直接讀本機 Parquet (memory-map，只讀要顯示的欄位) ---
+with st.sidebar:
+    if st.toggle("🗄️ 封存的旅程", key="archive_panel"):
+        archived = archive.list_archived()
+        if archived.empty:
+            st.caption("還沒有封存的旅程")
+        else:
+            st.dataframe(archived, hide_index=True, use_container_width=True)
+            archived_trip = st.selectbox("查看行程", archived["名稱"], key="archived_trip")
+            archived_items = archive.read(archive.ITEMS, ["日期", "開始時間", "活動", "備註"], [archived_trip])
+            st.dataframe(archived_items.sort_values(["日期", "開始時間"]), hide_index=True, use_container_width=True)
+            # 所有封存旅程的花費一次讀完、一次換匯加總
+            by_category = archive.spend_by_category(clients.get_fx_table())
+            if not by_category.empty:
+                st.caption(f"各旅程花費（{expenses.HOME_CURRENCY}）")
+                st.bar_chart(by_category)
+                st.caption(" · ".join(f"{cat} {val:,.0f}" for cat, val in by_category.sum().items()))
+
+
+# --- 除錯面板：這次 rerun 的外部呼叫 + 最近幾千筆的延遲百分位數 ---
+with st.sidebar:
+    if st.toggle("🛠️ 效能面板", key="debug_panel"):
+        records = instrument.recorder.for_rerun(rerun_id)
+        calls = [r for r in records if r["ms"] is not None]
+        hits = sum(r["cache"] == "hit" for r in records)
+        st.caption(f"這次 rerun：{len(calls)} 次外部呼叫 ({sum(r['ms'] for r in calls):.0f} ms)、{hits} 次快取命中")
+        if records:
+            st.dataframe(
+                pd.DataFrame(records, columns=["api", "op", "ms", "bytes", "cache", "cost", "error"]),
+                hide_index=True, use_container_width=True,
+            )
+        st.caption("最近紀錄 (含背景同步 / 預先抓取)")
+        st.dataframe(instrument.recorder.summary(), hide_index=True, use_container_width=True)
+        st.caption("cost：sheets = request 數、maps = elements 數、gemini = token 數")
+        queue = scheduler.scheduler.stats()
+        st.caption(f"排隊中：{queue['queued']}｜被限流重試：{queue['throttled']} 次")
+        shared = singleflight.group.shared + (sync.sheets.shared if sync is not None else 0)
+        st.caption(f"跟其他 session 共用的進行中請求：{shared} 次")
+        if st.button("匯出 JSON lines"):
+            path = data_path("metrics.jsonl")
+            count = instrument.recorder.export(path)
+            st.success(f"已匯出 {count} 筆到 {path}")
@@ -0,0 +1,164 @@
+import os
+import urllib.parse
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import expenses
+from disk_cache import DATA_DIR
+from storage import EXPENSE_HEADERS, INDEX_HEADERS, INDEX_SHEET, ITEM_HEADERS, expense_sheet
+
+# --- 封存已結束的旅程 (本機 Parquet) ---
+# 每個旅程在試算表上佔兩張工作表 (行程 + 記帳)，旅程越多列出 / 打開就越慢，也越接近 Sheets 的格數上限。
+# 結束日期已經過了的旅程可以封存：整趟旅程寫成本機的 Parquet 檔，再從試算表刪掉 (Index 列 + 兩張表)。
+#   archive/trips/<旅程>.parquet     Index 那一列 + 封存時間
+#   archive/items/<旅程>.parquet     行程
+#   archive/expenses/<旅程>.parquet  記帳 (花費存成數字)
+# 同一類的檔案 schema 都一樣，讀的時候整個資料夾當成一張表：memory-map + 只讀需要的欄位，
+# 跨旅程的統計 (例如各類別總花費) 一次讀完、一次 groupby。
+
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")
+TRIPS = "trips"
+ITEMS = "items"
+EXPENSES = "expenses"
+TRIP_COLUMN = "旅程"
+ARCHIVED_AT = "封存時間"
+COMPRESSION = "zstd"
+
+SCHEMAS = {
+    TRIPS: pa.schema([(h, pa.string()) for h in INDEX_HEADERS] + [(ARCHIVED_AT, pa.string())]),
+    ITEMS: pa.schema([(TRIP_COLUMN, pa.string())] + [(h, pa.string()) for h in ITEM_HEADERS]),
+    EXPENSES: pa.schema([(TRIP_COLUMN, pa.string())] + [(h, pa.float64() if h == "花費" else pa.string()) for h in EXPENSE_HEADERS]),
+}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _path(kind, trip_name, root=ARCHIVE_DIR):
+    return os.path.join(root, kind, urllib.parse.quote(trip_name, safe="") + ".parquet")
+
+
+def _write(kind, trip_name, columns, root):
+    # 先寫暫存檔再換名，讀的人不會看到寫一半的檔案
+    path = _path(kind, trip_name, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pydict(columns, schema=SCHEMAS[kind])
+    pq.write_table(table, path + ".tmp", compression=COMPRESSION)
+    os.replace(path + ".tmp", path)
+    return table.num_rows
+
+
+def finished_trips(store, today=None):
+    # 結束日期 (YYYY-MM-DD) 早於今天的旅程
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    return [row[0] for row in store.rows(INDEX_SHEET) if row[0] and row[2] and str(row[2]) < today]
+
+
+def write_snapshot(store, trip_name, root=ARCHIVE_DIR):
+    # 把本機 store 裡這趟旅程的資料寫成三個 Parquet 檔；回傳 (行程筆數, 記帳筆數)
+    index_row = store.get_trip(trip_name)
+    if index_row is None:
+        raise ArchiveError(f"Index 表找不到「{trip_name}」")
+    index_row = (list(index_row) + [""] * len(INDEX_HEADERS))[:len(INDEX_HEADERS)]
+    trip = {h: [str(v)] for h, v in zip(INDEX_HEADERS, index_row)}
+    trip[ARCHIVED_AT] = [datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
+
+    items = store.get_items(trip_name) if store.has_sheet(trip_name) else []
+    item_columns = {TRIP_COLUMN: [trip_name] * len(items)}
+    for i, h in enumerate(ITEM_HEADERS):
+        item_columns[h] = [str(r[i]) for r in items]
+
+    spent = store.get_expenses(trip_name) if store.has_sheet(expense_sheet(trip_name)) else []
+    spent = [(list(r) + [""] * len(EXPENSE_HEADERS))[:len(EXPENSE_HEADERS)] for r in spent]
+    expense_columns = {TRIP_COLUMN: [trip_name] * len(spent)}
+    for i, h in enumerate(EXPENSE_HEADERS):
+        expense_columns[h] = [expenses.parse_amount(r[i]) if h == "花費" else str(r[i]) for r in spent]
+
+    n_items = _write(ITEMS, trip_name, item_columns, root)
+    n_expenses = _write(EXPENSES, trip_name, expense_columns, root)
+    # Index 最後寫：有 trips 檔就表示整趟旅程都寫好了
+    _write(TRIPS, trip_name, trip, root)
+    return n_items, n_expenses
+
+
+def _remove_local(store, trip_names):
+    ids = [rid for rid, row in store.rows_with_ids(INDEX_SHEET) if row and row[0] in trip_names]
+    store.delete_rows_by_id(INDEX_SHEET, ids)
+    for name in trip_names:
+        store.drop_sheet(name)
+        store.drop_sheet(expense_sheet(name))
+
+
+def _remove_remote(store, sync, trip_names):
+    # Index 列 + 兩張工作表合併成一次 batch_update
+    # 要刪的 Index 列號在送出前重新讀一次遠端、依名稱找：本機記的位置可能已經過時
+    # (同步之後別人又新增 / 刪除了 Index 列)，照舊位置刪會刪到別的旅程
+    sync.sheets.invalidate_values(INDEX_SHEET)
+    values = sync.sheets.values(INDEX_SHEET)
+    rows = [i + 1 for i, row in enumerate(values) if i > 0 and row and row[0] in trip_names]
+    remote_titles = set(sync.sheets.titles())
+    writes = sync.writes
+    writes.delete_rows(INDEX_SHEET, rows)
+    for name in trip_names:
+        for title in (name, expense_sheet(name)):
+            if title in remote_titles:
+                writes.delete_worksheet(title)
+    writes.flush(wait=True)
+    errors = writes.pop_errors()
+    if errors:
+        raise ArchiveError(f"從試算表刪除失敗：{errors[-1]}")
+
+
+def archive_trips(store, trip_names, sync=None, root=ARCHIVE_DIR):
+    # 封存並從試算表移除；sync 是 None (離線模式) 時只移除本機資料。回傳 {旅程: (行程筆數, 記帳筆數)}
+    trip_names = list(dict.fromkeys(trip_names))
+    if not trip_names:
+        return {}
+    if sync is not None:
+        # 先把遠端最新的資料拉下來、本機還沒推的推上去，snapshot 才是完整的
+        sync.ensure(*[t for name in trip_names for t in (name, expense_sheet(name))])
+        if not sync.sync_once():
+            raise ArchiveError(f"同步失敗，稍後再試：{sync.last_error}")
+    written = {name: write_snapshot(store, name, root) for name in trip_names}
+    if sync is None:
+        _remove_local(store, set(trip_names))
+    else:
+        _remove_remote(store, sync, set(trip_names))
+        # 遠端已經沒有的工作表、Index 列，對帳時本機會跟著刪掉
+        sync.sync_once()
+    return written
+
+
+# --- 讀取 ---
+def read(kind, columns=None, trip_names=None, root=ARCHIVE_DIR):
+    # 整個資料夾 (或指定的幾趟旅程) 讀成一個 DataFrame；memory-map，只讀 columns 指定的欄位
+    schema = SCHEMAS[kind]
+    if trip_names is None:
+        directory = os.path.join(root, kind)
+        has_files = os.path.isdir(directory) and any(f.endswith(".parquet") for f in os.listdir(directory))
+        source = directory if has_files else None
+    else:
+        paths = [p for p in (_path(kind, name, root) for name in trip_names) if os.path.exists(p)]
+        source = paths or None
+    if source is None:
+        return schema.empty_table().select(columns or schema.names).to_pandas()
+    return pq.read_table(source, columns=columns, schema=schema, memory_map=True).to_pandas()
+
+
+def list_archived(root=ARCHIVE_DIR):
+    df = read(TRIPS, ["名稱", "開始日期", "結束日期", "國家", ARCHIVED_AT], root=root)
+    return df.sort_values("開始日期", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def spend_by_category(fx, home=expenses.HOME_CURRENCY, root=ARCHIVE_DIR):
+    # 所有封存旅程的花費 (換成 home)，旅程 x 類別；一次讀完所有檔案、一次換匯、一次 groupby
+    df = read(EXPENSES, [TRIP_COLUMN, "類別", "花費", "幣值", "日期"], root=root)
+    if df.empty:
+        return pd.DataFrame()
+    df = expenses.to_home(df, fx, home)
+    df["類別"] = df["類別"].replace("", "其他")
+    return df.groupby([TRIP_COLUMN, "類別"])["home"].sum().unstack(fill_value=0.0)
@@ -0,0 +1,240 @@
+"""離線 app 效能測試 (不需要任何 Google 憑證)
+
+用 Streamlit AppTest 跑 app.py，外部服務全部換成 process 內的假服務 (benchmarks/fakes.py)：
+    Google Sheets  -> FakeSpreadsheet
+    Distance Matrix / Geocoding -> 本機 HTTP server
+    Gemini         -> StubModel
+每個假服務都有可調的延遲，模擬真實網路。
+
+    python benchmarks/bench_app.py                               # 預設的幾種旅程大小
+    python benchmarks/bench_app.py --days 3,14,30 --items 8 --expenses 0,2000
+    python benchmarks/bench_app.py --save before.json            # 存下結果
+    python benchmarks/bench_app.py --compare before.json         # 跟上次比較，變慢超過門檻就 exit 1
+
+每種大小 (天數 x 每天項目數 x 記帳筆數) 在獨立的子程序裡跑，
+量測：冷啟動、rerun、切換天數、按 AI 建議的時間，各階段的外部呼叫次數，以及記憶體峰值。
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRIP = "Bench"
+COUNTRY = "日本 (Japan)"
+START = date(2026, 1, 1)
+CURRENCIES = ["JPY", "TWD", "USD"]
+CATEGORIES = ["交通", "住宿", "飲食", "購物", "其他"]
+
+
+def seed(spreadsheet, days, items, expenses):
+    from storage import EXPENSE_HEADERS, INDEX_HEADERS, INDEX_SHEET, ITEM_HEADERS, expense_sheet
+
+    end = START + timedelta(days=days - 1)
+    spreadsheet.seed(INDEX_SHEET, [INDEX_HEADERS, [TRIP, str(START), str(end), COUNTRY] + [""] * (len(INDEX_HEADERS) - 4)])
+    rows = [ITEM_HEADERS]
+    for d in range(days):
+        day = str(START + timedelta(days=d))
+        for i in range(items):
+            start_min = 8 * 60 + i * 60
+            rows.append([
+                day, f"{start_min // 60:02d}:{start_min % 60:02d}", f"{(start_min + 45) // 60:02d}:{(start_min + 45) % 60:02d}",
+                f"景點{d + 1}-{i + 1}", f"https://www.google.com/maps/search/?api=1&query=spot{d}-{i}", "",
+            ])
+    spreadsheet.seed(TRIP, rows)
+    rows = [EXPENSE_HEADERS]
+    for i in range(expenses):
+        rows.append([f"花費{i + 1}", CATEGORIES[i % len(CATEGORIES)], str(100 + i % 900), CURRENCIES[i % len(CURRENCIES)], str(START + timedelta(days=i % days))])
+    spreadsheet.seed(expense_sheet(TRIP), rows)
+
+
+def settle(counter, quiet=0.3, limit=15.0):
+    # 等背景工作 (預先抓取路線、同步) 安靜下來，避免算到下一個階段
+    deadline = time.monotonic() + limit
+    last = counter.snapshot()
+    while time.monotonic() < deadline:
+        time.sleep(quiet)
+        now = counter.snapshot()
+        if now == last:
+            return
+        last = now
+
+
+def diff(before, after):
+    return {k: after[k] - before.get(k, 0) for k in after if after[k] != before.get(k, 0)}
+
+
+def run_scenario(days, items, expenses, runs, latency, timeout):
+    # 必須在 import 任何 app 模組之前設定 (DATA_DIR 在 import 時決定)
+    os.environ["TRAVEL_PLANNER_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_app_")
+    os.environ.pop("TRAVEL_PLANNER_OFFLINE", None)
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+
+    import fakes
+    import clients
+    import geo
+    import travel
+    from streamlit.testing.v1 import AppTest
+
+    counter = fakes.CallCounter()
+    spreadsheet = fakes.FakeSpreadsheet(latency["sheets"], counter)
+    seed(spreadsheet, days, items, expenses)
+    maps = fakes.DistanceMatrixServer(latency["maps"], counter).start()
+    genai = fakes.stub_genai(latency["gemini"], counter)
+
+    # app.py 透過 clients 取得所有外部服務，把這幾個入口換掉就好
+    clients.get_gspread_client = lambda: fakes.FakeGspreadClient(spreadsheet)
+    clients.get_genai = lambda: genai
+    travel.DISTANCE_MATRIX_URL = maps.url
+    geo.GEOCODE_URL = maps.geocode_url
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=timeout)
+    at.secrets["GOOGLE_MAPS_API_KEY"] = "fake"
+    at.secrets["GEMINI_API_KEY"] = "fake"
+
+    phases = {}
+
+    def phase(name, action):
+        before = counter.snapshot()
+        t = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - t
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        settle(counter)
+        phases.setdefault(name, {"ms": [], "calls": {}})
+        phases[name]["ms"].append(round(elapsed * 1000, 1))
+        for k, v in diff(before, counter.snapshot()).items():
+            phases[name]["calls"][k] = phases[name]["calls"].get(k, 0) + v
+
+    try:
+        phase("cold", at.run)
+        for _ in range(runs):
+            phase("rerun", at.run)
+        day_key = f"day_{TRIP}"
+        for d in range(1, min(days, runs + 1)):
+            phase("switch_day", lambda d=d: at.radio(key=day_key).set_value(str(START + timedelta(days=d))).run())
+        if items:
+            # 目前顯示的那一天的第一張卡片
+            current = at.radio(key=day_key).value
+            phase("ai_advice", lambda: at.button(key=f"ai_btn_{current}_0").click().run())
+    finally:
+        maps.stop()
+
+    # Linux 的 ru_maxrss 單位是 KB
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"days": days, "items": items, "expenses": expenses, "phases": phases, "peak_rss_mb": round(peak_mb, 1)}
+
+
+def measure(days, items, expenses, args):
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--_single", json.dumps([days, items, expenses]),
+        "--runs", str(args.runs), "--timeout", str(args.timeout),
+        "--sheets-latency", str(args.sheets_latency), "--maps-latency", str(args.maps_latency),
+        "--gemini-latency", str(args.gemini_latency),
+    ]
+    out = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "benchmark failed")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def scenario_key(result):
+    return f"{result['days']}x{result['items']}x{result['expenses']}"
+
+
+def median_ms(result, name):
+    ms = result["phases"].get(name, {}).get("ms")
+    return statistics.median(ms) if ms else None
+
+
+def report(result):
+    def fmt(value):
+        return f"{value:8.1f}" if value is not None else "       -"
+
+    calls = {}
+    for p in result["phases"].values():
+        for k, v in p["calls"].items():
+            calls[k] = calls.get(k, 0) + v
+    sheets = sum(v for k, v in calls.items() if k.startswith("sheets."))
+    print(
+        f"{scenario_key(result):<14}"
+        f"{fmt(median_ms(result, 'cold'))}{fmt(median_ms(result, 'rerun'))}"
+        f"{fmt(median_ms(result, 'switch_day'))}{fmt(median_ms(result, 'ai_advice'))}"
+        f"{sheets:8d}{calls.get('maps.distance_matrix', 0):6d}{calls.get('maps.elements', 0):8d}"
+        f"{calls.get('gemini.generate_content', 0):7d}{result['peak_rss_mb']:9.1f}"
+    )
+    rerun_calls = result["phases"].get("rerun", {}).get("calls")
+    if rerun_calls:
+        # 穩定狀態的 rerun 理論上不應該有任何外部呼叫
+        print(f"{'':<14}  ⚠️ rerun 期間的外部呼叫：{rerun_calls}")
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {scenario_key(r): r for r in json.load(f)}
+    regressions = []
+    for result in results:
+        old = baseline.get(scenario_key(result))
+        if old is None:
+            continue
+        for name in ("cold", "rerun", "switch_day", "ai_advice"):
+            before, after = median_ms(old, name), median_ms(result, name)
+            if before and after and after > before * (1 + threshold):
+                regressions.append(f"{scenario_key(result)} {name}: {before:.1f} -> {after:.1f} ms")
+    for line in regressions:
+        print(f"⚠️ 變慢：{line}")
+    return not regressions
+
+
+def parse_sizes(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", default="3,7,14", help="天數，逗號分隔")
+    parser.add_argument("--items", default="5,10", help="每天的行程項目數，逗號分隔")
+    parser.add_argument("--expenses", default="100,1000", help="記帳筆數，逗號分隔")
+    parser.add_argument("--runs", type=int, default=5, help="冷啟動之後再跑幾次 rerun / 切換幾次天數")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="假 Sheets 每次呼叫的延遲 (秒)")
+    parser.add_argument("--maps-latency", type=float, default=0.15, help="假 Distance Matrix 每個 request 的延遲 (秒)")
+    parser.add_argument("--gemini-latency", type=float, default=0.8, help="假 Gemini 每次呼叫的延遲 (秒)")
+    parser.add_argument("--save", help="把結果存成 JSON")
+    parser.add_argument("--compare", help="跟之前存下的 JSON 比較")
+    parser.add_argument("--threshold", type=float, default=0.2, help="比較時容許變慢的比例")
+    parser.add_argument("--_single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    latency = {"sheets": args.sheets_latency, "maps": args.maps_latency, "gemini": args.gemini_latency}
+    if args._single:
+        days, items, expenses = json.loads(args._single)
+        print(json.dumps(run_scenario(days, items, expenses, args.runs, latency, args.timeout)))
+        return
+
+    print(f"延遲：Sheets {args.sheets_latency * 1000:.0f} ms / Maps {args.maps_latency * 1000:.0f} ms / Gemini {args.gemini_latency * 1000:.0f} ms")
+    print(f"{'天x項目x記帳':<14}{'冷啟動':>8}{'rerun':>8}{'換天':>8}{'AI':>8}{'Sheets':>8}{'Maps':>6}{'elem':>8}{'Gemini':>7}{'RSS MB':>9}")
+    results = []
+    for days, items, expenses in itertools.product(parse_sizes(args.days), parse_sizes(args.items), parse_sizes(args.expenses)):
+        result = measure(days, items, expenses, args)
+        report(result)
+        results.append(result)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""啟動 / rerun 時間測試
+
+比較「改版前 (eager import + 每次 rerun 重新連線)」與「現在 (cache_resource + lazy import)」：
+
+    python benchmarks/bench_startup.py                 # 只測目前的 app.py
+    python benchmarks/bench_startup.py --baseline fad0e88 --runs 5
+
+需要 .streamlit/secrets.toml 裡的真實憑證 (會真的連 Google)。
+每個版本都在獨立的子程序裡跑，避免 cache_resource / 已 import 的模組互相影響。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 改版前 app.py 一開始就 import 的 SDK，與現在啟動時真正需要的
+EAGER_IMPORTS = ["streamlit", "gspread", "pandas", "oauth2client.service_account", "google.generativeai", "PIL.Image", "requests"]
+LAZY_IMPORTS = ["streamlit", "gspread", "pandas", "requests"]
+
+
+def time_imports(modules):
+    code = "import time, importlib; t = time.perf_counter()\n"
+    code += "".join(f"importlib.import_module({m!r})\n" for m in modules)
+    code += "print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def load_secrets():
+    path = os.path.join(ROOT, ".streamlit", "secrets.toml")
+    if not os.path.exists(path):
+        return {}
+    import tomllib
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def run_app(app_path, runs, timeout):
+    # 在目前的 process 裡用 AppTest 跑：第一次是冷啟動，之後都是 rerun
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    for key, value in load_secrets().items():
+        at.secrets[key] = value
+    timings = []
+    for _ in range(runs + 1):
+        t = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - t)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    return {"first_run": timings[0], "reruns": timings[1:]}
+
+
+def app_at_revision(rev):
+    source = subprocess.run(["git", "show", f"{rev}:app.py"], capture_output=True, text=True, check=True, cwd=ROOT).stdout
+    # 放在 repo 根目錄，才 import 得到同層的模組
+    fd, path = tempfile.mkstemp(prefix=f"_bench_app_{rev}_", suffix=".py", dir=ROOT)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(source)
+    return path
+
+
+def measure(app_path, runs, timeout):
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--_single", app_path, "--runs", str(runs), "--timeout", str(timeout)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "benchmark failed")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def report(label, result):
+    reruns = result["reruns"]
+    mean = sum(reruns) / len(reruns) if reruns else float("nan")
+    print(f"{label:<12} 冷啟動 {result['first_run'] * 1000:8.1f} ms | rerun 平均 {mean * 1000:8.1f} ms (n={len(reruns)})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", help="拿來比較的 git revision (例如 fad0e88)")
+    parser.add_argument("--runs", type=int, default=5, help="冷啟動之後再跑幾次 rerun")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--_single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._single:
+        sys.path.insert(0, ROOT)
+        os.chdir(ROOT)
+        print(json.dumps(run_app(args._single, args.runs, args.timeout)))
+        return
+
+    print(f"SDK import (改版前 eager)：{time_imports(EAGER_IMPORTS) * 1000:8.1f} ms")
+    print(f"SDK import (現在 lazy)   ：{time_imports(LAZY_IMPORTS) * 1000:8.1f} ms")
+
+    if args.baseline:
+        path = app_at_revision(args.baseline)
+        try:
+            report(args.baseline, measure(path, args.runs, args.timeout))
+        finally:
+            os.remove(path)
+    report("app.py", measure(os.path.join(ROOT, "app.py"), args.runs, args.timeout))
+
+
+if __name__ == "__main__":
+    main()
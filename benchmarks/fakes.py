@@ -0,0 +1,269 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+# --- 離線測試用的假外部服務 ---
+#   FakeSpreadsheet      ：跟 gspread 的 Spreadsheet / Worksheet 介面相容 (app 用到的那幾個方法)
+#   DistanceMatrixServer ：本機 HTTP server，回傳 Distance Matrix / Geocoding 格式的 JSON
+#   StubModel / stub_genai：取代 google.generativeai 的 GenerativeModel
+# 每個假服務都可以設定延遲 (秒)，並記錄被呼叫的次數，給 benchmark 統計外部呼叫用。
+
+
+class CallCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def _display(cell):
+    # get_all_values 回傳的是格式化後的字串
+    value = cell.get("userEnteredValue", {})
+    if "numberValue" in value:
+        number = value["numberValue"]
+        return str(int(number)) if float(number).is_integer() else str(number)
+    if "boolValue" in value:
+        return "TRUE" if value["boolValue"] else "FALSE"
+    return str(value.get("stringValue", value.get("formulaValue", "")))
+
+
+# --- Google Sheets ---
+class FakeWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title, rows=None):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.rows = [list(r) for r in rows or []]
+
+    def get_all_values(self):
+        self.spreadsheet._call("get_all_values")
+        width = max((len(r) for r in self.rows), default=0)
+        return [[str(c) for c in r] + [""] * (width - len(r)) for r in self.rows]
+
+    def _set(self, row, col, value):
+        while len(self.rows) <= row:
+            self.rows.append([])
+        line = self.rows[row]
+        while len(line) <= col:
+            line.append("")
+        line[col] = value
+
+
+class FakeSpreadsheet:
+    def __init__(self, latency=0.0, counter=None):
+        self.latency = latency
+        self.counter = counter or CallCounter()
+        self._sheets = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._updated = 0
+
+    def _call(self, name):
+        self.counter.add(f"sheets.{name}")
+        if self.latency:
+            time.sleep(self.latency)
+
+    # 建立測試資料用 (不算呼叫次數)
+    def seed(self, title, rows):
+        with self._lock:
+            ws = FakeWorksheet(self, self._next_id, title, rows)
+            self._next_id += 1
+            self._sheets[title] = ws
+            self._updated += 1
+        return ws
+
+    def worksheets(self):
+        self._call("worksheets")
+        with self._lock:
+            return list(self._sheets.values())
+
+    def worksheet(self, title):
+        self._call("worksheet")
+        return self._sheets[title]
+
+    def get_lastUpdateTime(self):
+        self._call("get_lastUpdateTime")
+        return str(self._updated)
+
+    def batch_update(self, body):
+        self._call("batch_update")
+        with self._lock:
+            by_id = {ws.id: ws for ws in self._sheets.values()}
+            for request in body.get("requests", []):
+                if "addSheet" in request:
+                    props = request["addSheet"]["properties"]
+                    ws = FakeWorksheet(self, props.get("sheetId", self._next_id), props["title"])
+                    self._next_id = max(self._next_id, ws.id) + 1
+                    self._sheets[ws.title] = by_id[ws.id] = ws
+                elif "appendCells" in request:
+                    spec = request["appendCells"]
+                    ws = by_id[spec["sheetId"]]
+                    ws.rows.extend([_display(c) for c in row.get("values", [])] for row in spec["rows"])
+                elif "deleteSheet" in request:
+                    ws = by_id.pop(request["deleteSheet"]["sheetId"])
+                    del self._sheets[ws.title]
+                elif "deleteDimension" in request:
+                    grid = request["deleteDimension"]["range"]
+                    del by_id[grid["sheetId"]].rows[grid["startIndex"]:grid["endIndex"]]
+                elif "updateCells" in request:
+                    spec = request["updateCells"]
+                    grid = spec["range"]
+                    ws = by_id[grid["sheetId"]]
+                    for i, row in enumerate(spec["rows"]):
+                        for j, cell in enumerate(row.get("values", [])):
+                            ws._set(grid.get("startRowIndex", 0) + i, grid.get("startColumnIndex", 0) + j, _display(cell))
+            self._updated += 1
+        return {"replies": [{} for _ in body.get("requests", [])]}
+
+
+class FakeGspreadClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+
+# --- Distance Matrix ---
+def fake_element(origin, destination):
+    # 依地名算出固定的假時間 / 距離，同一段路線每次結果都一樣
+    seed = int(hashlib.md5(f"{origin}|{destination}".encode("utf-8")).hexdigest()[:8], 16)
+    minutes = 5 + seed % 55
+    km = round(0.5 + (seed >> 8) % 300 / 10, 1)
+    return {
+        "status": "OK",
+        "duration": {"text": f"{minutes} 分鐘", "value": minutes * 60},
+        "distance": {"text": f"{km} 公里", "value": int(km * 1000)},
+    }
+
+
+def fake_location(address):
+    # 依地名算出固定的假座標，散布在東京附近約 10 公里見方內 (有些路段會近到不用查 Maps)
+    seed = int(hashlib.md5(address.encode("utf-8")).hexdigest()[:8], 16)
+    return {"lat": 35.65 + (seed % 1000) / 10000, "lng": 139.70 + (seed >> 10) % 1000 / 10000}
+
+
+class DistanceMatrixServer:
+    def __init__(self, latency=0.0, counter=None):
+        self.latency = latency
+        self.counter = counter or CallCounter()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path.endswith("/geocode/json"):
+                    server.counter.add("maps.geocode")
+                    address = query.get("address", [""])[0]
+                    return self._reply({"status": "OK", "results": [{"geometry": {"location": fake_location(address)}}]})
+                origins = query.get("origins", [""])[0].split("|")
+                destinations = query.get("destinations", [""])[0].split("|")
+                server.counter.add("maps.distance_matrix")
+                server.counter.add("maps.elements", len(origins) * len(destinations))
+                if server.latency:
+                    time.sleep(server.latency)
+                self._reply({
+                    "status": "OK",
+                    "rows": [{"elements": [fake_element(o, d) for d in destinations]} for o in origins],
+                })
+
+            def _reply(self, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/maps/api/distancematrix/json"
+
+    @property
+    def geocode_url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/maps/api/geocode/json"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# --- Gemini ---
+class StubResponse:
+    def __init__(self, text, chunks):
+        self.text = text
+        self._chunks = chunks
+        self.usage_metadata = SimpleNamespace(total_token_count=len(text) // 2)
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield SimpleNamespace(text=chunk)
+
+
+class StubModel:
+    def __init__(self, name="stub", latency=0.0, counter=None):
+        self.model_name = name
+        self.latency = latency
+        self.counter = counter or CallCounter()
+
+    def _answer(self, contents, generation_config):
+        config = generation_config or {}
+        if config.get("response_mime_type") != "application/json":
+            return "這是測試用的建議：早點去避開人潮。"
+        schema = config.get("response_schema")
+        if schema is not None:
+            fields = schema["items"]["properties"] if schema.get("type") == "array" else schema["properties"]
+            obj = {f: "" for f in fields}
+            if schema.get("type") != "array":
+                return json.dumps(obj, ensure_ascii=False)
+            # 多筆一次解析：prompt 裡每一筆前面有一行 [n]
+            count = sum(1 for line in str(contents).splitlines() if re.fullmatch(r"\s*\[\d+\]\s*", line))
+            return json.dumps([obj] * max(count, 1), ensure_ascii=False)
+        prompt = contents if isinstance(contents, str) else ""
+        if isinstance(contents, list):
+            return json.dumps({"item": "收據", "amount": 1000, "category": "飲食"}, ensure_ascii=False)
+        # 一天的景點建議：prompt 裡 "- 景點" 的每一行都回一段
+        spots = [line[2:].strip() for line in prompt.splitlines() if line.startswith("- ")]
+        return json.dumps({s: f"{s} 的測試建議" for s in spots}, ensure_ascii=False)
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        self.counter.add("gemini.generate_content")
+        if self.latency:
+            time.sleep(self.latency)
+        text = self._answer(contents, generation_config)
+        chunks = [text[i:i + 16] for i in range(0, len(text), 16)] if stream else [text]
+        return StubResponse(text, chunks)
+
+
+def stub_genai(latency=0.0, counter=None):
+    # 取代 google.generativeai 模組：只需要 GenerativeModel
+    return SimpleNamespace(
+        configure=lambda **kwargs: None,
+        GenerativeModel=lambda name: StubModel(name, latency, counter),
+    )
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import re
+import unicodedata
+
+import instrument
+import singleflight
+import streaming
+
+# --- 訂位資訊解析 (航班 / 飯店確認信) ---
+# 1. 先用正規表示式抓明顯的欄位 (航班號、機場代碼、時間、日期)，
+#    單純的航班資訊就不用叫模型
+# 2. 需要模型時用 JSON 模式 + schema，輸出一定是合法 JSON，不用再手動去掉 ```
+# 3. 結果依「正規化後的文字」hash 快取，同一封信貼兩次不會再花一次錢
+# 4. 多筆訂位可以一次送出 (parse_bookings)
+# 5. 同一段文字同時被兩個 session 送出時只問一次模型 (single-flight)
+
+PARSER_VERSION = 1
+BOOKING_TTL = 180 * 24 * 3600
+
+META_FIELDS = ["航班號", "出發機場", "出發時間", "抵達機場", "抵達時間", "酒店名稱", "酒店地址", "入住日期", "退房日期"]
+TIME_FIELDS = ["出發時間", "抵達時間"]
+DATE_FIELDS = ["入住日期", "退房日期"]
+
+BOOKING_SCHEMA = {
+    "type": "object",
+    "properties": {f: {"type": "string"} for f in META_FIELDS},
+    "required": META_FIELDS,
+}
+BATCH_SCHEMA = {"type": "array", "items": BOOKING_SCHEMA}
+
+FLIGHT_FIELDS = ["航班號", "出發機場", "出發時間", "抵達機場", "抵達時間"]
+# 航班號前面一定要有「航班 / flight」之類的字，而且只認原本就是大寫的代碼，
+# 不然 "check in 2025" 這種一般文字也會被當成航班 IN2025
+FLIGHT_RE = re.compile(
+    r"(?i:航班|班機|flight|flt)\s*(?i:no\.?|number|編號|號碼?)?\s*[:：#]?\s*"
+    r"\b([A-Z]{2}|[A-Z][0-9]|[0-9][A-Z])\s?(\d{2,4})\b"
+)
+AIRPORT_RE = re.compile(r"\b([A-Z]{3})\b")
+TIME_RE = re.compile(r"(?<!\d)([01]?\d|2[0-3])[:：]([0-5]\d)(?!\d)")
+DATE_RE = re.compile(r"(?<!\d)(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?")
+HOTEL_HINTS = ("飯店", "酒店", "旅館", "民宿", "入住", "退房", "hotel", "check-in", "check in", "checkout", "check-out")
+SPLIT_RE = re.compile(r"^\s*-{3,}\s*$", re.M)   # 一次貼好幾筆時，每筆之間用一行 --- 隔開
+# 常見的三碼大寫但不是機場的字
+NOT_AIRPORTS = {"THE", "AND", "PNR", "VIA", "UTC", "GMT", "ETD", "ETA", "TWD", "JPY", "USD", "KRW", "THB", "EUR"}
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(text, travel_start):
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return (digest, str(travel_start), PARSER_VERSION)
+
+
+def empty_meta():
+    return {f: "" for f in META_FIELDS}
+
+
+def _hhmm(value):
+    m = TIME_RE.search(value or "")
+    return f"{int(m.group(1)):02d}:{m.group(2)}" if m else ""
+
+
+def _ymd(value):
+    m = DATE_RE.search(value or "")
+    return f"{m.group(1)}-{int(m.group(2)):02d}-{int(m.group(3)):02d}" if m else ""
+
+
+def clean_meta(obj):
+    # 補齊欄位、全部轉成字串，時間 / 日期格式不對的清成空字串
+    meta = empty_meta()
+    if isinstance(obj, dict):
+        for f in META_FIELDS:
+            value = obj.get(f)
+            meta[f] = "" if value is None else str(value).strip()
+    for f in TIME_FIELDS:
+        meta[f] = _hhmm(meta[f])
+    for f in DATE_FIELDS:
+        meta[f] = _ymd(meta[f])
+    return meta
+
+
+def regex_prepass(text):
+    # 回傳 (抓到的欄位, 是否已經完整到不需要模型)
+    text = normalize_text(text)
+    meta = empty_meta()
+    has_hotel = any(h in text.lower() for h in HOTEL_HINTS)
+    # 有飯店字眼時信裡的時間多半是入住 / 退房時間，航班欄位整個交給模型
+    flight = None if has_hotel else FLIGHT_RE.search(text)
+    if flight:
+        meta["航班號"] = f"{flight.group(1)}{flight.group(2)}"
+        airports = [a for a in AIRPORT_RE.findall(text) if a not in NOT_AIRPORTS]
+        if len(airports) >= 2:
+            meta["出發機場"], meta["抵達機場"] = airports[0], airports[1]
+        times = [f"{int(h):02d}:{m}" for h, m in TIME_RE.findall(text)]
+        if len(times) >= 2:
+            meta["出發時間"], meta["抵達時間"] = times[0], times[1]
+    dates = [f"{y}-{int(mo):02d}-{int(d):02d}" for y, mo, d in DATE_RE.findall(text)]
+    if has_hotel and len(dates) >= 2:
+        meta["入住日期"], meta["退房日期"] = dates[0], dates[1]
+    complete = not has_hotel and all(meta[f] for f in FLIGHT_FIELDS)
+    return meta, complete
+
+
+def booking_prompt(text, travel_start):
+    return f"""
+    請分析以下旅遊資訊（包含航班或酒店）並轉換為結構化 JSON。
+    參考開始日期：{travel_start}
+    輸入內容：{text}
+    時間用 HH:MM，日期用 YYYY-MM-DD。如果資訊中沒有提到某項，請填入空字串 ""。
+    """
+
+
+def batch_prompt(texts, travel_start):
+    parts = "\n".join(f"[{i + 1}]\n{t}\n" for i, t in enumerate(texts))
+    return f"""
+    以下有 {len(texts)} 筆旅遊資訊（航班或酒店），請依照順序每一筆輸出一個 JSON 物件，組成陣列。
+    參考開始日期：{travel_start}
+    {parts}
+    時間用 HH:MM，日期用 YYYY-MM-DD。如果資訊中沒有提到某項，請填入空字串 ""。
+    """
+
+
+def _merge(model_meta, regex_meta):
+    # 模型沒填的欄位用正規表示式的結果補；模型判斷沒有航班時，不拿正規表示式的航班欄位硬補
+    meta = clean_meta(model_meta)
+    has_flight = any(meta[f] for f in FLIGHT_FIELDS)
+    for f in META_FIELDS:
+        if f in FLIGHT_FIELDS and not has_flight:
+            continue
+        if not meta[f] and regex_meta.get(f):
+            meta[f] = regex_meta[f]
+    return meta
+
+
+def _ask_model(model, text, travel_start, regex_meta, on_partial=None):
+    config = {"response_mime_type": "application/json", "response_schema": BOOKING_SCHEMA}
+    prompt = booking_prompt(text, travel_start)
+    if on_partial is None:
+        raw = model.generate_content(prompt, generation_config=config).text
+    else:
+        raw = ""
+        for chunk in streaming.iter_text(model.generate_content(prompt, generation_config=config, stream=True)):
+            raw += chunk
+            fields, _ = streaming.parse_partial_object(raw)
+            if fields:
+                on_partial(fields)
+    try:
+        parsed = json.loads(raw)
+    except json.JSONDecodeError:
+        parsed, _ = streaming.parse_partial_object(raw)
+    return _merge(parsed, regex_meta)
+
+
+def parse_booking(model, text, travel_start, cache=None, on_partial=None):
+    # on_partial(fields)：串流時每收到一段就回報目前的欄位 (給畫面逐步顯示)
+    key = cache_key(text, travel_start)
+    if cache is not None:
+        cached = instrument.cache_result("gemini", "booking", cache.get(key))
+        if cached is not None:
+            return cached
+    regex_meta, complete = regex_prepass(text)
+    if complete:
+        meta = regex_meta
+    else:
+        meta = singleflight.do(("booking",) + key, _ask_model, model, text, travel_start, regex_meta, on_partial)
+    if cache is not None:
+        cache.set(key, meta, BOOKING_TTL)
+    return meta
+
+
+def parse_bookings(model, texts, travel_start, cache=None):
+    # 多筆一次解析：快取有的、正規表示式就夠的先處理，其餘合併成一個 request
+    results = [None] * len(texts)
+    todo = []
+    for i, text in enumerate(texts):
+        key = cache_key(text, travel_start)
+        cached = instrument.cache_result("gemini", "booking", cache.get(key)) if cache is not None else None
+        if cached is not None:
+            results[i] = cached
+            continue
+        regex_meta, complete = regex_prepass(text)
+        if complete:
+            results[i] = regex_meta
+            if cache is not None:
+                cache.set(key, regex_meta, BOOKING_TTL)
+        else:
+            todo.append((i, text, regex_meta))
+    if not todo:
+        return results
+    if len(todo) == 1:
+        i, text, _ = todo[0]
+        results[i] = parse_booking(model, text, travel_start, cache)
+        return results
+
+    config = {"response_mime_type": "application/json", "response_schema": BATCH_SCHEMA}
+    try:
+        parsed = json.loads(model.generate_content(batch_prompt([t for _, t, _ in todo], travel_start), generation_config=config).text)
+    except (json.JSONDecodeError, ValueError):
+        parsed = None
+    if not isinstance(parsed, list) or len(parsed) != len(todo):
+        # 數量對不上就不猜了，逐筆重新解析
+        for i, text, _ in todo:
+            results[i] = parse_booking(model, text, travel_start, cache)
+        return results
+    for (i, text, regex_meta), obj in zip(todo, parsed):
+        results[i] = _merge(obj, regex_meta)
+        if cache is not None:
+            cache.set(cache_key(text, travel_start), results[i], BOOKING_TTL)
+    return results
+
+
+def split_bookings(text):
+    return [t.strip() for t in SPLIT_RE.split(text or "") if t.strip()]
+
+
+def to_items(meta, flight_date):
+    # 解析結果轉成行程列 (日期, 開始, 結束, 活動, 地圖連結, 備註)，格式跟手動「加航班」「加飯店」一樣
+    # 航班只有時間沒有日期，用 flight_date (畫面上可以再改)
+    if not meta:
+        return []
+    rows = []
+    # 要有航班號或起降機場才算航班，只有一個時間不算
+    if meta["航班號"] or (meta["出發機場"] and meta["抵達機場"]):
+        rows.append([
+            flight_date, meta["出發時間"], meta["抵達時間"],
+            f"✈️ 航班: {meta['航班號']} ({meta['出發機場']} 🛫 {meta['抵達機場']})", "", "航班資訊",
+        ])
+    if meta["酒店名稱"] and meta["入住日期"]:
+        rows.append([meta["入住日期"], "15:00", "23:59", f"🏨 入住: {meta['酒店名稱']}", "", meta["酒店地址"]])
+        if meta["退房日期"]:
+            rows.append([meta["退房日期"], "00:00", "11:00", f"🔑 退房: {meta['酒店名稱']}", "", ""])
+    return rows
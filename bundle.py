@@ -0,0 +1,207 @@
+import gzip
+import json
+import math
+import os
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+
+import advice
+import itinerary
+import travel
+from disk_cache import data_path
+from storage import BOOKING_PREFIXES, row_hash
+
+# --- 出發前的離線包 ---
+# 「準備出發」把整趟旅程先算好存成一個檔案 (gzip 的 JSON)，放在 server 的資料夾：
+#   每一天的行程、所有相鄰兩站的交通、每個景點的 AI 建議、記帳統計
+# 旅行模式只讀這個檔案，畫面不用等 Sheets / Maps / Gemini，手機網路很差也打得開。
+# 再按一次「準備出發」時只補查上一版沒有的東西：
+#   路線依 (起點, 終點)、AI 建議依景點名稱沿用上一版，行程改了但地點沒變就不用重查
+#   row_hash 只用來算「有幾列變了」(stats) 和旅行模式提示「打包之後改過幾列」
+# 缺的 AI 建議每 ADVICE_BATCH 個景點合併成一次呼叫 (不是一天一次)。
+# 查失敗的 (逾時、限流、AI 錯誤) 不算數，下次準備時會再查。
+# FORMAT_VERSION 是檔案格式，改了欄位記得加一；revision 是同一趟旅程打包的第幾版。
+
+FORMAT_VERSION = 1
+ADVICE_BATCH = 20   # 一次 Gemini 呼叫最多問幾個景點 (太多回答會被截斷)
+RETRY_LEGS = (travel.PENDING_TEXT, travel.TIMEOUT_TEXT, travel.BUSY_TEXT)
+
+
+def bundle_path(trip_name):
+    return os.path.join(data_path("bundles"), urllib.parse.quote(trip_name, safe="") + ".json.gz")
+
+
+def _plain(value):
+    # pandas / NumPy 的值轉成 JSON 可以存的；NaN -> None
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def expense_summary(ledger):
+    return {
+        "home": ledger.home,
+        "count": ledger.count,
+        "total": ledger.total_home,
+        "by_category": dict(ledger.by_category),
+        "by_currency": dict(ledger.by_currency),
+        "unconverted": dict(ledger.unconverted),
+        "daily": {d: float(v) for d, v in ledger.daily_series().items()},
+    }
+
+
+def _needs_advice(name):
+    return bool(name) and not str(name).startswith(BOOKING_PREFIXES)
+
+
+def build(trip_name, country, rows, fetch_legs, fetch_advice, expenses=None, previous=None):
+    # rows：[(row_id, 行程列)]；fetch_legs(pairs) -> {pair: 文字}；fetch_advice(景點 list) -> {景點: 建議}
+    # previous：上一版的內容 (dict)，有的話只補查變動的部分
+    previous = previous if previous and previous.get("format") == FORMAT_VERSION and previous.get("country") == country else None
+    old_hashes = set(previous["rows"]) if previous else set()
+    old_legs = {}
+    old_advice = {}
+    if previous:
+        for day in previous["days"].values():
+            for o, d, text in day["legs"]:
+                if text not in RETRY_LEGS:
+                    old_legs[(o, d)] = text
+        old_advice = {k: v for k, v in previous["advice"].items() if not v.startswith(advice.FAILED_TEXT)}
+
+    plan = itinerary.prepare_itinerary([r for _, r in rows], [rid for rid, _ in rows])
+    hashes = {rid: row_hash(r) for rid, r in rows}
+    changed = [h for h in hashes.values() if h not in old_hashes]
+
+    # 只查上一版沒有的路線 / 景點 (行程沒變的那幾天通常全部沿用)
+    pairs = [p for p in dict.fromkeys(plan.all_pairs()) if p[0] and p[1]]
+    missing_legs = [p for p in pairs if p not in old_legs]
+    legs = {p: old_legs[p] for p in pairs if p in old_legs}
+    if missing_legs:
+        legs.update(fetch_legs(missing_legs))
+
+    names = dict.fromkeys(r["活動"] for items in plan.days.values() for r in items if _needs_advice(r["活動"]))
+    tips = {n: old_advice[n] for n in names if n in old_advice}
+    # 還沒有建議的景點依日期順序，每 ADVICE_BATCH 個問一次 (跟畫面上的「AI 建議」同一個快取)
+    missing_advice = [n for n in names if n not in tips]
+    for i in range(0, len(missing_advice), ADVICE_BATCH):
+        tips.update(fetch_advice(missing_advice[i:i + ADVICE_BATCH]))
+
+    days = {}
+    for date_str, items in plan.days.items():
+        records = []
+        for r in items:
+            record = {k: _plain(v) for k, v in r.items()}
+            record["hash"] = hashes.get(record["row_id"])
+            records.append(record)
+        days[date_str] = {
+            "items": records,
+            "legs": [[o, d, legs.get((o, d), travel.UNKNOWN_ROUTE)] for o, d in plan.pairs(date_str)],
+        }
+
+    return {
+        "format": FORMAT_VERSION,
+        "revision": (previous["revision"] + 1) if previous else 1,
+        "trip": trip_name,
+        "country": country,
+        "built_at": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "rows": sorted(set(hashes.values())),
+        "days": days,
+        "advice": tips,
+        "expenses": expenses,
+        "stats": {
+            "rows_changed": len(changed),
+            "legs_fetched": len(missing_legs),
+            "advice_fetched": len(missing_advice),
+        },
+    }
+
+
+def save(data, path):
+    # 先寫暫存檔再換名，讀的人不會讀到寫一半的檔案
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8", compresslevel=6) as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+class Bundle:
+    def __init__(self, data, size=0):
+        self.data = data
+        self.size = size   # 壓縮後的 bytes
+        self._legs = {
+            date_str: {(o, d): text for o, d, text in day["legs"]}
+            for date_str, day in data["days"].items()
+        }
+        self._hashes = set(data["rows"])
+
+    @property
+    def revision(self):
+        return self.data["revision"]
+
+    @property
+    def built_at(self):
+        return self.data["built_at"]
+
+    @property
+    def stats(self):
+        return self.data.get("stats", {})
+
+    @property
+    def expenses(self):
+        return self.data.get("expenses")
+
+    def items(self, date_str):
+        day = self.data["days"].get(date_str)
+        return day["items"] if day else []
+
+    def legs(self, date_str):
+        return self._legs.get(date_str, {})
+
+    def advice(self, spot_name):
+        return self.data["advice"].get(spot_name)
+
+    def changes(self, rows):
+        # 打包之後有幾列不一樣 (新增 / 修改 / 刪除)
+        current = {row_hash(r) for r in rows}
+        return len(current - self._hashes) + len(self._hashes - current)
+
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load(trip_name):
+    # 依檔案修改時間快取；所有 session 共用同一份
+    path = bundle_path(trip_name)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _lock:
+        cached = _loaded.get(trip_name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("format") != FORMAT_VERSION:
+        return None
+    loaded = Bundle(data, os.path.getsize(path))
+    with _lock:
+        _loaded[trip_name] = (mtime, loaded)
+    return loaded
+
+
+def prepare(trip_name, country, rows, fetch_legs, fetch_advice, expenses=None):
+    # 建立 / 更新離線包並存檔，回傳 (Bundle, 花了幾秒)
+    started = time.perf_counter()
+    previous = load(trip_name)
+    data = build(trip_name, country, rows, fetch_legs, fetch_advice, expenses, previous.data if previous else None)
+    save(data, bundle_path(trip_name))
+    return load(trip_name), time.perf_counter() - started
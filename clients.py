@@ -0,0 +1,140 @@
+import os
+
+import streamlit as st
+
+import advice
+import expenses
+import geo
+import instrument
+import scheduler
+import storage
+import travel
+from disk_cache import SqliteCache, data_path
+from sheets_cache import SheetsCache
+from write_queue import WriteQueue
+
+# --- 共用 client (每個 process 只建立一次) ---
+# st.cache_resource 讓憑證、gspread client、試算表、Gemini model 在所有 rerun
+# 與 session 之間共用。比較重的 SDK (oauth2client、google.generativeai) 在第一次
+# 真的用到時才 import，沒用到 AI 功能的 rerun 不用付這個成本。
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+
+# 設定 TRAVEL_PLANNER_OFFLINE=1 就完全不連 Google Sheets，只用本機資料 (測試 / 沒網路時)
+OFFLINE = os.environ.get("TRAVEL_PLANNER_OFFLINE") == "1"
+
+
+# --- 1. 初始化 Google Sheets ---
+@st.cache_resource
+def get_credentials():
+    from oauth2client.service_account import ServiceAccountCredentials
+    creds_info = st.secrets["gcp_service_account"]
+    return ServiceAccountCredentials.from_json_keyfile_dict(creds_info, SCOPE)
+
+
+@st.cache_resource
+def get_gspread_client():
+    import gspread
+    return gspread.authorize(get_credentials())
+
+
+@st.cache_resource
+def get_spreadsheet(sheet_id):
+    return scheduler.call("sheets_read", get_gspread_client().open_by_key, sheet_id)
+
+
+# --- 初始化 Gemini ---
+@st.cache_resource
+def get_genai():
+    import google.generativeai as genai
+    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+    return genai
+
+
+@st.cache_resource
+def get_model():
+    # 嘗試使用最標準的名稱，如果 flash 不行，也可以試試 gemini-pro
+    # 外層排程 (配額 / 退避重試)、內層量測 (每次實際呼叫的時間 / token 數)，用法跟 GenerativeModel 一樣
+    return scheduler.ScheduledModel(instrument.TrackedModel(get_genai().GenerativeModel('models/gemini-2.5-flash'), "text"))
+
+
+@st.cache_resource
+def get_vision_model():
+    # 使用 flash 處理圖片速度快且便宜
+    return scheduler.ScheduledModel(instrument.TrackedModel(get_genai().GenerativeModel('gemini-1.5-flash'), "vision"))
+
+
+# --- 快取與寫入佇列 ---
+# 讀取快取：整個 process 共用一份，rerun 時不再重新連線或重抓資料
+@st.cache_resource
+def get_sheets_cache(sheet_id):
+    return SheetsCache(get_spreadsheet(sheet_id), ttl=300)
+
+
+# 批次寫入佇列：對話框送出時才合併成一次 batch_update
+@st.cache_resource
+def get_write_queue(sheet_id):
+    return WriteQueue(get_sheets_cache(sheet_id))
+
+
+# 本機優先的資料儲存：讀寫都先到本機 SQLite，背景再跟 Sheets 同步
+@st.cache_resource
+def get_store(sheet_id):
+    if OFFLINE:
+        return storage.LocalStore(data_path("offline.sqlite3"))
+    return storage.LocalStore(data_path(f"store_{sheet_id}.sqlite3"))
+
+
+@st.cache_resource
+def get_sync_worker(sheet_id):
+    if OFFLINE:
+        return None
+    worker = storage.SyncWorker(get_store(sheet_id), get_sheets_cache(sheet_id), get_write_queue(sheet_id))
+    try:
+        # 第一次啟動先同步一次 (Index 表不存在會在這裡建立)，之後交給背景執行緒
+        worker.sync_once()
+    except Exception as e:
+        worker.last_error = e
+    return worker.start()
+
+
+# 交通時間快取：存在本機 SQLite，所有 session 共用、重開也還在
+@st.cache_resource
+def get_travel_cache():
+    return SqliteCache(data_path("cache.sqlite3"), "travel", max_entries=20000)
+
+
+# Maps 查詢 client：共用連線池與 thread pool
+@st.cache_resource
+def get_travel_client():
+    return travel.TravelClient(st.secrets["GOOGLE_MAPS_API_KEY"], cache=get_travel_cache())
+
+
+# 地點座標：存在本機 store，背景查 Geocoding API
+@st.cache_resource
+def get_geocoder(sheet_id):
+    return geo.Geocoder(st.secrets["GOOGLE_MAPS_API_KEY"], get_store(sheet_id))
+
+
+# 收據辨識結果快取：依照片內容 hash
+@st.cache_resource
+def get_receipt_cache():
+    return SqliteCache(data_path("cache.sqlite3"), "receipts")
+
+
+# 訂位解析結果快取：依正規化後的文字 hash
+@st.cache_resource
+def get_booking_cache():
+    return SqliteCache(data_path("cache.sqlite3"), "booking")
+
+
+# AI 建議快取：記憶體 LRU + 本機 SQLite
+@st.cache_resource
+def get_advice_cache():
+    return advice.AdviceCache(SqliteCache(data_path("cache.sqlite3"), "advice"))
+
+
+# 匯率表 (本機 JSON 檔，檔案有改才重新讀)
+@st.cache_resource
+def get_fx_table():
+    return expenses.FxTable()
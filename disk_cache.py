@@ -0,0 +1,125 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- 本機 SQLite 快取 ---
+# 整個 process 共用同一個檔案，重開 app 後資料還在。
+# 每筆資料有各自的 TTL；超過 max_entries 時依最後使用時間 (LRU) 淘汰。
+# 最後使用時間不用很精確：命中時只有超過 TOUCH_INTERVAL 沒更新的才寫回，
+# 平常的讀取就只是 SELECT，不會每次命中都寫檔 + fsync。
+# 淘汰也不用每次寫入都做 (COUNT(*) 要掃整個 namespace)：每 EVICT_EVERY 次寫入才檢查一次，
+# 所以筆數最多會暫時超過 max_entries 不到 EVICT_EVERY 筆。
+
+DATA_DIR = os.environ.get("TRAVEL_PLANNER_DATA_DIR", ".planner_data")
+TOUCH_INTERVAL = 3600
+EVICT_EVERY = 100
+SQL_VARIABLES = 500   # 一次 IN (...) 最多帶幾個 key (SQLite 的參數上限)
+
+
+def data_path(name):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, name)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class SqliteCache:
+    def __init__(self, path, namespace, max_entries=10000, evict_every=EVICT_EVERY):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, last_access REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+
+    def get(self, key, default=None):
+        found = self.get_many([key])
+        return found[key] if key in found else default
+
+    def get_many(self, keys):
+        # 回傳 {key: value}，只包含有命中的；一次 SELECT，要更新使用時間的也一次寫回
+        keys = list(keys)
+        if not keys:
+            return {}
+        by_text = {self._key(k): k for k in keys}
+        now = time.time()
+        found = {}
+        stale = []
+        with self._lock:
+            for part in _chunks(list(by_text), SQL_VARIABLES):
+                rows = self._conn.execute(
+                    "SELECT key, value, expires_at, last_access FROM cache"
+                    f" WHERE namespace = ? AND key IN ({','.join('?' * len(part))})",
+                    (self.namespace, *part),
+                ).fetchall()
+                for k, value, expires_at, last_access in rows:
+                    if expires_at < now:
+                        continue
+                    found[by_text[k]] = value
+                    if now - last_access > TOUCH_INTERVAL:
+                        stale.append(k)
+            if stale:
+                self._conn.executemany(
+                    "UPDATE cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                    [(now, self.namespace, k) for k in stale],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(by_text) - len(found)
+        return {k: json.loads(v) for k, v in found.items()}
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, self._key(key), json.dumps(value, ensure_ascii=False), now + ttl, now),
+            )
+            self._writes += 1
+            if self._writes % self.evict_every == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, self._key(key)))
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at < ?", (self.namespace, now))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM cache WHERE rowid IN ("
+                " SELECT rowid FROM cache WHERE namespace = ? ORDER BY last_access LIMIT ?)",
+                (self.namespace, count - self.max_entries),
+            )
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()
+        return count
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
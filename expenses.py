@@ -0,0 +1,183 @@
+import bisect
+import json
+import os
+import threading
+from collections import defaultdict
+
+import pandas as pd
+
+from storage import EXPENSE_HEADERS, expense_sheet
+
+# --- 記帳統計 ---
+# ExpenseLedger 維護「各類別 / 各幣值」的累計金額，新增一筆就只加那一筆，
+# 不用每次 rerun 把整張記帳表重算。所有金額會透過本機匯率表換成 HOME_CURRENCY。
+# 匯率表是本機 JSON 檔 (fx_rates.json)，依日期記錄：
+#   {"base": "TWD", "rates": {"2026-01-01": {"JPY": 0.21, "USD": 32.5, ...}}}
+# 意思是 1 單位外幣 = 多少 base。換算時用「花費日期當天或之前最近的一天」的匯率。
+
+HOME_CURRENCY = "TWD"
+FX_PATH = os.environ.get("TRAVEL_PLANNER_FX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fx_rates.json"))
+
+
+def parse_amount(value):
+    try:
+        return float(str(value).replace(",", "").strip())
+    except ValueError:
+        return 0.0
+
+
+class FxTable:
+    def __init__(self, path=FX_PATH):
+        self.path = path
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.base = HOME_CURRENCY
+        self._dates = []
+        self._rates = []
+
+    def _load(self):
+        # 檔案有改才重新讀
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            data = {}
+            if mtime is not None:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+            self.base = data.get("base", HOME_CURRENCY)
+            table = sorted(data.get("rates", {}).items())
+            self._dates = [d for d, _ in table]
+            self._rates = [r for _, r in table]
+            self._mtime = mtime
+
+    @property
+    def version(self):
+        # 匯率檔的修改時間；變了表示之前換算的金額都要重算
+        self._load()
+        return self._mtime
+
+    def rate(self, currency, date_str=None):
+        # 1 單位 currency = 多少 base；查不到回傳 None
+        self._load()
+        if currency == self.base:
+            return 1.0
+        if not self._dates:
+            return None
+        i = bisect.bisect_right(self._dates, date_str or self._dates[-1]) - 1
+        # 比匯率表還早的日期就用最早的一天；往前找有這個幣值的最近一天
+        for j in range(max(i, 0), -1, -1):
+            if currency in self._rates[j]:
+                return self._rates[j][currency]
+        for rates in self._rates[max(i, 0):]:
+            if currency in rates:
+                return rates[currency]
+        return None
+
+    def convert(self, amount, currency, date_str=None, to=HOME_CURRENCY):
+        src = self.rate(currency, date_str)
+        dst = self.rate(to, date_str)
+        if src is None or dst is None:
+            return None
+        return amount * src / dst
+
+    def frame(self):
+        # 長表 (date, currency, rate)，給向量化換算用
+        self._load()
+        records = [(d, c, r) for d, rates in zip(self._dates, self._rates) for c, r in rates.items()]
+        df = pd.DataFrame(records, columns=["date", "currency", "rate"])
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        return df
+
+
+class ExpenseLedger:
+    def __init__(self, fx, home=HOME_CURRENCY):
+        self.fx = fx
+        self.home = home
+        self.reset()
+
+    def reset(self):
+        self.rows = []
+        self.count = 0
+        self.by_currency = defaultdict(float)       # 原幣別累計
+        self.by_category = defaultdict(float)       # 換成 home 後的類別累計
+        self.total_home = 0.0
+        self.unconverted = defaultdict(float)       # 匯率表找不到的幣值
+        self.max_id = 0
+        self.prefix = None
+        self.fx_version = self.fx.version    # 這本帳是用哪一版匯率換算的
+
+    def add(self, row):
+        desc, cat, amount, curr, date_str = (list(row) + [""] * 5)[:5]
+        amount = parse_amount(amount)
+        curr = curr or self.home
+        self.rows.append([desc, cat, amount, curr, date_str])
+        self.count += 1
+        self.by_currency[curr] += amount
+        converted = self.fx.convert(amount, curr, date_str or None, self.home)
+        if converted is None:
+            self.unconverted[curr] += amount
+            return
+        self.by_category[cat or "其他"] += converted
+        self.total_home += converted
+
+    def daily_series(self):
+        # 每天花費 (換成 home)；匯率表沒有的幣值不算進去 (跟總額一樣，另外列在 unconverted)
+        if not self.rows:
+            return pd.Series(dtype=float)
+        df = to_home(pd.DataFrame(self.rows, columns=EXPENSE_HEADERS), self.fx, self.home)
+        df = df.dropna(subset=["date", "home"])
+        if df.empty:
+            return pd.Series(dtype=float)
+        return df.groupby(df["date"].dt.strftime("%Y-%m-%d"))["home"].sum()
+
+
+def to_home(df, fx, home=HOME_CURRENCY):
+    # 向量化換匯：df 要有 花費 / 幣值 / 日期 欄位，回傳多了 date / rate / home 欄位的 DataFrame (依日期排序)。
+    # 用 merge_asof 一次把所有列對到當天或之前最近的匯率；沒有日期的列用最新的匯率，匯率表沒有的幣值 home 是 NaN
+    df = df.copy()
+    df["花費"] = pd.to_numeric(df["花費"], errors="coerce").fillna(0.0)
+    df["date"] = pd.to_datetime(df["日期"], format="%Y-%m-%d", errors="coerce")
+    df["_on"] = df["date"].fillna(pd.Timestamp.max).astype("datetime64[ns]")
+    df = df.sort_values("_on", kind="stable")
+    rates = fx.frame().dropna(subset=["date"]).sort_values("date").rename(columns={"date": "_on"})
+    rates["_on"] = rates["_on"].astype("datetime64[ns]")
+    base_rows = df["幣值"] == fx.base
+    if rates.empty:
+        df["rate"] = base_rows.astype(float).where(base_rows)
+    else:
+        df = pd.merge_asof(df, rates, on="_on", left_by="幣值", right_by="currency", direction="backward")
+        # 比匯率表更早的日期：改用最早的匯率
+        earliest = rates.groupby("currency")["rate"].first()
+        df["rate"] = df["rate"].fillna(df["幣值"].map(earliest))
+        df.loc[df["幣值"] == fx.base, "rate"] = 1.0
+    home_rate = fx.rate(home) or 1.0
+    df["home"] = df["花費"] * df["rate"] / home_rate
+    return df.drop(columns=["_on", "currency"], errors="ignore")
+
+
+_ledgers = {}
+_lock = threading.Lock()
+
+
+def get_ledger(store, trip_name, fx):
+    # 每個旅程一本帳；只有「新增」時增量更新，改過或刪過列、或匯率檔更新了就整本重建
+    title = expense_sheet(trip_name)
+    with _lock:
+        ledger = _ledgers.get(title)
+        if ledger is None or ledger.fx is not fx:
+            ledger = _ledgers[title] = ExpenseLedger(fx)
+        if ledger.fx_version != fx.version:
+            ledger.reset()
+        if ledger.prefix is not None and store.prefix_version(title, ledger.max_id) != ledger.prefix:
+            ledger.reset()
+        new_rows = store.rows_after(title, ledger.max_id)
+        for row_id, row in new_rows:
+            ledger.add(row)
+            ledger.max_id = max(ledger.max_id, row_id)
+        if new_rows or ledger.prefix is None:
+            ledger.prefix = store.prefix_version(title, ledger.max_id)
+    return ledger
@@ -0,0 +1,130 @@
+import contextvars
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+import instrument
+import scheduler
+from storage import BOOKING_PREFIXES
+
+# --- 地點座標 + 本機距離估算 ---
+# 每個地點只 geocode 一次，座標存在本機 store (places 表)，之後不再查。
+# 有了座標就能用 haversine 算直線距離 (NumPy 一次算完整趟旅程的所有路段)：
+#   直線距離在 NEAR_KM 以內的路段，直接顯示估計的步行時間，不用花 Distance Matrix 的錢
+#   比較遠的路段、還沒有座標的地點，或使用者要求精確交通資訊時，才查 Distance Matrix
+# Geocoding 在背景 thread pool 跑，第一次打開旅程時還沒有座標的路段照舊查 Maps。
+
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+REQUEST_TIMEOUT = (3.05, 8)
+
+EARTH_RADIUS_KM = 6371.0088
+NEAR_KM = 1.0        # 直線距離在這以內的路段用估計值
+DETOUR = 1.3         # 直線距離換算成實際走路距離的倍數
+WALK_KMH = 4.5
+FAILED_RETRY = 7 * 24 * 3600   # 查不到的地名一週後再試
+TRANSIENT_RETRY = 600          # 逾時 / 限流的地名十分鐘內不再送
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    # 向量化：每個參數都可以是 NumPy 陣列 (度)，回傳同樣長度的公里數
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def leg_distances(pairs, coords):
+    # pairs: [(起點, 終點), ...]；coords: {地點: (lat, lng)}
+    # 回傳 {pair: 直線公里數}，只包含兩端都有座標的路段
+    known = [p for p in dict.fromkeys(pairs) if p[0] in coords and p[1] in coords]
+    if not known:
+        return {}
+    origins = np.array([coords[o] for o, _ in known], dtype=float)
+    destinations = np.array([coords[d] for _, d in known], dtype=float)
+    km = haversine_km(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+    return dict(zip(known, km.tolist()))
+
+
+def near_legs(pairs, coords, threshold=NEAR_KM):
+    # 可以不查 Maps、直接用估計值的路段：{pair: 直線公里數}
+    return {p: km for p, km in leg_distances(pairs, coords).items() if km <= threshold}
+
+
+def walking_minutes(km):
+    return max(1, math.ceil(km * DETOUR / WALK_KMH * 60))
+
+
+def estimate_text(km):
+    return f"步行約 {walking_minutes(km)} 分鐘 ({km * DETOUR:.1f} 公里，估計)"
+
+
+def _request_geocode(http, params):
+    with instrument.track("maps", "geocode") as record:
+        response = http.get(GEOCODE_URL, params=params, timeout=REQUEST_TIMEOUT)
+        record["bytes"] = len(response.content)
+        if response.status_code in scheduler.RETRY_STATUS:
+            raise scheduler.Throttled(response.status_code)
+        data = response.json()
+        if data.get("status") == "OVER_QUERY_LIMIT":
+            raise scheduler.Throttled(429, data.get("error_message", ""))
+        if data.get("status") != "OK":
+            record["error"] = data.get("status")
+        return data
+
+
+def geocode(place, country, api_key, session=None):
+    # 回傳 (lat, lng)；Google 確定查不到回傳 None；逾時、限流等暫時性的錯誤直接丟出 (不要記下來)
+    params = {"address": f"{country} {place}", "language": "zh-TW", "key": api_key}
+    data = scheduler.call("geocode", _request_geocode, session or requests, params)
+    if data.get("status") == "ZERO_RESULTS":
+        return None
+    if data.get("status") != "OK" or not data.get("results"):
+        raise ValueError(data.get("status") or "geocode failed")
+    location = data["results"][0]["geometry"]["location"]
+    return location["lat"], location["lng"]
+
+
+class Geocoder:
+    def __init__(self, api_key, store, session=None, max_workers=2):
+        self.api_key = api_key
+        self.store = store
+        self.session = session or requests.Session()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geocode")
+        self._lock = threading.Lock()
+        self._inflight = set()   # (country, 地點)
+        self._retry_at = {}      # (country, 地點) -> 暫時性失敗後可以再試的時間
+
+    def coords(self, names, country):
+        # 本機已經有的座標 {地點: (lat, lng)}；沒有的 (或查不到很久了的) 丟到背景查，下次 rerun 就有
+        # 航班 / 入住 / 退房列的「活動」不是地名，查了也是 ZERO_RESULTS，直接跳過
+        names = [n for n in dict.fromkeys(names) if n and not str(n).startswith(BOOKING_PREFIXES)]
+        known = self.store.get_places(country, names)
+        now = time.time()
+        coords = {n: c for n, (c, _) in known.items() if c is not None}
+        missing = [n for n in names if n not in known or (known[n][0] is None and now - known[n][1] > FAILED_RETRY)]
+        if missing:
+            self._submit(missing, country)
+        return coords
+
+    def _submit(self, names, country):
+        now = time.monotonic()
+        with self._lock:
+            todo = [n for n in names if (country, n) not in self._inflight and self._retry_at.get((country, n), 0) <= now]
+            self._inflight.update((country, n) for n in todo)
+        for name in todo:
+            self._executor.submit(
+                contextvars.copy_context().run, scheduler.run_with, scheduler.BACKGROUND, None, self._lookup, name, country,
+            )
+
+    def _lookup(self, name, country):
+        try:
+            self.store.set_places(country, {name: geocode(name, country, self.api_key, self.session)})
+        except Exception:
+            with self._lock:
+                self._retry_at[(country, name)] = time.monotonic() + TRANSIENT_RETRY
+        finally:
+            with self._lock:
+                self._inflight.discard((country, name))
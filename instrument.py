@@ -0,0 +1,246 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# --- 外部呼叫量測 (Sheets / Maps / Gemini) ---
+# 每一次外部呼叫記一筆：{rerun, api, op, ms, bytes, cache, cost, error}
+#   cache: "hit" / "miss" / None (沒有快取的呼叫)
+#   cost:  配額成本；sheets = request 數、maps = elements 數、gemini = token 數
+# 記錄只做 perf_counter + append 到固定長度的 deque，正式環境也可以一直開著。
+# 百分位數只有在打開除錯面板時才計算。
+# 設定 TRAVEL_PLANNER_METRICS_LOG=路徑 會把每一筆以 JSON lines 附加寫到檔案 (批次寫入)。
+# 設定 TRAVEL_PLANNER_METRICS=0 可以完全關掉。
+
+ENABLED = os.environ.get("TRAVEL_PLANNER_METRICS", "1") != "0"
+LOG_PATH = os.environ.get("TRAVEL_PLANNER_METRICS_LOG") or None
+WINDOW = 5000
+LOG_FLUSH_EVERY = 50
+LOG_FLUSH_SECONDS = 5.0
+
+# 目前這次 rerun 的編號；背景執行緒沒有設定就是 None
+_rerun = contextvars.ContextVar("rerun", default=None)
+
+
+class Recorder:
+    def __init__(self, window=WINDOW, log_path=LOG_PATH):
+        self.records = deque(maxlen=window)
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending_log = []
+        self._logged_at = time.monotonic()
+
+    # --- rerun ---
+    def begin_rerun(self):
+        rerun_id = next(self._ids)
+        _rerun.set(rerun_id)
+        return rerun_id
+
+    def current_rerun(self):
+        return _rerun.get()
+
+    # --- 記錄 ---
+    def add(self, record):
+        record["rerun"] = _rerun.get()
+        record["ts"] = round(time.time(), 3)
+        with self._lock:
+            self.records.append(record)
+            if self.log_path is None:
+                return
+            self._pending_log.append(record)
+            now = time.monotonic()
+            if len(self._pending_log) < LOG_FLUSH_EVERY and now - self._logged_at < LOG_FLUSH_SECONDS:
+                return
+            pending, self._pending_log = self._pending_log, []
+            self._logged_at = now
+        self._write(pending)
+
+    def event(self, api, op, cache=None, size=0, cost=0):
+        # 沒有經過網路的事件 (例如快取命中)，ms 是 None，不算進延遲百分位數
+        if ENABLED:
+            self.add({"api": api, "op": op, "ms": None, "bytes": size, "cache": cache, "cost": cost, "error": None})
+
+    @contextmanager
+    def track(self, api, op, cache="miss", cost=1):
+        # with track("sheets", "get_all_values") as rec:
+        #     rec["bytes"] = ...    # 呼叫端可以補上 payload 大小 / 成本
+        record = {"api": api, "op": op, "ms": 0.0, "bytes": 0, "cache": cache, "cost": cost, "error": None}
+        if not ENABLED:
+            yield record
+            return
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["ms"] = round((time.perf_counter() - start) * 1000, 2)
+            self.add(record)
+
+    # --- 查詢 ---
+    def snapshot(self):
+        with self._lock:
+            return list(self.records)
+
+    def for_rerun(self, rerun_id):
+        return [r for r in self.snapshot() if r["rerun"] == rerun_id]
+
+    def summary(self, records=None):
+        # 每個 (api, op) 的次數、延遲百分位數、快取命中、流量與配額成本
+        import pandas as pd
+
+        records = self.snapshot() if records is None else records
+        columns = ["api", "op", "calls", "hits", "misses", "p50_ms", "p90_ms", "p99_ms", "max_ms", "bytes", "cost", "errors"]
+        if not records:
+            return pd.DataFrame(columns=columns)
+        df = pd.DataFrame(records)
+        df["ms"] = df["ms"].astype(float)
+        df["hit"] = df["cache"] == "hit"
+        df["miss"] = df["ms"].isna() & (df["cache"] == "miss")
+        df["failed"] = df["error"].notna()
+        # 百分位數只算真的打出去的呼叫 (有 ms 的)，快取查詢另外計數
+        calls = df.groupby(["api", "op"])["ms"]
+        out = df.groupby(["api", "op"]).agg(
+            calls=("ms", "count"), hits=("hit", "sum"), misses=("miss", "sum"),
+            bytes=("bytes", "sum"), cost=("cost", "sum"), errors=("failed", "sum"),
+        )
+        out["p50_ms"] = calls.quantile(0.5)
+        out["p90_ms"] = calls.quantile(0.9)
+        out["p99_ms"] = calls.quantile(0.99)
+        out["max_ms"] = calls.max()
+        return out.reset_index()[columns].round(1)
+
+    # --- 匯出 ---
+    def _write(self, records):
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        except OSError:
+            pass
+
+    def flush_log(self):
+        with self._lock:
+            pending, self._pending_log = self._pending_log, []
+            self._logged_at = time.monotonic()
+        if pending and self.log_path is not None:
+            self._write(pending)
+
+    def export(self, path):
+        # 把目前視窗內的紀錄全部寫成 JSON lines，回傳筆數
+        records = self.snapshot()
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        return len(records)
+
+
+recorder = Recorder()
+begin_rerun = recorder.begin_rerun
+track = recorder.track
+event = recorder.event
+
+
+def cache_result(api, op, value):
+    # 快取查詢的結果：有值算 hit，沒有算 miss (miss 之後真正的呼叫另外記)
+    event(api, op, cache="hit" if value is not None else "miss", cost=0)
+    return value
+
+
+# --- Gemini ---
+# 把 GenerativeModel 包一層，所有 generate_content (包含串流) 都會被記錄。
+# token 數從 usage_metadata 拿；串流的話要整個讀完才知道，所以在 generator 結束時才記。
+
+def _prompt_bytes(contents):
+    if isinstance(contents, str):
+        return len(contents.encode("utf-8"))
+    if isinstance(contents, (list, tuple)):
+        return sum(_prompt_bytes(c) for c in contents)
+    if isinstance(contents, dict):
+        data = contents.get("data")
+        return len(data) if isinstance(data, (bytes, bytearray)) else 0
+    return 0
+
+
+def _tokens(response):
+    # 串流中途被關掉時 SDK 可能拿不到 usage_metadata
+    try:
+        return response.usage_metadata.total_token_count or 0
+    except Exception:
+        return 0
+
+
+class _TrackedStream:
+    def __init__(self, response, record, start):
+        self._response = response
+        self._record = record
+        self._start = start
+        self._done = False
+
+    def __iter__(self):
+        try:
+            for chunk in self._response:
+                try:
+                    self._record["bytes"] += len((chunk.text or "").encode("utf-8"))
+                except Exception:
+                    pass
+                yield chunk
+        except BaseException as e:
+            self._record["error"] = type(e).__name__
+            raise
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if self._done:
+            return
+        self._done = True
+        self._record["cost"] = _tokens(self._response)
+        self._record["ms"] = round((time.perf_counter() - self._start) * 1000, 2)
+        recorder.add(self._record)
+
+    def close(self):
+        self._finish()
+        close = getattr(self._response, "close", None)
+        if callable(close):
+            close()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class TrackedModel:
+    def __init__(self, model, op="generate_content"):
+        self._model = model
+        self._op = op
+
+    def generate_content(self, contents, *args, **kwargs):
+        if not ENABLED:
+            return self._model.generate_content(contents, *args, **kwargs)
+        if kwargs.get("stream"):
+            record = {"api": "gemini", "op": self._op + ":stream", "ms": 0.0, "bytes": _prompt_bytes(contents), "cache": "miss", "cost": 0, "error": None}
+            start = time.perf_counter()
+            try:
+                response = self._model.generate_content(contents, *args, **kwargs)
+            except BaseException as e:
+                record["error"] = type(e).__name__
+                record["ms"] = round((time.perf_counter() - start) * 1000, 2)
+                recorder.add(record)
+                raise
+            return _TrackedStream(response, record, start)
+        with track("gemini", self._op) as record:
+            record["bytes"] = _prompt_bytes(contents)
+            response = self._model.generate_content(contents, *args, **kwargs)
+            record["cost"] = _tokens(response)
+            try:
+                record["bytes"] += len((response.text or "").encode("utf-8"))
+            except Exception:
+                pass
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
@@ -0,0 +1,188 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+
+from storage import ITEM_HEADERS
+
+# --- 行程的時間區間索引 ---
+# 兩種區間，各自一個 IntervalIndex：
+#   stays：飯店住宿，「🏨 入住」那天 15:00 到配對的「🔑 退房」那天 11:00 (沒有退房列就當住一晚)
+#   timed：航班 (出發 ~ 抵達) 與其他有時間的行程 (開始 ~ 結束)；入住 / 退房列本身不算
+# 時間都換成「絕對分鐘數」(日期序數 x 1440 + 當天分鐘)，跨午夜的結束時間算隔天。
+# 「今晚住哪裡」、「這個行程跟誰撞時間」都是 O(log n + 命中數) 的查詢，不用每次掃整張表；
+# 新增列時只把新的區間插進去 (跟 expenses.get_ledger 一樣，用 prefix_version 判斷能不能增量)。
+
+DAY = 24 * 60
+CHECK_IN = "🏨"
+CHECK_OUT = "🔑"
+FLIGHT = "✈️"
+CHECK_IN_TIME = 15 * 60
+CHECK_OUT_TIME = 11 * 60
+
+
+class IntervalIndex:
+    # 依開始時間排序的半開區間 [start, end)，加上「到這一個為止最大的結束時間」(遞增)：
+    # 跟 [a, b) 重疊的區間一定落在 max_end > a 的第一個位置 ~ start < b 的最後一個位置之間，兩次 bisect 就找到
+    def __init__(self, intervals=()):
+        self._items = sorted((s, max(e, s + 1), k) for s, e, k in intervals)
+        self._starts = [s for s, _, _ in self._items]
+        self._max_end = []
+        self._rebuild(0)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _rebuild(self, i):
+        del self._max_end[i:]
+        best = self._max_end[i - 1] if i else None
+        for _, end, _ in self._items[i:]:
+            best = end if best is None else max(best, end)
+            self._max_end.append(best)
+
+    def add(self, start, end, key):
+        item = (start, max(end, start + 1), key)
+        i = bisect_right(self._items, item)
+        self._items.insert(i, item)
+        self._starts.insert(i, start)
+        # 後面的 max_end 只會變大，遇到沒變的就可以停
+        best = max(self._max_end[i - 1], item[1]) if i else item[1]
+        self._max_end.insert(i, best)
+        for j in range(i + 1, len(self._items)):
+            new = max(best, self._items[j][1])
+            if new == self._max_end[j]:
+                break
+            self._max_end[j] = best = new
+
+    def remove(self, start, end, key):
+        item = (start, max(end, start + 1), key)
+        i = bisect_left(self._items, item)
+        if i < len(self._items) and self._items[i] == item:
+            del self._items[i]
+            del self._starts[i]
+            self._rebuild(i)
+
+    def overlapping(self, start, end):
+        # 跟 [start, end) 重疊的 (start, end, key)
+        end = max(end, start + 1)
+        lo = bisect_right(self._max_end, start)
+        hi = bisect_left(self._starts, end)
+        return [item for item in self._items[lo:hi] if item[1] > start]
+
+    def at(self, moment):
+        return self.overlapping(moment, moment + 1)
+
+
+def _day(date_str):
+    try:
+        return datetime.strptime(str(date_str).strip(), "%Y-%m-%d").toordinal()
+    except ValueError:
+        return None
+
+
+def _minutes(value):
+    try:
+        parsed = datetime.strptime(str(value).strip(), "%H:%M")
+    except ValueError:
+        return None
+    return parsed.hour * 60 + parsed.minute
+
+
+def hotel_name(activity):
+    return str(activity).split(":", 1)[-1].strip()
+
+
+class ScheduleIndex:
+    def __init__(self):
+        self.stays = IntervalIndex()
+        self.timed = IntervalIndex()
+        self.rows = {}           # row_id -> row (ITEM_HEADERS 順序)
+        self._spans = {}         # row_id -> (index, start, end)
+        self._check_ins = {}     # 飯店名稱 -> [(日期序數, row_id)]
+        self._check_outs = {}    # 飯店名稱 -> [(日期序數, row_id)]
+        self._paired = {}        # 入住 row_id -> 退房 row_id
+
+    def add(self, row_id, row):
+        row = (list(row) + [""] * len(ITEM_HEADERS))[:len(ITEM_HEADERS)]
+        self.rows[row_id] = row
+        day = _day(row[0])
+        if day is None:
+            return
+        activity = str(row[3])
+        if activity.startswith(CHECK_IN):
+            insort(self._check_ins.setdefault(hotel_name(activity), []), (day, row_id))
+            self._pair(hotel_name(activity))
+        elif activity.startswith(CHECK_OUT):
+            insort(self._check_outs.setdefault(hotel_name(activity), []), (day, row_id))
+            self._pair(hotel_name(activity))
+        else:
+            start = _minutes(row[1])
+            if start is None:
+                return
+            end = _minutes(row[2])
+            start += day * DAY
+            # 沒有結束時間就當一個時間點；結束比開始早表示跨過午夜 (例如紅眼班機)
+            end = start if end is None else day * DAY + end
+            if end < start:
+                end += DAY
+            self._set_span(row_id, self.timed, start, end)
+
+    def _set_span(self, row_id, index, start, end):
+        old = self._spans.get(row_id)
+        if old is not None:
+            old[0].remove(old[1], old[2], row_id)
+        index.add(start, end, row_id)
+        self._spans[row_id] = (index, start, end)
+
+    def _pair(self, hotel):
+        # 同一間飯店依日期配對：每個入住配「之後最早、還沒被配走」的退房；只有這間飯店的住宿要重算
+        outs = list(self._check_outs.get(hotel, []))
+        for day, row_id in self._check_ins.get(hotel, []):
+            i = bisect_right(outs, (day, float("inf")))
+            if i < len(outs):
+                out_day, out_id = outs.pop(i)
+                self._paired[row_id] = out_id
+            else:
+                out_day = day + 1
+                self._paired.pop(row_id, None)
+            span = (day * DAY + CHECK_IN_TIME, out_day * DAY + CHECK_OUT_TIME)
+            old = self._spans.get(row_id)
+            if old is None or old[1:] != span:
+                self._set_span(row_id, self.stays, *span)
+
+    # --- 查詢 ---
+    def hotels_on(self, date_str):
+        # 這天晚上住的飯店 (入住 <= 這天 < 退房)
+        day = _day(date_str)
+        if day is None:
+            return []
+        stays = self.stays.at(day * DAY + DAY - 1)
+        return [hotel_name(self.rows[k][3]) for _, _, k in stays]
+
+    def conflicts(self, row_id):
+        # 時間重疊的其他列 (row_id list)；住宿只跟住宿比，行程 / 航班只跟行程 / 航班比
+        span = self._spans.get(row_id)
+        if span is None:
+            return []
+        index, start, end = span
+        return [k for _, _, k in index.overlapping(start, end) if k != row_id]
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_schedule(store, trip_name):
+    # 每個旅程一份索引；只有「新增」列時增量插入，改過或刪過列就整份重建
+    with _lock:
+        entry = _indexes.get(trip_name)
+        if entry is not None and store.prefix_version(trip_name, entry["max_id"]) != entry["prefix"]:
+            entry = None
+        if entry is None:
+            entry = _indexes[trip_name] = {"index": ScheduleIndex(), "max_id": 0, "prefix": None}
+        new_rows = store.rows_after(trip_name, entry["max_id"])
+        for row_id, row in new_rows:
+            entry["index"].add(row_id, row)
+            entry["max_id"] = max(entry["max_id"], row_id)
+        if new_rows or entry["prefix"] is None:
+            entry["prefix"] = store.prefix_version(trip_name, entry["max_id"])
+    return entry["index"]
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from storage import ITEM_HEADERS
+
+# --- 行程整理 (一次處理整張表) ---
+# 以前每一天都要 df[df["日期"] == d].copy() + 解析時間 + 排序，天數一多就是 O(天數 x 列數)。
+# 這裡整張表只做一次：日期 / 時間轉成型別欄位、一次排序、一次 groupby，
+# 順便算好每一天相鄰兩站的路線，給分頁、交通時間、AI 建議共用。
+# 結果依 (工作表, 資料版本) 快取，資料沒變就直接重用。
+
+
+class Itinerary:
+    def __init__(self, df, days, legs):
+        self.df = df          # 排序後的完整行程 (含 date / start_min / end_min 型別欄位)
+        self.days = days      # {"YYYY-MM-DD": [row dict, ...]}，已依開始時間排序
+        self.legs = legs      # {"YYYY-MM-DD": [(活動, 下一個活動), ...]}
+
+    def items(self, date_str):
+        return self.days.get(date_str, [])
+
+    def pairs(self, date_str):
+        return self.legs.get(date_str, [])
+
+    def all_pairs(self):
+        return [pair for pairs in self.legs.values() for pair in pairs]
+
+
+def _minutes(series):
+    parsed = pd.to_datetime(series, format="%H:%M", errors="coerce")
+    return parsed.dt.hour * 60 + parsed.dt.minute
+
+
+def prepare_itinerary(rows, row_ids=None):
+    # row_ids：每一列在本機 store 的 id (改寫行程時用)，沒給就用原本的列號
+    df = pd.DataFrame(rows, columns=ITEM_HEADERS)
+    df["row_id"] = list(row_ids) if row_ids is not None else range(len(df))
+    df["date"] = pd.to_datetime(df["日期"], format="%Y-%m-%d", errors="coerce")
+    df["start_min"] = _minutes(df["開始時間"])
+    df["end_min"] = _minutes(df["結束時間"])
+    # 沒有時間的排在當天最後 (跟以前 sort_values 的 NaT 行為一樣)
+    df = df.sort_values(["日期", "start_min"], kind="stable", na_position="last").reset_index(drop=True)
+    df["下一個活動"] = df.groupby("日期", sort=False)["活動"].shift(-1)
+
+    records = df[ITEM_HEADERS + ["start_min", "end_min", "row_id"]].to_dict("records")
+    nxt = df["下一個活動"].to_numpy()
+    days = {}
+    legs = {}
+    for date_str, positions in df.groupby("日期", sort=False).indices.items():
+        days[date_str] = [records[i] for i in positions]
+        legs[date_str] = [(records[i]["活動"], nxt[i]) for i in positions[:-1]]
+    return Itinerary(df, days, legs)
+
+
+_prepared = OrderedDict()
+_lock = threading.Lock()
+MAX_PREPARED = 32
+
+
+def get_itinerary(store, trip_name):
+    # 依資料版本快取；同一個版本在所有 session 之間共用
+    key = (trip_name, store.sheet_version(trip_name))
+    with _lock:
+        if key in _prepared:
+            _prepared.move_to_end(key)
+            return _prepared[key]
+    rows = store.get_items_with_ids(trip_name)
+    prepared = prepare_itinerary([r for _, r in rows], [rid for rid, _ in rows])
+    with _lock:
+        _prepared[key] = prepared
+        while len(_prepared) > MAX_PREPARED:
+            _prepared.popitem(last=False)
+    return prepared
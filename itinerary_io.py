@@ -0,0 +1,313 @@
+import codecs
+import csv
+import io
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+
+from storage import ITEM_HEADERS, row_hash
+
+# --- 行程批次匯入 / 匯出 (ICS、CSV) ---
+# 匯入：一行一行讀上傳的檔案 (不先整個讀成字串)，每一筆檢查日期是否在旅程期間內、
+#       地圖連結跟「新增行程項目」對話框用同一個規則產生，最後整批交給 store.append_items，
+#       背景同步時合併成一次 batch_update，不是一筆一次 append_row + 一次 rerun。
+# 匯出：generator 一段一段產生 ICS / CSV，按下下載按鈕時才組成 bytes (download_button 的 callable)，
+#       不會每次 rerun 都組一份行事曆。download_button 只收 str / bytes / BytesIO 這類型別，
+#       所以最後交出去的是 bytes (Streamlit 本來就會整份放進記憶體)。
+
+MAX_IMPORT_ROWS = 2000
+MAX_ERRORS = 50
+ICS_LINE_OCTETS = 75
+
+# CSV 表頭：除了試算表本身的欄名，也接受常見的英文欄名 (Google 日曆 / 其他規劃工具匯出的)
+CSV_ALIASES = {
+    "日期": "日期", "date": "日期", "start date": "日期",
+    "開始時間": "開始時間", "開始": "開始時間", "start": "開始時間", "start time": "開始時間",
+    "結束時間": "結束時間", "結束": "結束時間", "end": "結束時間", "end time": "結束時間",
+    "活動": "活動", "景點": "活動", "名稱": "活動", "name": "活動", "title": "活動", "subject": "活動", "summary": "活動",
+    "地圖連結": "地圖連結", "地圖": "地圖連結", "url": "地圖連結", "map": "地圖連結", "link": "地圖連結",
+    "備註": "備註", "note": "備註", "notes": "備註", "description": "備註",
+    "地點": "地點", "location": "地點",
+}
+
+
+def map_url(country_name, name):
+    # 跟 add_item_dialog 一樣：沒有給地圖連結就用「國家 + 名稱」搜尋
+    return f"https://www.google.com/maps/search/?api=1&query={urllib.parse.quote(f'{country_name} {name}')}"
+
+
+def _date(value):
+    value = str(value or "").strip()
+    for fmt in ("%Y-%m-%d", "%Y/%m/%d", "%Y%m%d"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def _time(value):
+    value = str(value or "").strip()
+    for fmt in ("%H:%M", "%H:%M:%S", "%H%M"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%H:%M")
+        except ValueError:
+            continue
+    return None
+
+
+# --- ICS 解析 ---
+def _unfold(lines):
+    # RFC 5545：以空白或 tab 開頭的行接在上一行後面；回傳 (行號, 內容)
+    current, start = None, 0
+    for number, raw in enumerate(lines, 1):
+        line = raw.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, number
+    if current:
+        yield start, current
+
+
+def _unescape(text):
+    out = []
+    i = 0
+    while i < len(text):
+        if text[i] == "\\" and i + 1 < len(text):
+            out.append("\n" if text[i + 1] in "nN" else text[i + 1])
+            i += 2
+        else:
+            out.append(text[i])
+            i += 1
+    return "".join(out)
+
+
+def _ics_datetime(value, params, calendar_tz):
+    # 回傳 (日期, 時間)；全天的事件時間是 ""。
+    # 有 TZID 的照事件本身的時區顯示 (通常就是當地時間)；UTC (Z 結尾) 換成行事曆的時區
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return _date(value), ""
+    utc = value.endswith("Z")
+    try:
+        moment = datetime.strptime(value.rstrip("Z")[:15], "%Y%m%dT%H%M%S")
+    except ValueError:
+        return None, None
+    if utc and calendar_tz is not None:
+        moment = moment.replace(tzinfo=timezone.utc).astimezone(calendar_tz)
+    return moment.strftime("%Y-%m-%d"), moment.strftime("%H:%M")
+
+
+def _zone(name):
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+    except Exception:
+        return None
+
+
+def iter_ics(lines):
+    # 逐行讀 ICS，每個 VEVENT 產生一筆 (行號, {"日期", "開始時間", "結束時間", "活動", "地圖連結", "備註", "地點"})
+    stack = []
+    event = None
+    calendar_tz = None
+    for number, line in _unfold(lines):
+        head, _, value = line.partition(":")
+        name, *param_list = head.split(";")
+        name = name.upper()
+        params = dict(p.split("=", 1) for p in param_list if "=" in p)
+        if name == "BEGIN":
+            stack.append(value.strip().upper())
+            if stack[-1] == "VEVENT":
+                event = (number, {"_params": {}})
+            continue
+        if name == "END":
+            if stack and stack.pop() == "VEVENT" and event is not None:
+                yield _event_record(*event, calendar_tz)
+                event = None
+            continue
+        if name == "X-WR-TIMEZONE" and stack == ["VCALENDAR"]:
+            calendar_tz = _zone(value.strip())
+        # VEVENT 裡面的 VALARM 等子元件的欄位不要蓋掉事件本身的
+        if event is not None and stack and stack[-1] == "VEVENT":
+            event[1][name] = value
+            event[1]["_params"][name] = params
+
+
+def _event_record(number, props, calendar_tz):
+    params = props["_params"]
+    day, start = _ics_datetime(props.get("DTSTART", ""), params.get("DTSTART", {}), calendar_tz)
+    _, end = _ics_datetime(props.get("DTEND", ""), params.get("DTEND", {}), calendar_tz) if "DTEND" in props else (None, "")
+    return number, {
+        "日期": day or props.get("DTSTART", ""),
+        "開始時間": start or "",
+        "結束時間": end or "",
+        "活動": _unescape(props.get("SUMMARY", "")).strip(),
+        "地圖連結": props.get("URL", "").strip(),
+        "備註": _unescape(props.get("DESCRIPTION", "")).strip(),
+        "地點": _unescape(props.get("LOCATION", "")).strip(),
+    }
+
+
+# --- CSV 解析 ---
+def iter_csv(lines):
+    # csv.reader 本身就是一行一行讀；第一列是表頭，欄名對應到 CSV_ALIASES
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [CSV_ALIASES.get(h.strip().lstrip("\ufeff").lower()) for h in header]
+    for values in reader:
+        if not any(v.strip() for v in values):
+            continue
+        record = {}
+        for column, value in zip(columns, values):
+            if column is not None:
+                record[column] = value.strip()
+        yield reader.line_num, record
+
+
+# --- 匯入 ---
+def to_item_row(record, country_name, valid_dates):
+    # 回傳 (列, None) 或 (None, 錯誤訊息)
+    name = record.get("活動", "")
+    day = _date(record.get("日期"))
+    start = _time(record.get("開始時間"))
+    end = _time(record.get("結束時間")) if record.get("結束時間") else ""
+    if not name:
+        return None, "沒有名稱"
+    if day is None:
+        return None, f"「{name}」的日期看不懂：{record.get('日期', '')}"
+    if day not in valid_dates:
+        return None, f"「{name}」的日期 {day} 不在旅程期間內"
+    if not start:
+        return None, f"「{name}」沒有開始時間"
+    if end is None:
+        return None, f"「{name}」的結束時間看不懂：{record.get('結束時間', '')}"
+    note = record.get("備註", "")
+    location = record.get("地點", "")
+    if location and location not in note:
+        note = f"{note}\n📍 {location}".strip()
+    url = record.get("地圖連結", "") or map_url(country_name, name)
+    return [day, start, end, name, url, note], None
+
+
+def text_lines(binary):
+    # 上傳的檔案 (bytes 的 file-like) 邊讀邊解碼成一行一行的文字；UTF-8 BOM 會被拿掉
+    # 讀完 detach，不要連帶關掉原本的檔案 (同一個上傳檔 rerun 時還會再讀)
+    if binary.seekable():
+        binary.seek(0)
+    lines = io.TextIOWrapper(binary, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        yield from lines
+    finally:
+        lines.detach()
+
+
+def parse_import(binary, filename, country_name, date_range, existing=()):
+    # 回傳 (要新增的列, 錯誤 [(行號, 訊息)], 跳過的重複筆數)
+    # existing：旅程裡已經有的列，同一天同時間同名稱的不再加一次 (重複匯入同一個檔案時)
+    lines = text_lines(binary)
+    is_ics = filename.lower().endswith((".ics", ".ical"))
+    records = iter_ics(lines) if is_ics else iter_csv(lines)
+    valid_dates = set(date_range)
+    seen = {(r[0], r[1], r[3]) for r in existing}
+    rows, errors, duplicates = [], [], 0
+    for number, record in records:
+        row, error = to_item_row(record, country_name, valid_dates)
+        if error is not None:
+            if len(errors) < MAX_ERRORS:
+                errors.append((number, error))
+            continue
+        key = (row[0], row[1], row[3])
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        rows.append(row)
+        if len(rows) >= MAX_IMPORT_ROWS:
+            errors.append((number, f"一次最多匯入 {MAX_IMPORT_ROWS} 筆，後面的沒有讀"))
+            break
+    return rows, errors, duplicates
+
+
+# --- 匯出 ---
+def _escape(text):
+    return str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+
+def _fold(line):
+    # 每行最多 75 個 byte，接續行開頭加一個空白；不能把一個中文字切成兩半
+    encoded = line.encode("utf-8")
+    if len(encoded) <= ICS_LINE_OCTETS:
+        return line + "\r\n"
+    parts, current, size = [], [], 0
+    for ch in line:
+        width = len(ch.encode("utf-8"))
+        limit = ICS_LINE_OCTETS - (1 if parts else 0)
+        if size + width > limit:
+            parts.append("".join(current))
+            current, size = [], 0
+        current.append(ch)
+        size += width
+    parts.append("".join(current))
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _stamp(day, hhmm):
+    return f"{day.replace('-', '')}T{hhmm.replace(':', '')}00"
+
+
+def export_ics(trip_name, rows):
+    # rows：依時間排序的行程列 (ITEM_HEADERS 順序)；一個事件一段字串
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "".join(_fold(line) for line in (
+        "BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//travel-planner//itinerary//ZH", "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_escape(trip_name)}",
+    ))
+    for row in rows:
+        day, start, end, name, url, note = (list(row) + [""] * 6)[:6]
+        if _date(day) is None:
+            continue
+        start, end = _time(start), _time(end)
+        lines = ["BEGIN:VEVENT", f"UID:{row_hash(list(row))}@travel-planner", f"DTSTAMP:{stamp}"]
+        if start:
+            lines.append(f"DTSTART:{_stamp(day, start)}")
+            if end and end > start:
+                lines.append(f"DTEND:{_stamp(day, end)}")
+        else:
+            next_day = (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y%m%d")
+            lines += [f"DTSTART;VALUE=DATE:{day.replace('-', '')}", f"DTEND;VALUE=DATE:{next_day}"]
+        lines.append(f"SUMMARY:{_escape(name)}")
+        if note:
+            lines.append(f"DESCRIPTION:{_escape(note)}")
+        if url:
+            lines.append(f"URL:{url}")
+        lines.append("END:VEVENT")
+        yield "".join(_fold(line) for line in lines)
+    yield _fold("END:VCALENDAR")
+
+
+def export_csv(rows):
+    # 一列一段字串；表頭跟試算表一樣，可以直接再匯入
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ITEM_HEADERS)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow((list(row) + [""] * len(ITEM_HEADERS))[:len(ITEM_HEADERS)])
+        yield buffer.getvalue()
+
+
+def spool(chunks, bom=False):
+    # 把 generator 的輸出依序編碼成 bytes (給 st.download_button 的 callable)
+    out = io.BytesIO()
+    if bom:
+        out.write(codecs.BOM_UTF8)  # Excel 才認得是 UTF-8
+    for chunk in chunks:
+        out.write(chunk.encode("utf-8"))
+    return out.getvalue()
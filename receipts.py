@@ -0,0 +1,119 @@
+import contextvars
+import hashlib
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import instrument
+import singleflight
+
+# --- 收據辨識 ---
+# 手機照片動輒 4-12 MB，直接丟給 Gemini 又慢又貴。上傳前先：
+#   1. 依 EXIF 轉正 (不然直拍的收據會躺著)
+#   2. 長邊縮到 MAX_SIDE，再壓成 JPEG
+# 同一張照片 (內容 hash 一樣) 辨識過就直接用快取結果。
+# 多張收據用 thread pool 同時送出，結果檢查成 {item, amount, category}。
+# 同一張照片同時在兩個 session 上傳時只辨識一次 (single-flight)。
+
+MAX_SIDE = 1600
+JPEG_QUALITY = 80
+RECEIPT_TTL = 90 * 24 * 3600
+CATEGORIES = ["交通", "住宿", "飲食", "購物", "其他"]
+
+RECEIPT_PROMPT = (
+    "請分析這張收據，並以 JSON 格式回傳："
+    '{"item": "項目名稱", "amount": 數字金額, "category": "交通/住宿/飲食/購物/其他"}。'
+    "amount 只要總金額的數字，不要幣值符號或千分位。"
+)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def prepare_image(data, max_side=MAX_SIDE, quality=JPEG_QUALITY):
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def validate_receipt(obj):
+    if not isinstance(obj, dict):
+        raise ValueError("回傳內容不是 JSON 物件")
+    item = str(obj.get("item") or "").strip() or "收據"
+    raw = obj.get("amount")
+    try:
+        amount = float(str(raw).replace(",", "").strip())
+    except (TypeError, ValueError):
+        raise ValueError(f"金額無法辨識：{raw!r}")
+    if amount < 0:
+        raise ValueError(f"金額不可為負數：{amount}")
+    category = str(obj.get("category") or "").strip()
+    if category not in CATEGORIES:
+        category = "其他"
+    return {"item": item, "amount": amount, "category": category}
+
+
+def _recognize(model, data):
+    jpeg = prepare_image(data)
+    response = model.generate_content(
+        [RECEIPT_PROMPT, {"mime_type": "image/jpeg", "data": jpeg}],
+        generation_config={"response_mime_type": "application/json"},
+    )
+    text = response.text.replace("```json", "").replace("```", "").strip()
+    try:
+        return validate_receipt(json.loads(text))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"AI 回傳的不是合法 JSON：{e}")
+
+
+def analyze_receipt(model, data, cache=None):
+    # data 是上傳檔案的原始 bytes；回傳 {"item", "amount", "category"}，失敗會丟 ValueError
+    key = content_hash(data)
+    if cache is not None:
+        cached = instrument.cache_result("gemini", "receipt", cache.get(key))
+        if cached is not None:
+            return cached
+    result = singleflight.do(("receipt", key), _recognize, model, data)
+    if cache is not None:
+        cache.set(key, result, RECEIPT_TTL)
+    return result
+
+
+def analyze_receipts(model, files, cache=None, max_workers=4):
+    # files: [(檔名, bytes)]；回傳跟輸入同順序的 [{"name", "item", "amount", "category", "error"}]
+    # 同一批裡重複的照片只送一次
+    by_hash = {}
+    for name, data in files:
+        by_hash.setdefault(content_hash(data), data)
+
+    def run(data):
+        try:
+            return analyze_receipt(model, data, cache), None
+        except Exception as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(by_hash)))) as pool:
+        futures = {h: pool.submit(contextvars.copy_context().run, run, data) for h, data in by_hash.items()}
+        done = {h: f.result() for h, f in futures.items()}
+
+    results = []
+    seen = set()
+    for name, data in files:
+        h = content_hash(data)
+        result, error = done[h]
+        row = {"name": name, "item": "", "amount": 0.0, "category": "其他", "error": error or ""}
+        if h in seen:
+            row["error"] = "重複的收據，已略過"
+        elif result is not None:
+            row.update(result)
+        seen.add(h)
+        results.append(row)
+    return results
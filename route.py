@@ -0,0 +1,271 @@
+import re
+import time
+
+from storage import BOOKING_PREFIXES
+
+# --- 一天的路線最佳化 ---
+# 給一天的行程與兩兩之間的交通時間，重新排「可以移動」的景點順序讓交通時間最少：
+#   1. nearest-neighbour 建立初始順序 (下一個固定行程快到了就先去那裡)
+#   2. 2-opt (反轉一段) + Or-opt (把 1~3 站搬到別的位置) 反覆改善，直到沒有進步或時間用完
+# 固定行程 (航班、飯店入住 / 退房、有預約的項目) 是時間窗：可以早到等，遲到就重罰。
+# 第一站維持不變 (通常是飯店出發或當天第一個行程)。
+# 25 站以內純 Python 大約幾毫秒到幾十毫秒；TIME_BUDGET 是保險上限。
+
+DEFAULT_STAY = 60          # 沒有結束時間的景點預設停留分鐘數
+HOTEL_STAY = 15            # 入住 / 退房本身花的時間
+UNKNOWN_TRAVEL = 30        # 查不到交通時間時先當作 30 分鐘
+LATE_PENALTY = 1000        # 固定行程每遲到 1 分鐘，成本等於多坐 1000 分鐘的車
+TIME_BUDGET = 0.05         # 秒
+ROUND_TO = 5               # 新的開始時間取整到 5 分鐘
+DAY_END = 24 * 60 - 1      # 23:59；排到這之後的行程不跨到隔天，停在 23:59 並回報 overflow
+
+RESERVATION_HINTS = ("預約", "訂位", "預訂", "門票", "reservation", "booking")
+ARRIVAL_RE = re.compile(r"🛫\s*([A-Z]{3})")
+
+
+def is_fixed(row):
+    name = str(row.get("活動") or "")
+    note = str(row.get("備註") or "").lower()
+    return name.startswith(BOOKING_PREFIXES) or any(h in note for h in RESERVATION_HINTS)
+
+
+def place_of(row):
+    # 拿去查交通時間的地點：飯店用飯店名稱 (入住列的備註是地址)、航班用抵達機場
+    name = str(row.get("活動") or "")
+    if name.startswith("✈️"):
+        m = ARRIVAL_RE.search(name)
+        return f"{m.group(1)} airport" if m else name
+    if name.startswith(("🏨", "🔑")):
+        note = str(row.get("備註") or "").strip()
+        if name.startswith("🏨") and note:
+            return note
+        return name.split(":", 1)[-1].strip()
+    return name
+
+
+def _valid(value):
+    return value is not None and value == value  # 排除 NaN
+
+
+def _stay(row):
+    start, end = row.get("start_min"), row.get("end_min")
+    if _valid(start) and _valid(end) and end > start:
+        return int(end - start)
+    return DEFAULT_STAY
+
+
+def time_window(row, fixed):
+    # 回傳 (最早, 最晚抵達, 停留分鐘)；None 表示沒有限制
+    #   航班 / 預約：準時到 (最早 = 最晚 = 開始時間)
+    #   飯店入住：開始時間之後才能入住，晚到沒關係
+    #   飯店退房：結束時間之前要離開
+    name = str(row.get("活動") or "")
+    start = int(row["start_min"]) if _valid(row.get("start_min")) else None
+    end = int(row["end_min"]) if _valid(row.get("end_min")) else None
+    if name.startswith("🏨"):
+        return start, None, HOTEL_STAY
+    if name.startswith("🔑"):
+        return None, end, HOTEL_STAY
+    if fixed:
+        return start, start, _stay(row)
+    return None, None, _stay(row)
+
+
+def hhmm(minutes):
+    # 超過一天的時間停在 23:59，不繞回 00:00 (不然會變成當天一早的行程)
+    minutes = min(max(int(minutes), 0), DAY_END)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class DayPlan:
+    def __init__(self, items, travel, fixed):
+        # items: 這一天依時間排序的行程 (itinerary 的 row dict)
+        # travel: {(地點, 地點): 秒數或 None}
+        # fixed: 固定行程在 items 裡的 index 集合 (固定行程的時間不會被改)
+        self.items = items
+        self.n = len(items)
+        self.places = [place_of(r) for r in items]
+        self.fixed = [i in fixed for i in range(self.n)]
+        windows = [time_window(r, self.fixed[i]) for i, r in enumerate(items)]
+        self.earliest = [w[0] for w in windows]
+        self.latest = [w[1] for w in windows]
+        self.stay = [w[2] for w in windows]
+        # 一天從第一個「真的有開始時間」的行程算起 (退房列的 00:00 不算)
+        starts = [int(r["start_min"]) for r in items if _valid(r.get("start_min")) and not str(r.get("活動") or "").startswith("🔑")]
+        self.day_start = min(starts) if starts else 9 * 60
+        # 交通時間 (分鐘) 轉成 list of lists，評估時不用查 dict
+        self.unknown = 0
+        self.minutes = [[0] * self.n for _ in range(self.n)]
+        for i in range(self.n):
+            for j in range(self.n):
+                if i == j or self.places[i] == self.places[j]:
+                    continue
+                seconds = travel.get((self.places[i], self.places[j]))
+                if seconds is None:
+                    self.unknown += 1
+                    self.minutes[i][j] = UNKNOWN_TRAVEL
+                else:
+                    self.minutes[i][j] = (seconds + 59) // 60
+
+    def evaluate(self, order):
+        # 回傳 (成本, 交通分鐘, 遲到分鐘)
+        t = self.day_start
+        travel = late = 0
+        prev = None
+        minutes, earliest, latest, stay = self.minutes, self.earliest, self.latest, self.stay
+        for i in order:
+            if prev is not None:
+                m = minutes[prev][i]
+                travel += m
+                t += m
+            if latest[i] is not None and t > latest[i]:
+                late += t - latest[i]
+            if earliest[i] is not None and t < earliest[i]:
+                t = earliest[i]
+            t += stay[i]
+            prev = i
+        return travel + LATE_PENALTY * late, travel, late
+
+    def schedule(self, order):
+        # 依新順序排出可移動景點的 (開始, 結束) 分鐘；固定行程不在結果裡 (時間不動)
+        times = {}
+        t = self.day_start
+        prev = None
+        for i in order:
+            if prev is not None:
+                t += self.minutes[prev][i]
+            if self.earliest[i] is not None and t < self.earliest[i]:
+                t = self.earliest[i]
+            if not self.fixed[i]:
+                t = -(-t // ROUND_TO) * ROUND_TO
+                times[i] = (t, t + self.stay[i])
+            t += self.stay[i]
+            prev = i
+        return times
+
+
+def _nearest_neighbour(plan):
+    order = [0]
+    remaining = set(range(1, plan.n))
+    t = max(plan.day_start, plan.earliest[0] or 0) + plan.stay[0]
+    cur = 0
+    while remaining:
+        # 最早要趕到的那個固定行程
+        due = min((i for i in remaining if plan.latest[i] is not None), key=lambda i: plan.latest[i], default=None)
+
+        def feasible(i):
+            arrive = t + plan.minutes[cur][i]
+            if plan.earliest[i] is not None and arrive < plan.earliest[i]:
+                return False  # 還沒到時間 (例如還不能入住)
+            if due is None or i == due:
+                return True
+            # 去這一站再趕到下一個固定行程還來得及的才考慮
+            return arrive + plan.stay[i] + plan.minutes[i][due] <= plan.latest[due]
+
+        candidates = [i for i in remaining if feasible(i)]
+        if candidates:
+            nxt = min(candidates, key=lambda i: plan.minutes[cur][i])
+        elif due is not None:
+            nxt = due
+        else:
+            nxt = min(remaining, key=lambda i: (plan.earliest[i] or 0, plan.minutes[cur][i]))
+        t += plan.minutes[cur][nxt]
+        if plan.earliest[nxt] is not None:
+            t = max(t, plan.earliest[nxt])
+        t += plan.stay[nxt]
+        order.append(nxt)
+        remaining.discard(nxt)
+        cur = nxt
+    return order
+
+
+def _two_opt(plan, order, cost, deadline):
+    n = len(order)
+    improved = False
+    for i in range(1, n - 1):
+        for j in range(i + 1, n):
+            candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+            c = plan.evaluate(candidate)[0]
+            if c < cost:
+                order, cost, improved = candidate, c, True
+        if time.perf_counter() > deadline:
+            break
+    return order, cost, improved
+
+
+def _or_opt(plan, order, cost, deadline):
+    n = len(order)
+    improved = False
+    for length in (1, 2, 3):
+        for i in range(1, n - length + 1):
+            segment = order[i:i + length]
+            rest = order[:i] + order[i + length:]
+            for k in range(1, len(rest) + 1):
+                if k == i:
+                    continue
+                candidate = rest[:k] + segment + rest[k:]
+                c = plan.evaluate(candidate)[0]
+                if c < cost:
+                    order, cost, improved = candidate, c, True
+                    break
+            if time.perf_counter() > deadline:
+                return order, cost, improved
+    return order, cost, improved
+
+
+def optimize(plan, time_budget=TIME_BUDGET):
+    # 回傳新的順序 (items 的 index list)；比原本好才換
+    original = list(range(plan.n))
+    if plan.n < 3:
+        return original
+    deadline = time.perf_counter() + time_budget
+    order = _nearest_neighbour(plan)
+    cost = plan.evaluate(order)[0]
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        order, cost, a = _two_opt(plan, order, cost, deadline)
+        order, cost, b = _or_opt(plan, order, cost, deadline)
+        improved = a or b
+    return order if cost < plan.evaluate(original)[0] else original
+
+
+def optimize_day(items, travel, fixed=None, time_budget=TIME_BUDGET):
+    # items: 依時間排序的一天行程；travel: TravelClient.durations 的結果
+    # 回傳 {"order", "times", "overflow", "travel_before", "travel_after", "late_before", "late_after", "unknown", "ms"}
+    # overflow：結束時間超過 23:59 的可移動行程 (index list)，寫回時會停在 23:59
+    started = time.perf_counter()
+    if fixed is None:
+        fixed = {i for i, r in enumerate(items) if is_fixed(r)}
+    plan = DayPlan(items, travel, set(fixed))
+    order = optimize(plan, time_budget)
+    _, travel_before, late_before = plan.evaluate(list(range(plan.n)))
+    _, travel_after, late_after = plan.evaluate(order)
+    times = plan.schedule(order)
+    return {
+        "order": order,
+        "times": times,
+        "overflow": [i for i in order if i in times and times[i][1] > DAY_END],
+        "travel_before": travel_before,
+        "travel_after": travel_after,
+        "late_before": late_before,
+        "late_after": late_after,
+        "unknown": plan.unknown,
+        "ms": (time.perf_counter() - started) * 1000,
+    }
+
+
+def reordered_rows(items, result, date_str):
+    # 依最佳化結果產生要寫回的列：{row_id: [日期, 開始, 結束, 活動, 地圖連結, 備註]}，只包含有變動的列
+    updates = {}
+    if result["order"] == list(range(len(items))):
+        return updates
+    for i in result["order"]:
+        if i not in result["times"]:
+            continue  # 固定行程不改時間
+        row = items[i]
+        start, end = result["times"][i]
+        new = [date_str, hhmm(start), hhmm(end), row["活動"], row["地圖連結"], row["備註"]]
+        old = [row["日期"], row["開始時間"], row["結束時間"], row["活動"], row["地圖連結"], row["備註"]]
+        if new != old:
+            updates[row["row_id"]] = new
+    return updates
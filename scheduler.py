@@ -0,0 +1,252 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# --- 外部 API 排程 (配額 + 優先順序 + 重試) ---
+# 所有 Sheets / Maps / Gemini 呼叫都經過 call()：
+#   1. 每個 API 一個 token bucket，速率設在配額上限，等 token 的呼叫排隊，不會一起撞牆
+#   2. 排隊時依優先順序放行：使用者的寫入 > 畫面正在等的讀取 > 背景預先抓取 / 同步
+#   3. 遇到 429 / 503 (或 Maps 的 OVER_QUERY_LIMIT) 用指數退避 + 抖動重試，
+#      而且整個 bucket 一起暫停，其他呼叫也跟著等，不會繼續打出更多錯誤
+#   4. 使用者換頁 / 換旅程後，還在排隊的舊工作可以用 cancel(tag) 丟掉
+# 優先順序與 tag 用 context() 設定，同一個執行緒 (或 copy_context) 之後的呼叫都會套用。
+
+INTERACTIVE = 0   # 使用者按下去的寫入
+FOREGROUND = 1    # 畫面正在等的讀取 (預設)
+BACKGROUND = 2    # 預先抓取、背景同步
+
+# (每秒補充的 token, bucket 容量)；cost 的單位：sheets = request、maps = element、gemini = request
+# Sheets：每個使用者每分鐘讀 / 寫各 60 次；Distance Matrix：每分鐘 60,000 elements；Geocoding：每秒 50 次
+LIMITS = {
+    "sheets_read": (1.0, 10),
+    "sheets_write": (1.0, 10),
+    "maps": (1000.0, 1000),
+    "geocode": (50.0, 50),
+    "gemini": (float(os.environ.get("TRAVEL_PLANNER_GEMINI_RPM", "60")) / 60, 5),
+}
+RETRY_STATUS = (429, 500, 503)
+MAX_RETRIES = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 32.0
+DEFAULT_TIMEOUT = 120.0
+
+_priority = contextvars.ContextVar("priority", default=FOREGROUND)
+_tag = contextvars.ContextVar("tag", default=None)
+
+
+class Throttled(Exception):
+    # 回應本身 (不是例外) 表示被限流時，由呼叫端丟出，例如 Maps 的 OVER_QUERY_LIMIT
+    def __init__(self, status=429, message=""):
+        super().__init__(message or f"throttled ({status})")
+        self.status = status
+
+
+class Stale(Exception):
+    """排隊中的工作被 cancel() 丟掉了"""
+
+
+class QuotaTimeout(Exception):
+    """等 token 等超過期限"""
+
+
+def status_code(error):
+    # gspread APIError / requests HTTPError / google.api_core 的例外都整理成 HTTP 狀態碼
+    if isinstance(error, Throttled):
+        return error.status
+    response = getattr(error, "response", None)
+    code = getattr(response, "status_code", None) or getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    name = type(error).__name__
+    if name in ("ResourceExhausted", "TooManyRequests"):
+        return 429
+    if name in ("ServiceUnavailable", "InternalServerError"):
+        return 503
+    return None
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "cost", "tag", "cancelled")
+
+    def __init__(self, priority, seq, cost, tag):
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.tag = tag
+        self.cancelled = False
+
+
+class TokenBucket:
+    # clock：測試時可以換成假的時鐘
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.paused_until = 0.0
+        self._clock = clock
+        self._updated = clock()
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, cost=1, priority=FOREGROUND, tag=None, timeout=DEFAULT_TIMEOUT):
+        # 排在最前面 (優先順序最高、最早來) 的人拿到足夠的 token 才放行
+        deadline = self._clock() + timeout
+        with self._cond:
+            self._seq += 1
+            waiter = _Waiter(priority, self._seq, cost, tag)
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    if waiter.cancelled:
+                        raise Stale()
+                    now = self._clock()
+                    self._refill(now)
+                    head = min(self._waiters, key=lambda w: (w.priority, w.seq))
+                    # 比 bucket 還大的 cost 只要 bucket 滿了就放行 (先借後還)
+                    need = min(cost, self.burst)
+                    if head is waiter and now >= self.paused_until and self.tokens >= need:
+                        self.tokens -= cost
+                        return
+                    if now >= deadline:
+                        raise QuotaTimeout(f"等待配額超過 {timeout:.0f} 秒")
+                    if head is waiter:
+                        wait = max(self.paused_until - now, (need - self.tokens) / self.rate, 0.001)
+                    else:
+                        wait = 0.5  # 輪到自己時會被 notify 叫醒
+                    self._cond.wait(min(wait, deadline - now))
+            finally:
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+
+    def pause(self, seconds):
+        # 被限流時整個 bucket 暫停，並把已經累積的 token 清掉
+        with self._cond:
+            self.paused_until = max(self.paused_until, self._clock() + seconds)
+            self.tokens = min(self.tokens, 0.0)
+            self._cond.notify_all()
+
+    def cancel(self, tag):
+        with self._cond:
+            found = False
+            for waiter in self._waiters:
+                if waiter.tag == tag:
+                    waiter.cancelled = True
+                    found = True
+            if found:
+                self._cond.notify_all()
+        return found
+
+    def queued(self):
+        with self._cond:
+            return len(self._waiters)
+
+
+class Scheduler:
+    def __init__(self, limits=None, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, clock=time.monotonic, sleep=time.sleep):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._clock = clock
+        self._sleeper = sleep
+        self.buckets = {api: TokenBucket(rate, burst, clock) for api, (rate, burst) in (limits or LIMITS).items()}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def call(self, api, fn, *args, cost=1, priority=None, tag=None, timeout=DEFAULT_TIMEOUT, retries=None, **kwargs):
+        priority = _priority.get() if priority is None else priority
+        tag = _tag.get() if tag is None else tag
+        retries = self.max_retries if retries is None else retries
+        bucket = self.buckets[api]
+        for attempt in range(retries + 1):
+            self._check(tag)
+            bucket.acquire(cost, priority, tag, timeout)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                status = status_code(e)
+                if status not in RETRY_STATUS or attempt == retries:
+                    raise
+                self.throttled += 1
+                # full jitter：0 ~ base * 2^attempt，上限 MAX_DELAY
+                delay = random.uniform(0, min(MAX_DELAY, self.base_delay * (2 ** attempt)))
+                if status == 429:
+                    bucket.pause(delay)
+                else:
+                    self._sleep(delay, tag)
+
+    def _sleep(self, seconds, tag):
+        # 等重試的期間被取消就不用再等
+        deadline = self._clock() + seconds
+        while self._clock() < deadline:
+            self._check(tag)
+            self._sleeper(min(0.25, deadline - self._clock()))
+
+    def _check(self, tag):
+        if tag is not None:
+            with self._lock:
+                if tag in self._cancelled:
+                    raise Stale()
+
+    def cancel(self, tag):
+        # 丟掉這個 tag 還在排隊 / 等重試的工作；已經送出去的呼叫不受影響
+        with self._lock:
+            self._cancelled.add(tag)
+        for bucket in self.buckets.values():
+            bucket.cancel(tag)
+
+    def release(self, tag):
+        # tag 用完後清掉紀錄 (例如 Future 結束時)
+        with self._lock:
+            self._cancelled.discard(tag)
+
+    def stats(self):
+        return {"queued": {api: b.queued() for api, b in self.buckets.items()}, "throttled": self.throttled}
+
+
+scheduler = Scheduler()
+call = scheduler.call
+cancel = scheduler.cancel
+release = scheduler.release
+
+
+@contextmanager
+def context(priority=None, tag=None):
+    # with scheduler.context(BACKGROUND): ...  裡面所有的呼叫都用這個優先順序 / tag
+    tokens = []
+    if priority is not None:
+        tokens.append((_priority, _priority.set(priority)))
+    if tag is not None:
+        tokens.append((_tag, _tag.set(tag)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def run_with(priority, tag, fn, *args, **kwargs):
+    # 給 executor.submit 用：在指定的優先順序 / tag 底下執行 fn
+    with context(priority, tag):
+        return fn(*args, **kwargs)
+
+
+# --- Gemini ---
+class ScheduledModel:
+    # GenerativeModel 包一層：每次 generate_content 都先拿 gemini 的 token，被限流就退避重試
+    # 串流只有「送出 request」這一步會重試，收到一半的串流不會重來
+    def __init__(self, model):
+        self._model = model
+
+    def generate_content(self, *args, **kwargs):
+        return call("gemini", self._model.generate_content, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
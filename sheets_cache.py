@@ -0,0 +1,156 @@
+import threading
+import time
+
+import gspread
+
+import instrument
+import scheduler
+import singleflight
+
+# --- Google Sheets 讀取快取 ---
+# Streamlit 每次 rerun 都會重新執行 app.py，但被 import 的模組只會載入一次，
+# 所以把快取放在這裡就能跨 rerun、跨 session 共用。
+# 規則：
+#   1. TTL 內直接回傳快取 (0 次 API 呼叫)
+#   2. TTL 過期後先比對試算表的最後修改時間 (一次便宜的 Drive metadata 呼叫)，
+#      沒變就續命，有變才重新抓資料
+#   3. 寫入路徑只清掉自己動到的那幾個 key
+#   4. 多個 session 同時 miss 同一個 key 時只打一次 API (single-flight)
+
+LISTING_KEY = ("worksheets",)
+VERSION_KEY = ("version",)
+
+
+def values_key(title):
+    return ("values", title)
+
+
+class _Entry:
+    __slots__ = ("value", "fetched_at", "version")
+
+    def __init__(self, value, fetched_at, version):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.version = version
+
+
+class SheetsCache:
+    def __init__(self, spreadsheet, ttl=300, version_check_interval=30):
+        self.spreadsheet = spreadsheet
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._flights = singleflight.Group()
+
+    # 試算表最後修改時間，同一段時間內多個過期 entry 共用一次查詢
+    def _current_version(self, force=False):
+        now = time.monotonic()
+        if not force and self._version is not None and now - self._version_checked_at < self.version_check_interval:
+            return self._version
+        try:
+            version = self._flights.do(VERSION_KEY, scheduler.call, "sheets_read", self._read_version, abandon=(scheduler.Stale,))
+        except Exception:
+            # 查不到版本就當作有變動，交給 TTL 處理
+            version = None
+        self._version = version
+        self._version_checked_at = now
+        return version
+
+    def _read_version(self):
+        with instrument.track("sheets", "lastUpdateTime"):
+            if hasattr(self.spreadsheet, "get_lastUpdateTime"):
+                return self.spreadsheet.get_lastUpdateTime()
+            return self.spreadsheet.lastUpdateTime
+
+    @staticmethod
+    def _fetch(key, fetch):
+        with instrument.track("sheets", key[0]) as record:
+            value = fetch()
+            if key[0] == "values":
+                record["bytes"] = sum(len(c) for row in value for c in row)
+        return value
+
+    def _get(self, key, fetch):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            if now - entry.fetched_at < self.ttl:
+                self.hits += 1
+                instrument.event("sheets", key[0], cache="hit")
+                return entry.value
+            version = self._current_version()
+            if version is not None and version == entry.version:
+                entry.fetched_at = now
+                self.hits += 1
+                instrument.event("sheets", key[0], cache="hit")
+                return entry.value
+
+        self.misses += 1
+        version = self._current_version()
+        # 經過 scheduler：配額用完會排隊等，被限流會退避重試；同時 miss 的 session 共用同一次呼叫
+        value = self._flights.do(key, scheduler.call, "sheets_read", self._fetch, key, fetch, abandon=(scheduler.Stale,))
+        with self._lock:
+            self._entries[key] = _Entry(value, time.monotonic(), version)
+        return value
+
+    # --- 讀取 ---
+    def worksheets(self):
+        # 回傳 {title: Worksheet}，之後拿 Worksheet 物件就不用再打 API
+        return self._get(LISTING_KEY, lambda: {ws.title: ws for ws in self.spreadsheet.worksheets()})
+
+    def titles(self):
+        return list(self.worksheets().keys())
+
+    def worksheet(self, title):
+        ws = self.worksheets().get(title)
+        if ws is None:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return ws
+
+    def values(self, title):
+        ws = self.worksheet(title)
+        return self._get(values_key(title), ws.get_all_values)
+
+    def refresh_if_changed(self, since):
+        # 給背景同步用：立刻查版本，跟呼叫的人上次同步時的版本 since 比，有變就把快取全部丟掉。
+        # 不能跟 self._version 比：畫面的讀取 (TTL 過期、titles()) 也會更新它，背景同步就會漏掉遠端的修改。
+        # 回傳 (是否有變, 目前版本)
+        version = self._current_version(force=True)
+        if version is not None and version == since:
+            return False, version
+        with self._lock:
+            self._entries.clear()
+        self._flights.forget()
+        return True, version
+
+    @property
+    def shared(self):
+        # 同時 miss、共用別人那一次呼叫的次數
+        return self._flights.shared
+
+    # --- 失效 ---
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        self._flights.forget(*keys)
+        # 自己寫入後版本一定會變，下次需要時重新查
+        self._version = None
+
+    def invalidate_values(self, *titles):
+        self.invalidate(*[values_key(t) for t in titles])
+
+    def invalidate_listing(self):
+        self.invalidate(LISTING_KEY)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self._flights.forget()
+        self._version = None
@@ -0,0 +1,110 @@
+import threading
+
+# --- Single-flight：同樣的請求同時只送一次 ---
+# 家人同時打開同一個旅程時，每個 session 都會去抓同一張工作表、問同一個景點的建議。
+# 同一個 key 已經有人在查 (leader)，後來的人 (follower) 就等那一次的結果：
+#   - leader 成功：所有 follower 拿到同一個結果
+#   - leader 失敗：follower 收到同一個例外
+#   - leader 半途放棄 (例如串流被使用者關掉、工作被取消)：follower 自己重新查
+#   - follower 等超過 timeout：丟 FlightTimeout，leader 不受影響
+# 只合併「同時」進行的請求，結果不會留下來 (快取是各模組自己的事)。
+
+DEFAULT_TIMEOUT = 60.0
+
+
+class FlightTimeout(TimeoutError):
+    pass
+
+
+class Abandoned(Exception):
+    """leader 沒有拿到結果就離開了，follower 應該自己重新查"""
+
+
+class Flight:
+    __slots__ = ("_done", "_value", "_error", "followers")
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+        self.followers = 0
+
+    def set_result(self, value):
+        self._value = value
+        self._done.set()
+
+    def set_exception(self, error):
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=DEFAULT_TIMEOUT):
+        if not self._done.wait(timeout):
+            raise FlightTimeout(f"等待進行中的請求超過 {timeout:.0f} 秒")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class Group:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.shared = 0   # follower 共用結果的次數 (= 省下的外部呼叫)
+
+    def join(self, key):
+        # 回傳 (flight, 是否為 leader)；leader 一定要呼叫 finish()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.shared += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def finish(self, key, flight, value=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if error is not None:
+            flight.set_exception(error)
+        else:
+            flight.set_result(value)
+
+    def forget(self, *keys):
+        # 資料已經被改過 (例如自己剛寫入)：進行中的那次讓它跑完，但之後來的人要重新查
+        with self._lock:
+            for key in keys or list(self._flights):
+                self._flights.pop(key, None)
+
+    def do(self, key, fn, *args, timeout=DEFAULT_TIMEOUT, abandon=(), **kwargs):
+        # abandon：leader 遇到這些例外時不傳給 follower (例如只屬於 leader 自己的取消)，
+        # follower 改成自己重新查
+        while True:
+            flight, leader = self.join(key)
+            if not leader:
+                try:
+                    return flight.wait(timeout)
+                except Abandoned:
+                    continue
+            try:
+                value = fn(*args, **kwargs)
+            except BaseException as e:
+                shared = Abandoned() if isinstance(e, abandon) or not isinstance(e, Exception) else e
+                self.finish(key, flight, error=shared)
+                raise
+            self.finish(key, flight, value)
+            return value
+
+    def inflight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+group = Group()
+do = group.do
+join = group.join
+finish = group.finish
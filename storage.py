@@ -0,0 +1,513 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from gspread.utils import rowcol_to_a1
+
+import scheduler
+
+# --- 本機優先 (local-first) 的資料儲存 ---
+# 行程、Index、記帳的所有讀寫都先落在本機 SQLite，畫面讀取不用等網路；
+# SyncWorker 在背景跟 Google Sheets 對帳。
+#
+# 本機保存的是每張工作表的「鏡像」：
+#   sheets 表：工作表名稱、表頭、遠端是否已建立
+#   rows 表  ：每一列資料，position 是在遠端的第幾列 (0 = 表頭下第一列，NULL = 還沒推上去)
+#              base_hash 是上次同步時遠端那一列的內容 hash，dirty = 本機改過還沒推
+#              version 每次內容變動 (本機或遠端) 都加一
+# 對帳規則 (row-version 衝突偵測)：
+#   遠端沒變 + 本機沒改 -> 不動
+#   遠端有變 + 本機沒改 -> 用遠端
+#   遠端沒變 + 本機有改 -> 推本機
+#   兩邊都改            -> 用遠端，本機版本記到 conflicts 表並在畫面上提示
+
+INDEX_SHEET = "Index"
+INDEX_HEADERS = [
+    "名稱", "開始日期", "結束日期", "國家",
+    "航班號", "出發機場", "出發時間", "抵達機場", "抵達時間",
+    "酒店名稱", "酒店地址", "入住日期", "退房日期"
+]
+ITEM_HEADERS = ["日期", "開始時間", "結束時間", "活動", "地圖連結", "備註"]
+EXPENSE_HEADERS = ["款項敘述", "類別", "花費", "幣值", "日期"]
+# 航班、飯店入住、退房這三種列的「活動」開頭：不是真的地點名稱 (不問 AI、不 geocode)，排路線時是固定行程
+BOOKING_PREFIXES = ("✈️", "🏨", "🔑")
+
+
+def expense_sheet(trip_name):
+    return f"{trip_name}_Expenses"
+
+
+def _norm(value):
+    # Sheets 讀回來全部是字串 ("12")，本機可能是數字 (12.0)，比對前先統一
+    text = "" if value is None else str(value).strip()
+    try:
+        return repr(float(text))
+    except ValueError:
+        return text
+
+
+def row_hash(row):
+    cells = [_norm(v) for v in row]
+    while cells and cells[-1] == "":
+        cells.pop()
+    return hashlib.sha1(json.dumps(cells, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _fit(row, width):
+    row = list(row)[:width]
+    return row + [""] * (width - len(row))
+
+
+class LocalStore:
+    def __init__(self, path):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sheets (
+                title TEXT PRIMARY KEY, headers TEXT NOT NULL,
+                remote INTEGER NOT NULL DEFAULT 0, synced_at REAL);
+            CREATE TABLE IF NOT EXISTS rows (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, sheet TEXT NOT NULL, position INTEGER,
+                data TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 1,
+                base_hash TEXT, dirty INTEGER NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS rows_sheet ON rows (sheet, position);
+            CREATE TABLE IF NOT EXISTS conflicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, sheet TEXT NOT NULL, position INTEGER,
+                local TEXT, remote TEXT, at REAL NOT NULL, seen INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS places (
+                country TEXT NOT NULL, name TEXT NOT NULL, lat REAL, lng REAL,
+                updated REAL NOT NULL, PRIMARY KEY (country, name));
+        """)
+        self._conn.commit()
+        self.ensure_sheet(INDEX_SHEET, INDEX_HEADERS)
+        # 本機有寫入時通知同步程式 (SyncWorker.kick)
+        self.on_change = None
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    # --- 工作表層級 ---
+    def ensure_sheet(self, title, headers):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO sheets (title, headers) VALUES (?, ?)",
+                (title, json.dumps(headers, ensure_ascii=False)),
+            )
+            self._conn.commit()
+
+    def sheet_titles(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT title FROM sheets")]
+
+    def headers(self, title):
+        with self._lock:
+            row = self._conn.execute("SELECT headers FROM sheets WHERE title = ?", (title,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def has_sheet(self, title):
+        return self.headers(title) is not None
+
+    def rows(self, title):
+        # 依遠端順序排列，還沒推上去的新列排在最後
+        return [row for _, row in self.rows_with_ids(title)]
+
+    def rows_with_ids(self, title):
+        # 跟 rows() 同樣的順序，多帶本機的列 id (要改寫特定幾列時用)
+        width = len(self.headers(title) or [])
+        with self._lock:
+            data = self._conn.execute(
+                "SELECT id, data FROM rows WHERE sheet = ? ORDER BY position IS NULL, position, id", (title,)
+            ).fetchall()
+        return [(rid, _fit(json.loads(d), width) if width else json.loads(d)) for rid, d in data]
+
+    def sheet_version(self, title):
+        # 資料有任何變動 (新增、修改、刪除、同步後對上位置) 這個值就會不同
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(version), 0), COALESCE(MAX(id), 0), COALESCE(SUM(position IS NULL), 0)"
+                " FROM rows WHERE sheet = ?",
+                (title,),
+            ).fetchone()
+
+    def prefix_version(self, title, max_id):
+        # id <= max_id 的那些列還是不是原本的樣子 (沒被改、沒被刪)
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(version), 0) FROM rows WHERE sheet = ? AND id <= ?",
+                (title, max_id),
+            ).fetchone()
+
+    def rows_after(self, title, after_id):
+        # 增量讀取：只拿 id 比 after_id 大的新列
+        with self._lock:
+            data = self._conn.execute(
+                "SELECT id, data FROM rows WHERE sheet = ? AND id > ? ORDER BY id", (title, after_id)
+            ).fetchall()
+        return [(rid, json.loads(d)) for rid, d in data]
+
+    def append_rows(self, title, rows, headers=None):
+        if headers is not None:
+            self.ensure_sheet(title, headers)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO rows (sheet, position, data, dirty) VALUES (?, NULL, ?, 1)",
+                [(title, json.dumps(list(r), ensure_ascii=False)) for r in rows],
+            )
+            self._conn.commit()
+        self._changed()
+
+    def update_rows(self, title, updates):
+        # updates: {position: row}，只改已經在遠端的列
+        with self._lock:
+            for position, row in updates.items():
+                self._conn.execute(
+                    "UPDATE rows SET data = ?, version = version + 1, dirty = 1 WHERE sheet = ? AND position = ?",
+                    (json.dumps(list(row), ensure_ascii=False), title, position),
+                )
+            self._conn.commit()
+        self._changed()
+
+    def update_rows_by_id(self, title, updates):
+        # updates: {列 id: row}；還沒推上去的列也可以改 (推的時候直接用新內容)
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE rows SET data = ?, version = version + 1, dirty = 1 WHERE sheet = ? AND id = ?",
+                [(json.dumps(list(row), ensure_ascii=False), title, rid) for rid, row in updates.items()],
+            )
+            self._conn.commit()
+        self._changed()
+
+    # --- 旅程 / 行程 / 記帳 ---
+    def list_trips(self):
+        return [r[0] for r in self.rows(INDEX_SHEET) if r and r[0]]
+
+    def get_trip(self, name):
+        for row in self.rows(INDEX_SHEET):
+            if row and row[0] == name:
+                return row
+        return None
+
+    def create_trip(self, name, start, end, country):
+        self.ensure_sheet(name, ITEM_HEADERS)
+        self.append_rows(INDEX_SHEET, [[name, str(start), str(end), country, "", ""]])
+
+    def get_items(self, trip_name):
+        return self.rows(trip_name)
+
+    def get_items_with_ids(self, trip_name):
+        return self.rows_with_ids(trip_name)
+
+    def update_items(self, trip_name, updates):
+        # 多列一起改，背景同步時合併成一次 batch_update
+        self.update_rows_by_id(trip_name, updates)
+
+    def append_items(self, trip_name, rows):
+        self.append_rows(trip_name, rows, ITEM_HEADERS)
+
+    def get_expenses(self, trip_name):
+        return self.rows(expense_sheet(trip_name))
+
+    def append_expenses(self, trip_name, rows):
+        self.append_rows(expense_sheet(trip_name), rows, EXPENSE_HEADERS)
+
+    # --- 衝突紀錄 ---
+    def unseen_conflicts(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, sheet, position, local, remote FROM conflicts WHERE seen = 0 ORDER BY id"
+            ).fetchall()
+            self._conn.execute("UPDATE conflicts SET seen = 1 WHERE seen = 0")
+            self._conn.commit()
+        return [
+            {"sheet": s, "position": p, "local": json.loads(l), "remote": json.loads(r)}
+            for _, s, p, l, r in rows
+        ]
+
+    # --- 地點座標 (geo.Geocoder)：只存在本機，不同步到試算表 ---
+    def get_places(self, country, names):
+        # 回傳 {地點: ((lat, lng) 或 None, 查詢時間)}；None 表示 Google 也查不到
+        names = list(dict.fromkeys(names))
+        found = {}
+        with self._lock:
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                for name, lat, lng, updated in self._conn.execute(
+                    f"SELECT name, lat, lng, updated FROM places WHERE country = ? AND name IN ({','.join('?' * len(chunk))})",
+                    [country] + chunk,
+                ):
+                    found[name] = ((lat, lng) if lat is not None else None, updated)
+        return found
+
+    def set_places(self, country, places):
+        # places: {地點: (lat, lng) 或 None}
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO places (country, name, lat, lng, updated) VALUES (?, ?, ?, ?, ?)",
+                [(country, name, *(coords or (None, None)), now) for name, coords in places.items()],
+            )
+            self._conn.commit()
+
+    # --- 給 SyncWorker 用 ---
+    def _sheet_state(self, title):
+        with self._lock:
+            return self._conn.execute("SELECT remote, synced_at FROM sheets WHERE title = ?", (title,)).fetchone()
+
+    def _mark_remote(self, title, synced=False):
+        with self._lock:
+            if synced:
+                self._conn.execute("UPDATE sheets SET remote = 1, synced_at = ? WHERE title = ?", (time.time(), title))
+            else:
+                self._conn.execute("UPDATE sheets SET remote = 1 WHERE title = ?", (title,))
+            self._conn.commit()
+
+    def _detach_sheet(self, title):
+        # 遠端的工作表不見了、本機還有沒推的修改：所有列當成新列，下次同步重新建立工作表推上去
+        with self._lock:
+            self._conn.execute("UPDATE rows SET position = NULL, base_hash = NULL, dirty = 1 WHERE sheet = ?", (title,))
+            self._conn.execute("UPDATE sheets SET remote = 0, synced_at = NULL WHERE title = ?", (title,))
+            self._conn.commit()
+
+    def _local_rows(self, title):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, position, data, base_hash, dirty FROM rows WHERE sheet = ? ORDER BY position IS NULL, position, id",
+                (title,),
+            ).fetchall()
+
+    def merge_remote(self, title, remote_rows):
+        # 用遠端內容對帳，回傳要推上去的 (updates {position: row}, appends [(id, row)])
+        with self._lock:
+            local = self._local_rows(title)
+            by_position = {pos: (rid, data, base, dirty) for rid, pos, data, base, dirty in local if pos is not None}
+            # 已經推上去、等著對上遠端位置的新列 (position NULL，base_hash 是推上去的內容)
+            # (舊版推完只清 dirty、沒記 base_hash，就用列的內容)
+            pushed = [
+                (rid, data, base or row_hash(json.loads(data)), dirty)
+                for rid, pos, data, base, dirty in local if pos is None and (base is not None or not dirty)
+            ]
+            pending = [(rid, json.loads(data)) for rid, pos, data, base, dirty in local if pos is None and base is None and dirty]
+            updates = {}
+            for position, remote in enumerate(remote_rows):
+                remote_hash = row_hash(remote)
+                remote_json = json.dumps(remote, ensure_ascii=False)
+                current = by_position.pop(position, None)
+                if current is None:
+                    match = next((p for p in pushed if p[2] == remote_hash), None)
+                    if match is not None:
+                        pushed.remove(match)
+                        if match[3]:
+                            # 推上去之後本機又改過：留著本機內容，下次當一般修改推
+                            self._conn.execute(
+                                "UPDATE rows SET position = ?, base_hash = ? WHERE id = ?", (position, remote_hash, match[0])
+                            )
+                            updates[position] = json.loads(match[1])
+                        else:
+                            self._conn.execute(
+                                "UPDATE rows SET position = ?, data = ?, base_hash = ? WHERE id = ?",
+                                (position, remote_json, remote_hash, match[0]),
+                            )
+                    else:
+                        self._conn.execute(
+                            "INSERT INTO rows (sheet, position, data, base_hash, dirty) VALUES (?, ?, ?, ?, 0)",
+                            (title, position, remote_json, remote_hash),
+                        )
+                    continue
+                rid, data, base, dirty = current
+                if remote_hash == base:
+                    if dirty:
+                        updates[position] = json.loads(data)
+                    continue
+                if dirty and row_hash(json.loads(data)) != remote_hash:
+                    self._conn.execute(
+                        "INSERT INTO conflicts (sheet, position, local, remote, at) VALUES (?, ?, ?, ?, ?)",
+                        (title, position, data, remote_json, time.time()),
+                    )
+                self._conn.execute(
+                    "UPDATE rows SET data = ?, base_hash = ?, dirty = 0, version = version + 1 WHERE id = ?",
+                    (remote_json, remote_hash, rid),
+                )
+            # 遠端已經沒有的列 (被刪掉了)；本機沒改過就跟著刪
+            for position, (rid, data, base, dirty) in by_position.items():
+                if not dirty:
+                    self._conn.execute("DELETE FROM rows WHERE id = ?", (rid,))
+            # 推上去的新列在遠端找不到 (被刪掉了)：本機沒再改過就跟著刪，改過的當新列重推
+            for rid, data, base, dirty in pushed:
+                if dirty:
+                    self._conn.execute("UPDATE rows SET base_hash = NULL WHERE id = ?", (rid,))
+                    pending.append((rid, json.loads(data)))
+                else:
+                    self._conn.execute("DELETE FROM rows WHERE id = ?", (rid,))
+            self._conn.commit()
+        return updates, pending
+
+    def local_changes(self, title):
+        # 遠端沒變動時不用對帳，直接找出本機改過 / 新增的列
+        updates = {}
+        pending = []
+        for rid, pos, data, base, dirty in self._local_rows(title):
+            if not dirty:
+                continue
+            if pos is None:
+                # 推過但還沒對上位置的列等下次對帳，不要再 append 一次
+                if base is None:
+                    pending.append((rid, json.loads(data)))
+            else:
+                updates[pos] = json.loads(data)
+        return updates, pending
+
+    def delete_rows_by_id(self, title, ids):
+        # 只刪本機；遠端還有的列下次對帳會再出現，遠端的列要用 WriteQueue.delete_rows 刪
+        with self._lock:
+            self._conn.executemany("DELETE FROM rows WHERE sheet = ? AND id = ?", [(title, i) for i in ids])
+            self._conn.commit()
+
+    def drop_sheet(self, title):
+        with self._lock:
+            self._conn.execute("DELETE FROM rows WHERE sheet = ?", (title,))
+            self._conn.execute("DELETE FROM sheets WHERE title = ?", (title,))
+            self._conn.commit()
+
+    def mark_pushed(self, title, updates, appended):
+        # updates: {position: 推上去的 row}，appended: [(列 id, 推上去的 row)]
+        # 遠端現在是推上去的內容 (base_hash)；推送期間本機又改過的列保持 dirty，下一輪再推
+        with self._lock:
+            for position, row in updates.items():
+                current = self._conn.execute(
+                    "SELECT id, data FROM rows WHERE sheet = ? AND position = ?", (title, position)
+                ).fetchone()
+                if current is not None:
+                    self._set_pushed(current, row)
+            for rid, row in appended:
+                current = self._conn.execute("SELECT id, data FROM rows WHERE id = ?", (rid,)).fetchone()
+                if current is not None:
+                    self._set_pushed(current, row)
+            self._conn.commit()
+
+    def _set_pushed(self, current, row):
+        rid, data = current
+        pushed_hash = row_hash(row)
+        self._conn.execute(
+            "UPDATE rows SET base_hash = ?, dirty = ? WHERE id = ?",
+            (pushed_hash, int(row_hash(json.loads(data)) != pushed_hash), rid),
+        )
+
+
+class SyncWorker:
+    def __init__(self, store, sheets, writes, interval=60):
+        self.store = store
+        self.sheets = sheets
+        self.writes = writes
+        self.interval = interval
+        self.last_error = None
+        self.last_sync = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sync_lock = threading.Lock()
+        self._synced_version = None   # 上一次同步成功時試算表的版本 (lastUpdateTime)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="sheets-sync", daemon=True)
+            self._thread.start()
+        self.store.on_change = self.kick
+        return self
+
+    def kick(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self):
+        # 背景同步的讀取排在畫面需要的讀取後面 (寫入一律優先)
+        with scheduler.context(scheduler.BACKGROUND):
+            while not self._stop.is_set():
+                try:
+                    self.sync_once()
+                except Exception as e:
+                    self.last_error = e
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+    def ensure(self, *titles):
+        # 遠端有、但本機從沒同步過的工作表 (例如第一次打開某個旅程) 先同步一次再顯示
+        remote_titles = set(self.sheets.titles())
+        never = [t for t in titles if t in remote_titles and (self.store._sheet_state(t) or (0, None))[1] is None]
+        if never:
+            self.sync_once(never)
+
+    def sync_once(self, titles=None):
+        with self._sync_lock:
+            changed, version = self.sheets.refresh_if_changed(self._synced_version)
+            remote_titles = set(self.sheets.titles())
+            local_titles = self.store.sheet_titles()
+            for title in titles or []:
+                if title in remote_titles and not self.store.has_sheet(title):
+                    self.store.ensure_sheet(title, self._remote_headers(title))
+            targets = [t for t in local_titles + list(titles or []) if self.store.has_sheet(t)]
+            targets = list(dict.fromkeys(targets))
+
+            plan = {}
+            for title in list(targets):
+                remote, synced_at = self.store._sheet_state(title)
+                if title not in remote_titles:
+                    if remote:
+                        updates, pending = self.store.local_changes(title)
+                        if not updates and not pending:
+                            # 遠端已經刪掉 (例如封存了)，本機也跟著移除
+                            self.store.drop_sheet(title)
+                            targets.remove(title)
+                            continue
+                        # 本機還有沒推上去的修改：不丟資料，整張表重新建立
+                        self.store._detach_sheet(title)
+                    # 遠端還沒建立：新增工作表 (含表頭)，本機列全部當新列
+                    self.writes.add_worksheet(title, self.store.headers(title))
+                    plan[title] = self.store.local_changes(title)
+                elif changed or synced_at is None or title in (titles or []):
+                    self.store._mark_remote(title)
+                    plan[title] = self.store.merge_remote(title, self.sheets.values(title)[1:])
+                else:
+                    plan[title] = self.store.local_changes(title)
+
+            pushed = {}
+            for title, (updates, pending) in plan.items():
+                width = len(self.store.headers(title) or [])
+                for position, row in updates.items():
+                    sheet_row = position + 2  # 第 1 列是表頭
+                    a1 = f"{rowcol_to_a1(sheet_row, 1)}:{rowcol_to_a1(sheet_row, max(width, len(row)))}"
+                    self.writes.update_range(title, a1, [row])
+                if pending:
+                    self.writes.append_rows(title, [row for _, row in pending])
+                if updates or pending:
+                    pushed[title] = (updates, pending)
+
+            if self.writes.has_pending():
+                self.writes.flush(wait=True)
+                errors = self.writes.pop_errors()
+                if errors:
+                    # 推送失敗就保持 dirty，下一輪再試
+                    self.last_error = errors[-1]
+                    return False
+                for title, (updates, appended) in pushed.items():
+                    self.store.mark_pushed(title, updates, appended)
+                    self.store._mark_remote(title, synced=True)
+                # 重新讀一次剛推上去的表，讓新列對上遠端的位置
+                for title in pushed:
+                    self.store.merge_remote(title, self.sheets.values(title)[1:])
+            for title in targets:
+                self.store._mark_remote(title, synced=True)
+            self._synced_version = version
+            self.last_error = None
+            self.last_sync = time.time()
+            return True
+
+    def _remote_headers(self, title):
+        values = self.sheets.values(title)
+        return values[0] if values else []
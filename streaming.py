@@ -0,0 +1,138 @@
+import json
+
+# --- Gemini 串流輸出 ---
+# generate_content(stream=True) 會一段一段回傳文字，這裡負責：
+#   1. 把串流轉成單純的文字 generator (給 st.write_stream 用)
+#   2. 一邊收 JSON 一邊解析，欄位收到多少就先顯示多少
+# cancelled() 回傳 True (例如使用者換了旅程 / 天數) 就停止讀取並關掉串流。
+
+
+def iter_text(response, cancelled=None):
+    try:
+        for chunk in response:
+            if cancelled is not None and cancelled():
+                return
+            try:
+                text = chunk.text
+            except Exception:
+                # 被安全機制擋掉之類沒有文字的 chunk
+                continue
+            if text:
+                yield text
+    finally:
+        close = getattr(response, "close", None)
+        if callable(close):
+            close()
+
+
+def _skip_ws(text, i):
+    while i < len(text) and text[i] in " \t\r\n,":
+        i += 1
+    return i
+
+
+def _read_string(text, i):
+    # text[i] 是開頭的引號；回傳 (內容, 下一個位置, 是否完整)
+    out = []
+    i += 1
+    while i < len(text):
+        ch = text[i]
+        if ch == '"':
+            return "".join(out), i + 1, True
+        if ch == "\\":
+            if i + 1 >= len(text):
+                break
+            esc = text[i + 1]
+            if esc == "u":
+                if i + 6 > len(text):
+                    break
+                try:
+                    out.append(chr(int(text[i + 2:i + 6], 16)))
+                except ValueError:
+                    pass
+                i += 6
+                continue
+            out.append({"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}.get(esc, esc))
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out), i, False
+
+
+def _read_scalar(text, i):
+    # 數字 / true / false / null：後面還沒看到 , } ] 就可能還沒收完 (例如 12 後面還有 3)
+    end = i
+    while end < len(text) and text[end] not in ",}]":
+        end += 1
+    if end >= len(text):
+        return None, end, False
+    raw = text[i:end].strip()
+    try:
+        return json.loads(raw), end, True
+    except ValueError:
+        return raw, end, True
+
+
+def _read_value(text, i):
+    # 回傳 (值, 下一個位置, 是否完整)；還沒收完的字串 / 物件 / 陣列回傳目前的部分內容
+    if text[i] == '"':
+        return _read_string(text, i)
+    if text[i] == "{":
+        return _read_object(text, i)
+    if text[i] == "[":
+        return _read_array(text, i)
+    return _read_scalar(text, i)
+
+
+def _read_array(text, i):
+    items = []
+    i += 1
+    while True:
+        i = _skip_ws(text, i)
+        if i >= len(text):
+            return items, i, False
+        if text[i] == "]":
+            return items, i + 1, True
+        value, i, ok = _read_value(text, i)
+        if not ok:
+            if value is not None:
+                items.append(value)
+            return items, i, False
+        items.append(value)
+
+
+def _read_object(text, i):
+    fields = {}
+    i += 1
+    while True:
+        i = _skip_ws(text, i)
+        if i >= len(text):
+            return fields, i, False
+        if text[i] == "}":
+            return fields, i + 1, True
+        if text[i] != '"':
+            return fields, i, False
+        key, i, ok = _read_string(text, i)
+        if not ok:
+            return fields, i, False
+        while i < len(text) and text[i] in " \t\r\n:":
+            i += 1
+        if i >= len(text):
+            return fields, i, False
+        value, i, ok = _read_value(text, i)
+        if not ok:
+            if value is not None:
+                fields[key] = value
+            return fields, i, False
+        fields[key] = value
+
+
+def parse_partial_object(text):
+    # 解析「還沒收完」的 JSON 物件，回傳 (目前拿到的欄位, 是否已經完整)
+    # 值還在傳的字串 / 物件 / 陣列欄位也會先回傳目前的部分內容；還沒收完的數字先不回傳
+    start = text.find("{")
+    if start < 0:
+        return {}, False
+    fields, _, complete = _read_object(text, start)
+    return fields, complete
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# 模組都放在 repo 根目錄 (沒有 package)，測試直接 import；假的外部服務在 benchmarks/fakes.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import bench_app
+import clients
+import disk_cache
+import fakes
+import geo
+import travel
+from conftest import ROOT
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    # 跟 benchmarks/bench_app.py 一樣：外部服務全部換成 fakes，資料放在暫存資料夾
+    patch = pytest.MonkeyPatch()
+    patch.setattr(disk_cache, "DATA_DIR", str(tmp_path_factory.mktemp("planner_data")))
+    patch.delenv("TRAVEL_PLANNER_OFFLINE", raising=False)
+    counter = fakes.CallCounter()
+    spreadsheet = fakes.FakeSpreadsheet(0, counter)
+    bench_app.seed(spreadsheet, 3, 4, 5)
+    maps = fakes.DistanceMatrixServer(0, counter).start()
+    genai = fakes.stub_genai(0, counter)
+    patch.setattr(clients, "get_gspread_client", lambda: fakes.FakeGspreadClient(spreadsheet))
+    patch.setattr(clients, "get_genai", lambda: genai)
+    patch.setattr(travel, "DISTANCE_MATRIX_URL", maps.url)
+    patch.setattr(geo, "GEOCODE_URL", maps.geocode_url)
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.secrets["GOOGLE_MAPS_API_KEY"] = "fake"
+    at.secrets["GEMINI_API_KEY"] = "fake"
+    at.run()
+    assert not at.exception
+    yield at
+    maps.stop()
+    patch.undo()
+
+
+def click(at, label):
+    next(b for b in at.button if b.label == label).click().run()
+
+
+def test_expense_dialog_opens(app):
+    click(app, "💵 記帳")
+    assert not app.exception
+    assert [f.label for f in app.selectbox if f.label in ("類別", "選擇幣值", "日期")] == ["類別", "選擇幣值", "日期"]
@@ -0,0 +1,83 @@
+import json
+
+import booking
+from storage import BOOKING_PREFIXES
+
+HOTEL = "Hotel Gracery Shinjuku 訂房確認\n地址：東京都新宿區歌舞伎町1-19-1\ncheck in 2026-03-01 15:00\ncheck out 2026-03-04 11:00"
+FLIGHT = "Flight BR 198 TPE 08:50 → NRT 13:00"
+MIXED = "航班 CI100 TPE 08:00 NRT 12:00\n入住 Hotel Gracery 2026-03-01 ~ 2026-03-04"
+
+
+class CannedModel:
+    # 每次都回同一個 JSON，記錄被叫了幾次
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        self.calls += 1
+        return type("Response", (), {"text": json.dumps(self.answer, ensure_ascii=False)})()
+
+
+def meta(**fields):
+    result = booking.empty_meta()
+    result.update(fields)
+    return result
+
+
+def test_hotel_only_has_no_flight():
+    regex_meta, complete = booking.regex_prepass(HOTEL)
+    # "check in 2026" 不是航班 IN2026，入住 / 退房時間也不是起降時間
+    assert not complete
+    assert all(regex_meta[f] == "" for f in booking.FLIGHT_FIELDS)
+    assert (regex_meta["入住日期"], regex_meta["退房日期"]) == ("2026-03-01", "2026-03-04")
+    model = CannedModel(meta(酒店名稱="Hotel Gracery Shinjuku", 入住日期="2026-03-01", 退房日期="2026-03-04"))
+    result = booking.parse_booking(model, HOTEL, "2026-03-01")
+    rows = booking.to_items(result, "2026-03-01")
+    assert [r[3] for r in rows] == ["🏨 入住: Hotel Gracery Shinjuku", "🔑 退房: Hotel Gracery Shinjuku"]
+
+
+def test_flight_only_skips_model():
+    regex_meta, complete = booking.regex_prepass(FLIGHT)
+    assert complete
+    assert regex_meta == meta(航班號="BR198", 出發機場="TPE", 出發時間="08:50", 抵達機場="NRT", 抵達時間="13:00")
+    model = CannedModel(booking.empty_meta())
+    result = booking.parse_booking(model, FLIGHT, "2026-03-01")
+    assert model.calls == 0
+    assert [r[:4] for r in booking.to_items(result, "2026-03-01")] == [
+        ["2026-03-01", "08:50", "13:00", "✈️ 航班: BR198 (TPE 🛫 NRT)"],
+    ]
+
+
+def test_mixed_confirmation_uses_model_for_flight():
+    regex_meta, complete = booking.regex_prepass(MIXED)
+    assert not complete
+    assert regex_meta["航班號"] == ""
+    answer = meta(
+        航班號="CI100", 出發機場="TPE", 出發時間="08:00", 抵達機場="NRT", 抵達時間="12:00",
+        酒店名稱="Hotel Gracery", 入住日期="2026-03-01", 退房日期="2026-03-04",
+    )
+    result = booking.parse_booking(CannedModel(answer), MIXED, "2026-03-01")
+    assert result == booking.clean_meta(answer)
+    rows = booking.to_items(result, "2026-03-01")
+    assert [r[3].split(" ")[0] for r in rows] == list(BOOKING_PREFIXES)
+
+
+def test_lowercase_words_are_not_flights():
+    assert booking.regex_prepass("we land in 2026 at 10:00 and 12:00")[0]["航班號"] == ""
+    assert booking.regex_prepass("flight no. br 198")[0]["航班號"] == ""
+
+
+def test_merge_keeps_model_without_flight():
+    # 正規表示式抓到的航班欄位不能蓋過「模型說沒有航班」
+    regex_meta = meta(航班號="IN2026", 出發時間="15:00", 抵達時間="11:00")
+    result = booking._merge(meta(酒店名稱="Hotel Gracery", 入住日期="2026-03-01"), regex_meta)
+    assert all(result[f] == "" for f in booking.FLIGHT_FIELDS)
+    assert booking.to_items(result, "2026-03-01")[0][3] == "🏨 入住: Hotel Gracery"
+    # 模型有抓到航班時，缺的欄位才用正規表示式補
+    result = booking._merge(meta(航班號="BR198"), meta(航班號="BR198", 出發時間="08:50"))
+    assert result["出發時間"] == "08:50"
+
+
+def test_time_alone_is_not_a_flight_row():
+    assert booking.to_items(meta(出發時間="08:00"), "2026-03-01") == []
@@ -0,0 +1,96 @@
+import pytest
+
+import disk_cache
+from disk_cache import SqliteCache
+
+
+class FakeTime:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(disk_cache, "time", fake)
+    return fake
+
+
+def selects(cache):
+    # 記下送給 SQLite 的 SELECT (給檢查「一次查幾個 key」用)
+    statements = []
+    cache._conn.set_trace_callback(lambda sql: statements.append(sql) if sql.startswith("SELECT key") else None)
+    return statements
+
+
+def test_get_many_chunks_keys(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_cache, "SQL_VARIABLES", 3)
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), "legs")
+    for i in range(7):
+        cache.set(("日本", f"景點{i}"), i, 3600)
+    statements = selects(cache)
+    keys = [("日本", f"景點{i}") for i in range(8)]
+    found = cache.get_many(keys + keys[:2])
+    assert found == {k: i for i, k in enumerate(keys[:7])}
+    # 8 個不重複的 key，每次最多 3 個：3 個 SELECT
+    assert len(statements) == 3
+    assert cache.stats()["hits"] == 7 and cache.stats()["misses"] == 1
+
+
+def test_get_many_skips_expired(tmp_path, clock):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), "legs")
+    cache.set("short", 1, 10)
+    cache.set("long", 2, 3600)
+    clock.now += 60
+    assert cache.get_many(["short", "long"]) == {"long": 2}
+    assert cache.get("short", "default") == "default"
+
+
+def test_namespaces_are_separate(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    SqliteCache(path, "legs").set("key", "legs", 3600)
+    SqliteCache(path, "advice").set("key", "advice", 3600)
+    assert SqliteCache(path, "legs").get("key") == "legs"
+
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), "legs", max_entries=3, evict_every=1)
+    for key in ["a", "b", "c"]:
+        cache.set(key, key, 10 * 3600)
+        clock.now += 1
+    # 很久之後再讀 a：使用時間更新，b 變成最久沒用的
+    clock.now += disk_cache.TOUCH_INTERVAL + 1
+    assert cache.get("a") == "a"
+    clock.now += 1
+    cache.set("d", "d", 10 * 3600)
+    assert len(cache) == 3
+    assert cache.get_many(["a", "b", "c", "d"]) == {"a": "a", "c": "c", "d": "d"}
+
+
+def test_recent_hits_do_not_write(tmp_path, clock):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), "legs")
+    cache.set("a", 1, 3600)
+    updates = []
+    cache._conn.set_trace_callback(lambda sql: updates.append(sql) if sql.startswith("UPDATE") else None)
+    clock.now += 60
+    assert cache.get("a") == 1
+    assert updates == []
+
+
+def test_eviction_runs_every_n_writes(tmp_path, clock):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite3"), "legs", max_entries=2, evict_every=5)
+    counts = []
+    cache._conn.set_trace_callback(lambda sql: counts.append(sql) if sql.startswith("SELECT COUNT") else None)
+    for i in range(4):
+        cache.set(i, i, 3600)
+        clock.now += 1
+    # 還沒到第 5 次寫入：先不淘汰，可以暫時超過上限
+    assert counts == []
+    assert len(cache) == 4
+    counts.clear()
+    cache.set(4, 4, 3600)
+    assert len(counts) == 1
+    assert cache.get_many(range(5)) == {3: 3, 4: 4}
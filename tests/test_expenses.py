@@ -0,0 +1,98 @@
+import json
+
+import pandas as pd
+import pytest
+
+import expenses
+from storage import EXPENSE_HEADERS, LocalStore, expense_sheet
+
+
+@pytest.fixture
+def fx(tmp_path):
+    path = tmp_path / "fx_rates.json"
+    path.write_text(json.dumps({"base": "TWD", "rates": {
+        "2026-01-01": {"JPY": 0.20, "USD": 32.0},
+        "2026-01-05": {"JPY": 0.25},
+        "2026-01-10": {"JPY": 0.30, "USD": 33.0},
+    }}), encoding="utf-8")
+    return expenses.FxTable(str(path))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStore(str(tmp_path / "local.db"))
+
+
+def rebuilt(store, trip, fx):
+    # 從頭算一次的帳，拿來跟增量更新的結果比
+    ledger = expenses.ExpenseLedger(fx)
+    for row in store.get_expenses(trip):
+        ledger.add(row)
+    return ledger
+
+
+def assert_same(a, b):
+    assert a.count == b.count
+    assert a.total_home == pytest.approx(b.total_home)
+    assert dict(a.by_category) == pytest.approx(dict(b.by_category))
+    assert dict(a.by_currency) == pytest.approx(dict(b.by_currency))
+    assert dict(a.unconverted) == dict(b.unconverted)
+
+
+def test_to_home_uses_nearest_earlier_rate(fx):
+    df = pd.DataFrame([
+        ["早於匯率表", "餐飲", 100, "JPY", "2025-12-31"],
+        ["當天", "餐飲", 100, "JPY", "2026-01-05"],
+        ["兩個日期之間", "餐飲", 100, "JPY", "2026-01-07"],
+        ["JPY 有新匯率但 USD 沒有", "購物", 10, "USD", "2026-01-07"],
+        ["沒有日期", "交通", 100, "JPY", ""],
+        ["本國幣", "其他", 50, "TWD", "2026-01-07"],
+        ["匯率表沒有", "其他", 10, "EUR", "2026-01-07"],
+    ], columns=EXPENSE_HEADERS)
+    home = expenses.to_home(df, fx).set_index("款項敘述")["home"]
+    assert home["早於匯率表"] == pytest.approx(20.0)
+    assert home["當天"] == pytest.approx(25.0)
+    assert home["兩個日期之間"] == pytest.approx(25.0)
+    assert home["JPY 有新匯率但 USD 沒有"] == pytest.approx(320.0)
+    assert home["沒有日期"] == pytest.approx(30.0)
+    assert home["本國幣"] == pytest.approx(50.0)
+    assert pd.isna(home["匯率表沒有"])
+    # 跟逐筆換算的結果一致
+    assert fx.convert(100, "JPY", "2026-01-07") == pytest.approx(25.0)
+
+
+def test_incremental_append_matches_rebuild(store, fx):
+    store.append_expenses("東京", [["拉麵", "餐飲", 1000, "JPY", "2026-01-02"]])
+    ledger = expenses.get_ledger(store, "東京", fx)
+    assert ledger.count == 1
+    store.append_expenses("東京", [["地鐵", "交通", 500, "JPY", "2026-01-06"], ["咖啡", "餐飲", 5, "USD", "2026-01-06"]])
+    again = expenses.get_ledger(store, "東京", fx)
+    # 只新增：同一本帳物件，只加新列
+    assert again is ledger
+    assert_same(again, rebuilt(store, "東京", fx))
+    assert again.total_home == pytest.approx(200 + 125 + 160)
+
+
+def test_edit_or_delete_rebuilds(store, fx):
+    store.append_expenses("大阪", [["章魚燒", "餐飲", 600, "JPY", "2026-01-02"], ["門票", "娛樂", 2000, "JPY", "2026-01-03"]])
+    expenses.get_ledger(store, "大阪", fx)
+    (first_id, _), (second_id, _) = store.rows_with_ids(expense_sheet("大阪"))
+    store.update_rows_by_id(expense_sheet("大阪"), {first_id: ["章魚燒", "餐飲", 900, "JPY", "2026-01-02"]})
+    ledger = expenses.get_ledger(store, "大阪", fx)
+    assert_same(ledger, rebuilt(store, "大阪", fx))
+    assert ledger.total_home == pytest.approx(180 + 400)
+    store.delete_rows_by_id(expense_sheet("大阪"), [second_id])
+    ledger = expenses.get_ledger(store, "大阪", fx)
+    assert_same(ledger, rebuilt(store, "大阪", fx))
+    assert ledger.count == 1
+
+
+def test_daily_series_skips_unconverted_currency(fx):
+    ledger = expenses.ExpenseLedger(fx)
+    ledger.add(["拉麵", "餐飲", 1000, "JPY", "2026-01-02"])
+    ledger.add(["紀念品", "購物", 30, "EUR", "2026-01-02"])
+    ledger.add(["博物館", "娛樂", 40, "EUR", "2026-01-03"])
+    daily = ledger.daily_series()
+    # 只有 EUR 的那天不該出現一筆 0 元
+    assert daily.to_dict() == pytest.approx({"2026-01-02": 200.0})
+    assert dict(ledger.unconverted) == {"EUR": 70.0}
@@ -0,0 +1,115 @@
+import random
+
+import intervals
+from storage import LocalStore
+
+
+def brute(items, start, end):
+    end = max(end, start + 1)
+    return sorted(item for item in items if item[0] < end and item[1] > start)
+
+
+def test_matches_brute_force_under_random_adds_and_removes():
+    rng = random.Random(23)
+    index = intervals.IntervalIndex()
+    live = []
+    for step in range(3000):
+        if live and rng.random() < 0.4:
+            item = live.pop(rng.randrange(len(live)))
+            index.remove(*item)
+        else:
+            start = rng.randrange(1000)
+            item = (start, max(start + rng.randrange(0, 200), start + 1), step)
+            index.add(*item)
+            live.append(item)
+        # 增量維護的 max_end 要跟整個重算的一樣
+        expected, best = [], None
+        for _, end, _ in index._items:
+            best = end if best is None else max(best, end)
+            expected.append(best)
+        assert index._max_end == expected
+        if step % 10 == 0:
+            a = rng.randrange(1100)
+            b = a + rng.randrange(0, 150)
+            assert sorted(index.overlapping(a, b)) == brute(live, a, b)
+    assert len(index) == len(live)
+
+
+def test_bulk_build_equals_incremental():
+    rng = random.Random(5)
+    items = [(s, s + rng.randrange(1, 50), i) for i, s in enumerate(rng.randrange(500) for _ in range(200))]
+    bulk = intervals.IntervalIndex(items)
+    incremental = intervals.IntervalIndex()
+    for item in items:
+        incremental.add(*item)
+    assert bulk._items == incremental._items
+    assert bulk._max_end == incremental._max_end
+
+
+def test_zero_length_and_missing_remove():
+    index = intervals.IntervalIndex([(10, 10, "point")])
+    assert index.at(10) == [(10, 11, "point")]
+    assert index.at(11) == []
+    index.remove(99, 100, "nothing")
+    assert len(index) == 1
+
+
+def row(day, start, end, name):
+    return [day, start, end, name, "", ""]
+
+
+def test_hotel_stays_pair_check_in_with_next_check_out():
+    schedule = intervals.ScheduleIndex()
+    schedule.add(1, row("2026-03-01", "15:00", "23:59", "🏨 入住: 東橫INN"))
+    schedule.add(2, row("2026-03-03", "00:00", "11:00", "🔑 退房: 東橫INN"))
+    schedule.add(3, row("2026-03-03", "15:00", "23:59", "🏨 入住: 京都旅館"))
+    assert schedule.hotels_on("2026-02-28") == []
+    assert schedule.hotels_on("2026-03-01") == ["東橫INN"]
+    assert schedule.hotels_on("2026-03-02") == ["東橫INN"]
+    # 沒有退房列：當住一晚
+    assert schedule.hotels_on("2026-03-03") == ["京都旅館"]
+    assert schedule.hotels_on("2026-03-04") == []
+    # 退房列後來才加進來，住宿要重新配對
+    schedule.add(4, row("2026-03-05", "00:00", "11:00", "🔑 退房: 京都旅館"))
+    assert schedule.hotels_on("2026-03-04") == ["京都旅館"]
+    assert schedule.conflicts(1) == []
+
+
+def test_overlapping_items_and_red_eye_flights():
+    schedule = intervals.ScheduleIndex()
+    schedule.add(1, row("2026-03-01", "09:00", "11:00", "築地"))
+    schedule.add(2, row("2026-03-01", "10:30", "12:00", "銀座"))
+    schedule.add(3, row("2026-03-01", "12:00", "13:00", "午餐"))
+    schedule.add(4, row("2026-03-01", "23:30", "05:00", "✈️ 航班: NH1 (HND 🛫 LAX)"))
+    schedule.add(5, row("2026-03-02", "04:00", "", "早起"))
+    schedule.add(6, row("2026-03-01", "10:00", "", "🏨 入住: A"))
+    assert schedule.conflicts(1) == [2]
+    assert schedule.conflicts(2) == [1]
+    # 半開區間：12:00 結束跟 12:00 開始不算撞
+    assert schedule.conflicts(3) == []
+    # 跨午夜的航班到隔天 05:00
+    assert schedule.conflicts(5) == [4]
+    # 入住 / 退房列不算在有時間的行程裡
+    assert 6 not in schedule.conflicts(1)
+    # 沒有日期或時間的列不進索引
+    schedule.add(7, row("", "09:00", "10:00", "沒日期"))
+    schedule.add(8, row("2026-03-01", "", "", "沒時間"))
+    assert schedule.conflicts(7) == schedule.conflicts(8) == []
+
+
+def test_get_schedule_is_incremental_and_rebuilds_after_edits(tmp_path):
+    store = LocalStore(str(tmp_path / "store.sqlite3"))
+    trip = "東京"
+    store.append_items(trip, [row("2026-03-01", "09:00", "11:00", "築地")])
+    first = intervals.get_schedule(store, trip)
+    store.append_items(trip, [row("2026-03-01", "10:00", "10:30", "市場")])
+    second = intervals.get_schedule(store, trip)
+    # 只有新增：同一份索引，增量插入
+    assert second is first
+    ids = [rid for rid, _ in store.get_items_with_ids(trip)]
+    assert second.conflicts(ids[0]) == [ids[1]]
+    # 改過列：整份重建
+    store.update_items(trip, {ids[1]: row("2026-03-01", "12:00", "12:30", "市場")})
+    third = intervals.get_schedule(store, trip)
+    assert third is not first
+    assert third.conflicts(ids[0]) == []
@@ -0,0 +1,124 @@
+import codecs
+import io
+
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+import itinerary_io
+from storage import ITEM_HEADERS
+
+ROWS = [
+    ["2026-03-01", "09:00", "10:30", "淺草寺", "https://maps.example/a", "早點去"],
+    ["2026-03-01", "", "", "自由活動", "", ""],
+]
+
+
+def download(callable_):
+    # 跟 st.download_button 按下去時 (MediaFileManager.execute_deferred) 一樣的轉換
+    return convert_data_to_bytes_and_infer_mime(callable_(), RuntimeError("unsupported"))[0]
+
+
+def test_exports_are_accepted_by_download_button():
+    ics = download(lambda: itinerary_io.spool(itinerary_io.export_ics("東京", ROWS)))
+    assert ics.startswith(b"BEGIN:VCALENDAR\r\n")
+    assert ics.endswith(b"END:VCALENDAR\r\n")
+    csv_bytes = download(lambda: itinerary_io.spool(itinerary_io.export_csv(ROWS), bom=True))
+    assert csv_bytes.startswith(codecs.BOM_UTF8)
+    assert "淺草寺".encode("utf-8") in csv_bytes
+
+
+def test_fold_keeps_lines_within_75_octets_and_unfolds_back():
+    line = "SUMMARY:" + "東京晴空塔與淺草寺一日遊" * 6
+    folded = itinerary_io._fold(line)
+    physical = folded.split("\r\n")[:-1]
+    assert len(physical) > 1
+    assert all(len(p.encode("utf-8")) <= itinerary_io.ICS_LINE_OCTETS for p in physical)
+    assert all(p.startswith(" ") for p in physical[1:])
+    # 每一段都是完整的 UTF-8 (沒有把中文字切成兩半)
+    for p in physical:
+        p.encode("utf-8").decode("utf-8")
+    assert list(itinerary_io._unfold(folded.splitlines(keepends=True))) == [(1, line)]
+    assert itinerary_io._fold("SHORT:x") == "SHORT:x\r\n"
+
+
+def test_escape_round_trip():
+    text = "a,b;c\\d\n第二行"
+    assert itinerary_io._unescape(itinerary_io._escape(text)) == text
+
+
+def test_ics_round_trip():
+    rows = [
+        ["2026-03-01", "09:00", "10:30", "淺草寺, 雷門", "https://maps.example/a", "早點去;人多\n帶水"],
+        ["2026-03-02", "", "", "自由活動" * 10, "", ""],
+    ]
+    data = itinerary_io.spool(itinerary_io.export_ics("東京", rows))
+    records = [r for _, r in itinerary_io.iter_ics(data.decode("utf-8").splitlines(keepends=True))]
+    assert [(r["日期"], r["開始時間"], r["結束時間"], r["活動"], r["地圖連結"], r["備註"]) for r in records] == [
+        ("2026-03-01", "09:00", "10:30", "淺草寺, 雷門", "https://maps.example/a", "早點去;人多\n帶水"),
+        ("2026-03-02", "", "", "自由活動" * 10, "", ""),
+    ]
+
+
+def test_ics_converts_utc_to_calendar_timezone():
+    ics = "\r\n".join([
+        "BEGIN:VCALENDAR",
+        "X-WR-TIMEZONE:Asia/Tokyo",
+        "BEGIN:VEVENT",
+        "DTSTART:20260301T233000Z",
+        "DTEND:20260302T010000Z",
+        "SUMMARY:築地",
+        "BEGIN:VALARM",
+        "DESCRIPTION:提醒",
+        "END:VALARM",
+        "END:VEVENT",
+        "BEGIN:VEVENT",
+        "DTSTART;TZID=Asia/Tokyo:20260302T090000",
+        "SUMMARY:當地時間",
+        "END:VEVENT",
+        "END:VCALENDAR",
+    ])
+    (n1, first), (n2, second) = itinerary_io.iter_ics(ics.splitlines(keepends=True))
+    # UTC 23:30 = 東京隔天 08:30
+    assert (first["日期"], first["開始時間"], first["結束時間"]) == ("2026-03-02", "08:30", "10:00")
+    # VALARM 的 DESCRIPTION 不會蓋掉事件本身的
+    assert first["備註"] == ""
+    # 有 TZID 的照原本的當地時間
+    assert (second["日期"], second["開始時間"]) == ("2026-03-02", "09:00")
+    assert (n1, n2) == (3, 11)
+
+
+def test_ics_without_calendar_timezone_keeps_utc_clock():
+    ics = "BEGIN:VCALENDAR\nBEGIN:VEVENT\nDTSTART:20260301T233000Z\nSUMMARY:x\nEND:VEVENT\nEND:VCALENDAR\n"
+    (_, record), = itinerary_io.iter_ics(ics.splitlines(keepends=True))
+    assert (record["日期"], record["開始時間"]) == ("2026-03-01", "23:30")
+
+
+def test_csv_round_trip_with_bom_and_aliases():
+    data = itinerary_io.spool(itinerary_io.export_csv(ROWS), bom=True)
+    records = [r for _, r in itinerary_io.iter_csv(itinerary_io.text_lines(io.BytesIO(data)))]
+    assert [[r[h] for h in ITEM_HEADERS] for r in records] == ROWS
+    aliased = "Date,Start Time,Subject,Location\n2026/03/01,0930,晴空塔,押上\n\n"
+    (number, record), = itinerary_io.iter_csv(io.StringIO(aliased))
+    assert number == 2
+    assert record == {"日期": "2026/03/01", "開始時間": "0930", "活動": "晴空塔", "地點": "押上"}
+
+
+def test_parse_import_validates_and_skips_duplicates():
+    csv_text = "\n".join([
+        "日期,開始時間,結束時間,活動,地圖連結,備註",
+        "2026-03-01,09:00,10:00,淺草寺,,",
+        "2026-03-01,09:00,10:00,淺草寺,,",
+        "2026-03-05,09:00,,太晚了,,",
+        "2026-03-02,,,沒時間,,",
+        "2026-03-02,10:00,later,結束看不懂,,",
+        "2026-03-02,11:00,,上野,,",
+        "2026-03-02,12:00,,已經有了,,",
+    ])
+    existing = [["2026-03-02", "12:00", "", "已經有了", "", ""]]
+    upload = io.BytesIO(csv_text.encode("utf-8"))
+    rows, errors, duplicates = itinerary_io.parse_import(upload, "plan.csv", "日本", ["2026-03-01", "2026-03-02"], existing)
+    assert [r[3] for r in rows] == ["淺草寺", "上野"]
+    assert rows[0][4] == itinerary_io.map_url("日本", "淺草寺")
+    assert [n for n, _ in errors] == [4, 5, 6]
+    assert duplicates == 2
+    # 上傳的檔案還可以再讀 (rerun 時)
+    assert not upload.closed
@@ -0,0 +1,143 @@
+import itertools
+import random
+
+import itinerary
+import route
+
+DAY = "2026-03-01"
+
+
+def day_items(rows):
+    # rows: [(開始, 結束, 活動, 備註)]
+    plan = itinerary.prepare_itinerary([[DAY, s, e, name, "", note] for s, e, name, note in rows])
+    return plan.items(DAY)
+
+
+def line_travel(positions):
+    # 地點在一條直線上，每隔 1 單位 = 10 分鐘
+    return {
+        (a, b): abs(pa - pb) * 600
+        for (a, pa), (b, pb) in itertools.product(positions.items(), repeat=2) if a != b
+    }
+
+
+def test_fixed_and_place_of():
+    flight = {"活動": "✈️ 航班: BR198 (TPE 🛫 NRT)", "備註": ""}
+    hotel = {"活動": "🏨 入住: 東橫INN", "備註": "東京都台東區1-2-3"}
+    checkout = {"活動": "🔑 退房: 東橫INN", "備註": ""}
+    booked = {"活動": "壽司", "備註": "已預約 18:00"}
+    free = {"活動": "淺草寺", "備註": ""}
+    assert all(route.is_fixed(r) for r in (flight, hotel, checkout, booked))
+    assert not route.is_fixed(free)
+    assert route.place_of(flight) == "NRT airport"
+    assert route.place_of(hotel) == "東京都台東區1-2-3"
+    assert route.place_of(checkout) == "東橫INN"
+    assert route.place_of(free) == "淺草寺"
+
+
+def test_time_windows():
+    assert route.time_window({"活動": "🏨 入住: A", "start_min": 900, "end_min": 1439}, True) == (900, None, route.HOTEL_STAY)
+    assert route.time_window({"活動": "🔑 退房: A", "start_min": 0, "end_min": 660}, True) == (None, 660, route.HOTEL_STAY)
+    assert route.time_window({"活動": "午餐", "start_min": 720, "end_min": 780}, True) == (720, 720, 60)
+    assert route.time_window({"活動": "散步", "start_min": 600, "end_min": float("nan")}, False) == (None, None, route.DEFAULT_STAY)
+
+
+def test_evaluate_waits_for_earliest_and_counts_late():
+    items = day_items([("09:00", "10:00", "A", ""), ("10:00", "10:30", "B", "已預約")])
+    plan = route.DayPlan(items, {("A", "B"): 1800, ("B", "A"): 1800}, {1})
+    cost, travel, late = plan.evaluate([0, 1])
+    # 10:30 才到、預約是 10:00：遲到 30 分鐘
+    assert (travel, late) == (30, 30)
+    assert cost == 30 + route.LATE_PENALTY * 30
+    # 先到 B (沒有限制的話) 就要等到 10:00
+    plan = route.DayPlan(items, {("A", "B"): 0, ("B", "A"): 0}, {1})
+    assert plan.evaluate([0, 1])[2] == 0
+
+
+def test_line_is_sorted_into_a_single_sweep():
+    positions = {"起點": 0, "P1": 1, "P2": 2, "P3": 3, "P4": 4, "P5": 5, "P6": 6}
+    names = ["P4", "P1", "P6", "P2", "P5", "P3"]
+    rows = [("08:00", "08:30", "起點", "")] + [(f"{9 + i:02d}:00", f"{9 + i:02d}:30", n, "") for i, n in enumerate(names)]
+    items = day_items(rows)
+    result = route.optimize_day(items, line_travel(positions))
+    assert [items[i]["活動"] for i in result["order"]] == ["起點", "P1", "P2", "P3", "P4", "P5", "P6"]
+    assert result["travel_after"] == 60
+    assert result["travel_after"] < result["travel_before"]
+    assert result["late_after"] == 0
+
+
+def test_matches_brute_force_on_small_days():
+    rng = random.Random(7)
+    for _ in range(30):
+        n = rng.randint(3, 7)
+        names = [f"S{i}" for i in range(n)]
+        coords = {name: (rng.uniform(0, 5), rng.uniform(0, 5)) for name in names}
+        travel = {
+            (a, b): int(((coords[a][0] - coords[b][0]) ** 2 + (coords[a][1] - coords[b][1]) ** 2) ** 0.5 * 600)
+            for a in names for b in names if a != b
+        }
+        items = day_items([(f"{8 + i:02d}:00", f"{8 + i:02d}:30", name, "") for i, name in enumerate(names)])
+        plan = route.DayPlan(items, travel, set())
+        best = min(plan.evaluate([0] + list(p))[0] for p in itertools.permutations(range(1, n)))
+        result = route.optimize_day(items, travel, time_budget=1.0)
+        cost = plan.evaluate(result["order"])[0]
+        assert sorted(result["order"]) == list(range(n)) and result["order"][0] == 0
+        # 啟發式不保證最佳，但不能比原本差，也不會離最佳解太遠
+        assert cost <= plan.evaluate(list(range(n)))[0]
+        assert cost <= best * 1.25 + 1
+
+
+def test_reservation_is_not_missed_to_save_travel():
+    # 預約在最遠的 P3 (10:00)；順路先去 P1 會遲到，只能直接過去、回程再去 P2 / P1
+    positions = {"起點": 0, "P1": 1, "P2": 2, "P3": 6}
+    items = day_items([
+        ("08:30", "08:40", "起點", ""),
+        ("09:30", "10:00", "P1", ""),
+        ("10:00", "11:00", "P3", "門票 10:00"),
+        ("11:00", "11:30", "P2", ""),
+    ])
+    result = route.optimize_day(items, line_travel(positions))
+    assert result["late_before"] == 10
+    assert result["late_after"] == 0
+    assert [items[i]["活動"] for i in result["order"]] == ["起點", "P3", "P2", "P1"]
+    # 固定行程的時間不改
+    p3 = next(i for i, r in enumerate(items) if r["活動"] == "P3")
+    assert p3 not in result["times"]
+
+
+def test_schedule_rounds_and_reordered_rows_only_returns_changes():
+    positions = {"起點": 0, "P1": 1, "P2": 2}
+    items = day_items([("09:00", "09:30", "起點", ""), ("10:00", "10:30", "P2", ""), ("11:00", "11:30", "P1", "")])
+    travel = line_travel(positions)
+    travel[("起點", "P1")] = 7 * 60
+    result = route.optimize_day(items, travel)
+    assert [items[i]["活動"] for i in result["order"]] == ["起點", "P1", "P2"]
+    assert all(start % route.ROUND_TO == 0 for start, _ in result["times"].values())
+    updates = route.reordered_rows(items, result, DAY)
+    by_name = {row[3]: row for row in updates.values()}
+    # 起點的時間沒變，不用寫回
+    assert set(by_name) == {"P1", "P2"}
+    assert by_name["P1"][1:3] == ["09:40", "10:10"]
+    assert route.reordered_rows(items, dict(result, order=[0, 1, 2]), DAY) == {}
+
+
+def test_short_days_are_left_alone():
+    items = day_items([("09:00", "10:00", "A", ""), ("10:00", "11:00", "B", "")])
+    result = route.optimize_day(items, {})
+    assert result["order"] == [0, 1]
+    assert result["unknown"] == 2
+
+
+def test_late_night_times_stop_at_end_of_day():
+    assert route.hhmm(23 * 60 + 59) == "23:59"
+    assert route.hhmm(24 * 60 + 30) == "23:59"
+    positions = {"起點": 0, "P1": 1, "P2": 2}
+    items = day_items([("21:00", "22:00", "起點", ""), ("22:00", "23:30", "P2", ""), ("23:30", "23:59", "P1", "")])
+    result = route.optimize_day(items, line_travel(positions))
+    assert [items[i]["活動"] for i in result["order"]] == ["起點", "P1", "P2"]
+    # P2 排在 P1 之後要到半夜才結束：回報 overflow，寫回的時間停在 23:59，不會繞回 00:xx
+    p2 = next(i for i, r in enumerate(items) if r["活動"] == "P2")
+    assert result["overflow"] == [p2]
+    by_name = {row[3]: row for row in route.reordered_rows(items, result, DAY).values()}
+    assert by_name["P2"][2] == "23:59"
+    assert by_name["P2"][1] <= by_name["P2"][2]
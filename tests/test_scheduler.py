@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+import scheduler
+from scheduler import Scheduler, Throttled, TokenBucket
+
+
+class FakeClock:
+    # 時間只在測試呼叫 advance / sleep 時前進
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds, bucket=None):
+        self.now += seconds
+        if bucket is not None:
+            # 叫醒正在等 token 的執行緒重新檢查
+            with bucket._cond:
+                bucket._cond.notify_all()
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def wait_until(condition, timeout=5.0):
+    # 等其他執行緒進到某個狀態 (不是等時間經過)
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for condition"
+        time.sleep(0.001)
+
+
+def test_refill_and_burst_cap():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, burst=4, clock=clock)
+    for _ in range(4):
+        bucket.acquire(timeout=0)
+    with pytest.raises(scheduler.QuotaTimeout):
+        bucket.acquire(timeout=0)
+    clock.advance(1.0)
+    bucket.acquire(timeout=0)
+    bucket.acquire(timeout=0)
+    with pytest.raises(scheduler.QuotaTimeout):
+        bucket.acquire(timeout=0)
+    # 閒置再久也只累積到 burst
+    clock.advance(3600)
+    bucket._refill(clock())
+    assert bucket.tokens == 4
+
+
+def test_higher_priority_goes_first():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, burst=1, clock=clock)
+    bucket.acquire(timeout=0)
+    order = []
+
+    def take(name, priority):
+        bucket.acquire(priority=priority)
+        order.append(name)
+
+    background = threading.Thread(target=take, args=("background", scheduler.BACKGROUND))
+    background.start()
+    wait_until(lambda: bucket.queued() == 1)
+    interactive = threading.Thread(target=take, args=("interactive", scheduler.INTERACTIVE))
+    interactive.start()
+    wait_until(lambda: bucket.queued() == 2)
+    # 只補一個 token：比較晚來但優先順序高的先拿到
+    clock.advance(1.0, bucket)
+    wait_until(lambda: order)
+    assert order == ["interactive"]
+    assert bucket.queued() == 1
+    clock.advance(1.0, bucket)
+    background.join(5)
+    interactive.join(5)
+    assert order == ["interactive", "background"]
+
+
+def test_backoff_stops_after_retry_limit(monkeypatch):
+    clock = FakeClock()
+    sched = Scheduler(limits={"api": (1000.0, 1000)}, max_retries=3, base_delay=1.0, clock=clock, sleep=clock.sleep)
+    # 抖動取上限，才能檢查每次退避的長度
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: high)
+    calls = []
+
+    def unavailable():
+        calls.append(clock())
+        raise Throttled(503)
+
+    with pytest.raises(Throttled):
+        sched.call("api", unavailable)
+    assert len(calls) == 4
+    # 1 + 2 + 4 秒的指數退避 (每段最多睡 0.25 秒就檢查一次取消)
+    assert [b - a for a, b in zip(calls, calls[1:])] == pytest.approx([1.0, 2.0, 4.0])
+    assert sched.throttled == 3
+
+
+def test_non_retryable_error_is_not_retried():
+    sched = Scheduler(limits={"api": (1000.0, 1000)}, sleep=pytest.fail)
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        sched.call("api", broken)
+    assert calls == [1]
+
+
+def test_retry_succeeds_before_limit():
+    clock = FakeClock()
+    sched = Scheduler(limits={"api": (1000.0, 1000)}, max_retries=3, clock=clock, sleep=clock.sleep)
+    results = iter([Throttled(500), Throttled(503), "ok"])
+
+    def flaky():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert sched.call("api", flaky) == "ok"
+    assert sched.throttled == 2
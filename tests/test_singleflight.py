@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+import singleflight
+
+N = 8
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for condition"
+        time.sleep(0.001)
+
+
+def run_concurrently(group, fn):
+    # N 個執行緒同時呼叫 do()；leader 卡在 release 上，等其他人都變成 follower 才放行
+    release = threading.Event()
+    calls = []
+    results = [None] * N
+
+    def underlying():
+        calls.append(1)
+        release.wait(5)
+        return fn()
+
+    def worker(i):
+        try:
+            results[i] = ("value", group.do("key", underlying))
+        except Exception as e:
+            results[i] = ("error", e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(N)]
+    for t in threads:
+        t.start()
+    wait_until(lambda: group.shared == N - 1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    return calls, results
+
+
+def test_concurrent_calls_share_one_result():
+    group = singleflight.Group()
+    value = object()
+    calls, results = run_concurrently(group, lambda: value)
+    assert len(calls) == 1
+    assert all(kind == "value" and result is value for kind, result in results)
+    assert group.inflight() == 0
+
+
+def test_concurrent_calls_share_one_exception():
+    group = singleflight.Group()
+    error = RuntimeError("quota")
+
+    def fail():
+        raise error
+
+    calls, results = run_concurrently(group, fail)
+    assert len(calls) == 1
+    assert all(kind == "error" and result is error for kind, result in results)
+
+
+def test_abandoned_leader_lets_follower_retry():
+    group = singleflight.Group()
+    started = threading.Event()
+    release = threading.Event()
+
+    def cancelled():
+        started.set()
+        release.wait(5)
+        raise KeyboardInterrupt()
+
+    def leader():
+        with pytest.raises(KeyboardInterrupt):
+            group.do("key", cancelled)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait(5)
+    follower = []
+    other = threading.Thread(target=lambda: follower.append(group.do("key", lambda: "retried")))
+    other.start()
+    wait_until(lambda: group.shared == 1)
+    release.set()
+    thread.join(5)
+    other.join(5)
+    # leader 沒拿到結果就離開：follower 自己重新查，不會收到 leader 的例外
+    assert follower == ["retried"]
+
+
+def test_sequential_calls_are_not_cached():
+    group = singleflight.Group()
+    calls = []
+    assert group.do("key", lambda: calls.append(1) or len(calls)) == 1
+    assert group.do("key", lambda: calls.append(1) or len(calls)) == 2
@@ -0,0 +1,170 @@
+import pytest
+
+import fakes
+import scheduler
+import storage
+from sheets_cache import SheetsCache
+from storage import LocalStore, SyncWorker, row_hash
+from write_queue import WriteQueue
+
+HEADERS = ["日期", "活動"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStore(str(tmp_path / "local.db"))
+
+
+@pytest.fixture
+def remote():
+    spreadsheet = fakes.FakeSpreadsheet()
+    spreadsheet.seed("行程", [HEADERS, ["1/1", "淺草寺"], ["1/1", "晴空塔"]])
+    return spreadsheet
+
+
+@pytest.fixture
+def worker(store, remote, monkeypatch):
+    # 測試不受 Sheets 每分鐘配額限制
+    unlimited = scheduler.Scheduler(limits={api: (1e6, 1e6) for api in scheduler.LIMITS})
+    monkeypatch.setattr(scheduler, "call", unlimited.call)
+    cache = SheetsCache(remote, ttl=0, version_check_interval=0)
+    return SyncWorker(store, cache, WriteQueue(cache, max_retries=0))
+
+
+def synced(store, rows):
+    store.ensure_sheet("行程", HEADERS)
+    store.merge_remote("行程", rows)
+    return {pos: rid for rid, pos, *_ in store._local_rows("行程")}
+
+
+def dirty_rows(store, title):
+    return [store_row for store_row in store._local_rows(title) if store_row[4]]
+
+
+def remote_rows(spreadsheet, title):
+    return spreadsheet.worksheet(title).get_all_values()[1:]
+
+
+# --- merge_remote 的衝突偵測 ---
+def test_merge_remote_resolves_each_case(store):
+    ids = synced(store, [["1/1", "淺草寺"], ["1/1", "晴空塔"], ["1/2", "築地"]])
+    store.update_rows_by_id("行程", {ids[0]: ["1/1", "淺草寺 (早上)"], ids[1]: ["1/1", "晴空塔 (晚上)"]})
+    updates, pending = store.merge_remote("行程", [["1/1", "淺草寺"], ["1/1", "東京鐵塔"], ["1/2", "豐洲市場"]])
+    # 只有本機改：推本機
+    assert updates == {0: ["1/1", "淺草寺 (早上)"]}
+    assert pending == []
+    # 兩邊都改：用遠端，本機版本記成衝突；只有遠端改：直接用遠端
+    assert store.rows("行程") == [["1/1", "淺草寺 (早上)"], ["1/1", "東京鐵塔"], ["1/2", "豐洲市場"]]
+    conflicts = store.unseen_conflicts()
+    assert len(conflicts) == 1
+    assert "晴空塔 (晚上)" in str(conflicts[0]) and "東京鐵塔" in str(conflicts[0])
+
+
+def test_merge_remote_same_edit_is_not_a_conflict(store):
+    ids = synced(store, [["1/1", "淺草寺"]])
+    store.update_rows_by_id("行程", {ids[0]: ["1/1", "雷門"]})
+    assert store.merge_remote("行程", [["1/1", "雷門"]]) == ({}, [])
+    assert store.unseen_conflicts() == []
+    assert dirty_rows(store, "行程") == []
+
+
+def test_merge_remote_deleted_rows(store):
+    ids = synced(store, [["1/1", "淺草寺"], ["1/1", "晴空塔"], ["1/2", "築地"]])
+    store.update_rows_by_id("行程", {ids[2]: ["1/2", "築地 (改)"]})
+    store.merge_remote("行程", [["1/1", "淺草寺"]])
+    # 遠端刪掉的列：沒改過的跟著刪，本機改過的留著
+    assert store.rows("行程") == [["1/1", "淺草寺"], ["1/2", "築地 (改)"]]
+
+
+# --- mark_pushed 只把「還是推上去那個內容」的列標成乾淨 ---
+def test_mark_pushed_keeps_rows_edited_during_push(store):
+    ids = synced(store, [["1/1", "淺草寺"]])
+    store.update_rows_by_id("行程", {ids[0]: ["1/1", "雷門"]})
+    updates, _ = store.local_changes("行程")
+    # 推送途中使用者又改了一次
+    store.update_rows_by_id("行程", {ids[0]: ["1/1", "仲見世通"]})
+    store.mark_pushed("行程", updates, [])
+    assert len(dirty_rows(store, "行程")) == 1
+    # 遠端現在是推上去的內容，下一輪對帳要把新的修改推上去，不是衝突
+    assert store.merge_remote("行程", [["1/1", "雷門"]]) == ({0: ["1/1", "仲見世通"]}, [])
+    assert store.unseen_conflicts() == []
+
+
+def test_mark_pushed_appended_row_edited_during_push(store):
+    synced(store, [["1/1", "淺草寺"]])
+    store.append_rows("行程", [["1/2", "築地"]])
+    _, pending = store.local_changes("行程")
+    (rid, row), = pending
+    store.update_rows_by_id("行程", {rid: ["1/2", "豐洲市場"]})
+    store.mark_pushed("行程", {}, pending)
+    # 已經 append 過了，不能再 append 一次
+    assert store.local_changes("行程") == ({}, [])
+    updates, pending = store.merge_remote("行程", [["1/1", "淺草寺"], ["1/2", "築地"]])
+    assert (updates, pending) == ({1: ["1/2", "豐洲市場"]}, [])
+    assert store.rows("行程") == [["1/1", "淺草寺"], ["1/2", "豐洲市場"]]
+
+
+def test_mark_pushed_clears_unchanged_rows(store):
+    ids = synced(store, [["1/1", "淺草寺"]])
+    store.update_rows_by_id("行程", {ids[0]: ["1/1", "雷門"]})
+    updates, _ = store.local_changes("行程")
+    store.mark_pushed("行程", updates, [])
+    assert dirty_rows(store, "行程") == []
+    assert store._local_rows("行程")[0][3] == row_hash(["1/1", "雷門"])
+
+
+# --- SyncWorker ---
+def test_sync_pushes_local_edits_and_new_rows(worker, store, remote):
+    assert worker.sync_once(["行程"])
+    assert store.rows("行程") == [["1/1", "淺草寺"], ["1/1", "晴空塔"]]
+    (first, _), _ = store.rows_with_ids("行程")
+    store.update_rows_by_id("行程", {first: ["1/1", "雷門"]})
+    store.append_rows("行程", [["1/2", "築地"]])
+    assert worker.sync_once()
+    assert remote_rows(remote, "行程") == [["1/1", "雷門"], ["1/1", "晴空塔"], ["1/2", "築地"]]
+    assert dirty_rows(store, "行程") == []
+    assert store.local_changes("行程") == ({}, [])
+
+
+def test_sync_drops_sheet_deleted_remotely(worker, store, remote):
+    worker.sync_once(["行程"])
+    remote.batch_update({"requests": [{"deleteSheet": {"sheetId": remote.worksheet("行程").id}}]})
+    assert worker.sync_once()
+    assert not store.has_sheet("行程")
+
+
+def test_sync_recreates_deleted_sheet_with_local_changes(worker, store, remote):
+    worker.sync_once(["行程"])
+    store.append_rows("行程", [["1/2", "築地"]])
+    remote.batch_update({"requests": [{"deleteSheet": {"sheetId": remote.worksheet("行程").id}}]})
+    assert worker.sync_once()
+    # 沒推上去的修改不能丟：整張表重新建立
+    assert remote.worksheet("行程").get_all_values() == [HEADERS, ["1/1", "淺草寺"], ["1/1", "晴空塔"], ["1/2", "築地"]]
+    assert dirty_rows(store, "行程") == []
+
+
+def test_sync_creates_local_only_sheet(worker, store, remote):
+    store.append_rows("新旅程_Expenses", [["拉麵", "餐飲", 1000, "JPY", "2026-01-02"]], storage.EXPENSE_HEADERS)
+    assert worker.sync_once()
+    assert remote.worksheet("新旅程_Expenses").get_all_values() == [
+        storage.EXPENSE_HEADERS, ["拉麵", "餐飲", "1000", "JPY", "2026-01-02"],
+    ]
+    assert store.local_changes("新旅程_Expenses") == ({}, [])
+
+
+def test_sync_push_failure_keeps_rows_dirty(worker, store, remote, monkeypatch):
+    worker.sync_once(["行程"])
+    store.append_rows("行程", [["1/2", "築地"]])
+
+    def broken(body):
+        raise ValueError("batch_update failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(remote, "batch_update", broken)
+        assert not worker.sync_once()
+    assert isinstance(worker.last_error, ValueError)
+    assert store.local_changes("行程") == ({}, [(store.rows_with_ids("行程")[-1][0], ["1/2", "築地"])])
+    # 恢復之後下一輪推上去
+    assert worker.sync_once()
+    assert remote_rows(remote, "行程") == [["1/1", "淺草寺"], ["1/1", "晴空塔"], ["1/2", "築地"]]
+    assert dirty_rows(store, "行程") == []
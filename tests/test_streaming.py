@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from streaming import iter_text, parse_partial_object
+
+FULL = json.dumps({
+    "淺草寺": '早上 8 點前到，"雷門" 人比較少\n記得帶零錢',
+    "行程": {"開始": "09:00", "天數": 2},
+    "標籤": ["寺廟", "拍照", 3],
+    "預算": 1200,
+    "已訂": True,
+}, ensure_ascii=False)
+
+
+def test_complete_object():
+    assert parse_partial_object(FULL) == (json.loads(FULL), True)
+    # 前面多了說明文字或 ``` 也找得到
+    assert parse_partial_object("```json\n" + FULL + "\n```") == (json.loads(FULL), True)
+
+
+def test_every_prefix_is_a_partial_view():
+    expected = json.loads(FULL)
+    for n in range(len(FULL)):
+        fields, complete = parse_partial_object(FULL[:n])
+        assert not complete
+        assert set(fields) <= set(expected)
+        for key, value in fields.items():
+            if isinstance(value, str):
+                assert expected[key].startswith(value)
+
+
+def test_truncated_inside_string():
+    assert parse_partial_object('{"淺草寺": "早上 8 點') == ({"淺草寺": "早上 8 點"}, False)
+    # key 還沒收完就先不回傳
+    assert parse_partial_object('{"淺草寺": "早上", "晴空') == ({"淺草寺": "早上"}, False)
+
+
+@pytest.mark.parametrize("text, value", [
+    ('{"a": "line\\', "line"),
+    ('{"a": "line\\n', "line\n"),
+    ('{"a": "\\u96f7', "雷"),
+    ('{"a": "\\u96', ""),
+    ('{"a": "say \\"hi\\" ok', 'say "hi" ok'),
+])
+def test_truncated_inside_escape(text, value):
+    assert parse_partial_object(text) == ({"a": value}, False)
+
+
+def test_truncated_inside_nested_object():
+    assert parse_partial_object('{"行程": {"開始": "09:00", "天') == ({"行程": {"開始": "09:00"}}, False)
+    # 巢狀物件收完了，外層還沒
+    assert parse_partial_object('{"行程": {"天數": 2}, "預') == ({"行程": {"天數": 2}}, False)
+    # 巢狀物件裡的 } 不能被當成外層結束
+    assert parse_partial_object('{"行程": {"天數": 2}') == ({"行程": {"天數": 2}}, False)
+
+
+def test_truncated_inside_array():
+    assert parse_partial_object('{"標籤": ["寺廟", "拍') == ({"標籤": ["寺廟", "拍"]}, False)
+    assert parse_partial_object('{"標籤": ["寺廟", 3') == ({"標籤": ["寺廟"]}, False)
+    assert parse_partial_object('{"標籤": ["寺廟", [1, 2], {"x": "}"}]}') == ({"標籤": ["寺廟", [1, 2], {"x": "}"}]}, True)
+
+
+def test_numbers_wait_for_delimiter():
+    # 12 後面可能還有數字
+    assert parse_partial_object('{"預算": 12') == ({}, False)
+    assert parse_partial_object('{"預算": 1200,') == ({"預算": 1200}, False)
+    assert parse_partial_object('{"預算": 1200}') == ({"預算": 1200}, True)
+
+
+def test_no_object_yet():
+    assert parse_partial_object("") == ({}, False)
+    assert parse_partial_object("好的，以下是") == ({}, False)
+
+
+def test_iter_text_stops_when_cancelled():
+    class Response:
+        closed = False
+
+        def __iter__(self):
+            for text in ["a", "b", "c"]:
+                yield type("Chunk", (), {"text": text})()
+
+        def close(self):
+            self.closed = True
+
+    response = Response()
+    seen = []
+    out = list(iter_text(response, cancelled=lambda: len(seen) >= 2 or seen.append(1)))
+    assert out == ["a", "b"]
+    assert response.closed
@@ -0,0 +1,38 @@
+import pytest
+
+import fakes
+import scheduler
+import travel
+
+
+@pytest.fixture
+def maps(monkeypatch):
+    server = fakes.DistanceMatrixServer().start()
+    monkeypatch.setattr(travel, "DISTANCE_MATRIX_URL", server.url)
+    unlimited = scheduler.Scheduler(limits={api: (1e6, 1e6) for api in scheduler.LIMITS})
+    monkeypatch.setattr(scheduler, "call", unlimited.call)
+    yield server
+    server.stop()
+
+
+def test_day_legs_cost_one_element_each(maps):
+    stops = ["淺草寺", "晴空塔", "上野公園", "秋葉原", "東京車站", "銀座"]
+    pairs = travel.adjacent_pairs(stops)
+    legs = travel.get_legs(pairs, "日本", "fake")
+    assert set(legs) == set(pairs)
+    assert legs[("淺草寺", "晴空塔")] == travel.format_element(fakes.fake_element("日本 淺草寺", "日本 晴空塔"))
+    # 整天一個 5 x 5 request 要 25 個 elements；依起點分組只要 5 個
+    assert maps.counter.snapshot()["maps.elements"] == len(pairs)
+
+
+def test_shared_origin_legs_go_in_one_request(maps):
+    pairs = [("飯店", "淺草寺"), ("飯店", "築地"), ("飯店", "新宿"), ("新宿", "飯店")]
+    travel.get_legs(pairs, "日本", "fake")
+    counts = maps.counter.snapshot()
+    assert counts["maps.elements"] == 4
+    assert counts["maps.distance_matrix"] == 2
+
+
+def test_leg_groups_respect_max_destinations():
+    pairs = [("飯店", f"景點{i}") for i in range(travel.MAX_DESTINATIONS + 3)]
+    assert [len(g) for g in travel._leg_groups(pairs)] == [travel.MAX_DESTINATIONS, 3]
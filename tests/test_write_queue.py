@@ -0,0 +1,109 @@
+import pytest
+
+import fakes
+import scheduler
+from sheets_cache import SheetsCache
+from write_queue import WriteQueue
+
+HEADERS = ["款項敘述", "花費"]
+
+
+class RecordingSpreadsheet(fakes.FakeSpreadsheet):
+    # 記下每次 batch_update 的 body；failures 裡的例外依序丟出 (模擬限流 / 壞掉的 request)
+    def __init__(self):
+        super().__init__()
+        self.bodies = []
+        self.failures = []
+
+    def batch_update(self, body):
+        self.bodies.append(body)
+        if self.failures:
+            raise self.failures.pop(0)
+        return super().batch_update(body)
+
+
+@pytest.fixture(autouse=True)
+def no_quota(monkeypatch):
+    # 不受配額限制、重試不等待
+    fast = scheduler.Scheduler(limits={api: (1e6, 1e6) for api in scheduler.LIMITS}, base_delay=0)
+    monkeypatch.setattr(scheduler, "call", fast.call)
+
+
+@pytest.fixture
+def spreadsheet():
+    sheet = RecordingSpreadsheet()
+    sheet.seed("東京_Expenses", [HEADERS, ["拉麵", "1000"]])
+    return sheet
+
+
+@pytest.fixture
+def queue(spreadsheet):
+    return WriteQueue(SheetsCache(spreadsheet, ttl=0, version_check_interval=0), max_retries=2)
+
+
+def kinds(body):
+    return [next(iter(r)) for r in body["requests"]]
+
+
+def test_queued_ops_go_out_in_one_batch_update(queue, spreadsheet):
+    queue.add_worksheet("大阪_Expenses", HEADERS)
+    queue.append_rows("大阪_Expenses", [["章魚燒", 600]])
+    queue.append_rows("大阪_Expenses", [["門票", 2000]])
+    queue.append_rows("東京_Expenses", [["地鐵", 200]])
+    queue.update_range("東京_Expenses", "A2:B2", [["拉麵", 1200]])
+    assert spreadsheet.bodies == []
+    queue.flush(wait=True)
+    assert len(spreadsheet.bodies) == 1
+    # 連續 append 到同一張表 (含表頭) 合併成一個 appendCells
+    assert kinds(spreadsheet.bodies[0]) == ["addSheet", "appendCells", "appendCells", "updateCells"]
+    assert len(spreadsheet.bodies[0]["requests"][1]["appendCells"]["rows"]) == 3
+    assert spreadsheet.worksheet("大阪_Expenses").get_all_values() == [HEADERS, ["章魚燒", "600"], ["門票", "2000"]]
+    assert spreadsheet.worksheet("東京_Expenses").get_all_values() == [HEADERS, ["拉麵", "1200"], ["地鐵", "200"]]
+    assert not queue.has_pending()
+    assert queue.pop_errors() == []
+
+
+def test_pending_rows_overlay_until_flushed(queue, spreadsheet):
+    queue.add_worksheet("大阪_Expenses", HEADERS)
+    queue.append_rows("大阪_Expenses", [["章魚燒", 600]])
+    queue.append_rows("東京_Expenses", [["地鐵", 200]])
+    # 還沒送出：讀取結果已經看得到新的工作表與新列
+    assert "大阪_Expenses" in queue.titles()
+    assert queue.values("大阪_Expenses") == [HEADERS, ["章魚燒", 600]]
+    assert queue.values("東京_Expenses") == [HEADERS, ["拉麵", "1000"], ["地鐵", 200]]
+    assert queue.has_pending("東京_Expenses")
+    queue.flush(wait=True)
+    # 送出後改讀 Sheets 的真正內容，不會重複顯示
+    assert queue.values("東京_Expenses") == [HEADERS, ["拉麵", "1000"], ["地鐵", "200"]]
+    assert queue.values("大阪_Expenses") == [HEADERS, ["章魚燒", "600"]]
+
+
+def test_throttled_batch_is_retried(queue, spreadsheet):
+    spreadsheet.failures = [scheduler.Throttled(503), scheduler.Throttled(429)]
+    queue.append_rows("東京_Expenses", [["地鐵", 200]])
+    queue.flush(wait=True)
+    assert len(spreadsheet.bodies) == 3
+    assert spreadsheet.bodies[0] == spreadsheet.bodies[2]
+    assert queue.pop_errors() == []
+    assert queue.values("東京_Expenses")[-1] == ["地鐵", "200"]
+
+
+def test_failed_batch_surfaces_through_pop_errors(queue, spreadsheet):
+    error = ValueError("invalid range")
+    spreadsheet.failures = [error]
+    queue.append_rows("東京_Expenses", [["地鐵", 200]])
+    queue.flush(wait=True)
+    assert len(spreadsheet.bodies) == 1
+    assert queue.pop_errors() == [error]
+    assert queue.pop_errors() == []
+    # optimistic 的列撤掉，畫面看到的是 Sheets 真正的內容
+    assert queue.values("東京_Expenses") == [HEADERS, ["拉麵", "1000"]]
+
+
+def test_retries_give_up_after_max_retries(queue, spreadsheet):
+    spreadsheet.failures = [scheduler.Throttled(503)] * 3
+    queue.append_rows("東京_Expenses", [["地鐵", 200]])
+    queue.flush(wait=True)
+    assert len(spreadsheet.bodies) == 3
+    errors = queue.pop_errors()
+    assert len(errors) == 1 and isinstance(errors[0], scheduler.Throttled)
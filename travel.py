@@ -0,0 +1,344 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrument
+import scheduler
+
+# --- 交通時間計算 (Distance Matrix 批次版) ---
+# Distance Matrix 依 elements (起點數 x 終點數) 計費，每個 request 最多 100 個 elements。
+# 相鄰兩站的路線彼此無關，硬塞成 n x n 矩陣只會用到對角線、卻要付 n 倍的錢，
+# 所以只把「起點相同」的路線合併成 1 x k 的 request (一段路線剛好一個 element)，
+# 其餘各自 1 x 1，交給 TravelClient 的 thread pool 並行送出。
+# 一天 n 個地點 (n - 1 段路線) 的比較：
+#   整天一個 request (origins = stops[:-1], destinations = stops[1:])：1 個 request，(n - 1)^2 個 elements
+#   依起點分組 (這裡的做法)                                          ：最多 n - 1 個 request，n - 1 個 elements
+#   n = 6  ->  25 vs 5 elements；n = 11 (一個 request 的上限 100) -> 100 vs 10
+#   10 天、每天 8 個地點：490 vs 70 elements，費用差 7 倍
+# request 數多出來的部分由 thread pool (6 條) 並行送出，畫面等的是最慢的那一個，不是加總；
+# 而 Maps 的配額 (scheduler.LIMITS) 跟帳單都是算 elements，所以選 elements 少的這邊。
+# 排路線 (durations) 真的需要整個矩陣，才切成 BLOCK x BLOCK 的區塊。
+
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+MAX_DESTINATIONS = 25  # 一個 request 最多 25 個終點
+BLOCK = 10             # durations 的區塊：10 x 10 = 100 elements
+REQUEST_TIMEOUT = (3.05, 8)  # (連線, 讀取) 秒數
+
+UNKNOWN_ROUTE = "無法計算交通 (請檢查地點名稱)"
+UNREACHABLE = -1  # 秒數矩陣裡「查不到路線」的值
+TIMEOUT_TEXT = "計算超時"
+BUSY_TEXT = "查詢量過大，稍後再試"
+PENDING_TEXT = "交通計算中…"
+
+# 快取時間：查得到的路線留一週；查不到的地名一小時後再試；逾時只留幾分鐘
+LEG_TTL = 7 * 24 * 3600
+FAILED_LEG_TTL = 3600
+TIMEOUT_LEG_TTL = 600
+
+
+def _query(country, place):
+    # 為了準確性，搜尋時加入國家名稱
+    return f"{country} {place}"
+
+
+def format_element(element):
+    if element.get("status") == "OK":
+        duration = element["duration"]["text"]  # 例如: "25 分鐘"
+        distance = element["distance"]["text"]  # 例如: "5.2 公里"
+        return f"{duration} ({distance})"
+    return UNKNOWN_ROUTE
+
+
+def _request_matrix(http, params, cost):
+    with instrument.track("maps", "distance_matrix", cost=cost) as record:
+        response = http.get(DISTANCE_MATRIX_URL, params=params, timeout=REQUEST_TIMEOUT)
+        record["bytes"] = len(response.content)
+        # 被限流：交給 scheduler 退避重試
+        if response.status_code in scheduler.RETRY_STATUS:
+            raise scheduler.Throttled(response.status_code)
+        data = response.json()
+        if data.get("status") == "OVER_QUERY_LIMIT":
+            raise scheduler.Throttled(429, data.get("error_message", ""))
+        if data.get("status") != "OK":
+            record["error"] = data.get("status")
+        return data
+
+
+def _matrix_data(origins, destinations, country, api_key, mode="transit", session=None):
+    # 單一 request：回傳 (Distance Matrix 的 JSON, None)，失敗時回傳 (None, 要顯示的文字)
+    params = {
+        "origins": "|".join(_query(country, o) for o in origins),
+        "destinations": "|".join(_query(country, d) for d in destinations),
+        "mode": mode,
+        "language": "zh-TW",
+        "key": api_key,
+    }
+    # Distance Matrix 依 elements 計費，配額也是算 elements
+    cost = len(origins) * len(destinations)
+    try:
+        data = scheduler.call("maps", _request_matrix, session or requests, params, cost, cost=cost)
+    except requests.Timeout:
+        return None, TIMEOUT_TEXT
+    except (scheduler.Throttled, scheduler.QuotaTimeout):
+        return None, BUSY_TEXT
+    except (requests.RequestException, ValueError):
+        return None, UNKNOWN_ROUTE
+    if data.get("status") != "OK":
+        return None, UNKNOWN_ROUTE
+    return data, None
+
+
+def fetch_matrix(origins, destinations, country, api_key, mode="transit", session=None):
+    # 單一 request：回傳 origins x destinations 的文字矩陣
+    data, failed = _matrix_data(origins, destinations, country, api_key, mode, session)
+    if data is None:
+        return [[failed] * len(destinations) for _ in origins]
+    return [[format_element(el) for el in row.get("elements", [])] for row in data.get("rows", [])]
+
+
+def fetch_durations(origins, destinations, country, api_key, mode="transit", session=None):
+    # 單一 request：回傳 origins x destinations 的秒數矩陣 (查不到的地點是 UNREACHABLE)；
+    # 整個 request 失敗 (逾時、限流) 回傳 None，這種結果不要快取
+    data, _ = _matrix_data(origins, destinations, country, api_key, mode, session)
+    if data is None:
+        return None
+    return [
+        [el["duration"]["value"] if el.get("status") == "OK" else UNREACHABLE for el in row.get("elements", [])]
+        for row in data.get("rows", [])
+    ]
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _leg_groups(pairs):
+    # 起點相同的路線放在同一組 (每組最多 MAX_DESTINATIONS 段)，一組就是一個 1 x k 的 request
+    by_origin = {}
+    for pair in pairs:
+        by_origin.setdefault(pair[0], []).append(pair)
+    for group in by_origin.values():
+        yield from _chunks(group, MAX_DESTINATIONS)
+
+
+def leg_cache_key(country, origin, destination, mode="transit"):
+    return (country, origin, destination, mode)
+
+
+def duration_cache_key(country, origin, destination, mode="transit"):
+    return ("seconds", country, origin, destination, mode)
+
+
+def leg_ttl(text):
+    if text in (TIMEOUT_TEXT, BUSY_TEXT):
+        return TIMEOUT_LEG_TTL
+    if text == UNKNOWN_ROUTE:
+        return FAILED_LEG_TTL
+    return LEG_TTL
+
+
+def get_legs(pairs, country, api_key, mode="transit", session=None, cache=None):
+    # pairs: [(origin, destination), ...] -> {(origin, destination): "25 分鐘 (5.2 公里)"}
+    # 重複的路線只算一次，快取 (SqliteCache) 有的直接用，其餘起點相同的合併成一個 request
+    unique = list(dict.fromkeys(p for p in pairs if p[0] and p[1]))
+    legs = {}
+    if cache is not None:
+        # 一次查完快取 (一個 SELECT)
+        cached = cache.get_many([leg_cache_key(country, o, d, mode) for o, d in unique])
+        for pair in unique:
+            text = instrument.cache_result("maps", "leg", cached.get(leg_cache_key(country, pair[0], pair[1], mode)))
+            if text is not None:
+                legs[pair] = text
+        unique = [p for p in unique if p not in legs]
+    for chunk in _leg_groups(unique):
+        legs.update(_fetch_chunk(chunk, country, api_key, mode, session, cache))
+    return legs
+
+
+def _fetch_chunk(chunk, country, api_key, mode, session, cache):
+    # chunk 裡的路線起點都一樣 (_leg_groups)：1 x len(chunk) 的 request
+    destinations = [d for _, d in chunk]
+    matrix = fetch_matrix([chunk[0][0]], destinations, country, api_key, mode, session)
+    legs = {}
+    for j, pair in enumerate(chunk):
+        try:
+            legs[pair] = matrix[0][j]
+        except IndexError:
+            legs[pair] = UNKNOWN_ROUTE
+        if cache is not None:
+            cache.set(leg_cache_key(country, pair[0], pair[1], mode), legs[pair], leg_ttl(legs[pair]))
+    return legs
+
+
+def adjacent_pairs(stops):
+    return [(stops[i], stops[i + 1]) for i in range(len(stops) - 1)]
+
+
+# --- 並行查詢 + 預先抓取 ---
+# 共用一個 requests.Session (keep-alive + 連線池) 與 thread pool。
+# 選到旅程後先 prefetch 全部天數的路線，畫面只等「正在顯示」的那幾段，
+# 而且每次等待都有期限，超過就先顯示「計算中」，不會卡住整頁。
+class TravelClient:
+    def __init__(self, api_key, cache=None, max_workers=6, mode="transit"):
+        self.api_key = api_key
+        self.cache = cache
+        self.mode = mode
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        # 畫面正在等的路線跟背景預先抓取分開兩個 pool，背景工作排隊時不會佔住前景的執行緒
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="maps")
+        self._background = ThreadPoolExecutor(max_workers=max(1, max_workers // 2), thread_name_prefix="maps-prefetch")
+        self._lock = threading.Lock()
+        self._inflight = {}  # (country, pair) -> Future (同一段路線進行中就共用)
+        self._owners = {}    # Future -> set(owner)
+        self._tags = {}      # Future -> scheduler tag (取消還在排配額的工作用)
+
+    def _done(self, country, chunk, future):
+        with self._lock:
+            for pair in chunk:
+                if self._inflight.get((country, pair)) is future:
+                    del self._inflight[(country, pair)]
+            self._owners.pop(future, None)
+            tag = self._tags.pop(future, None)
+        scheduler.release(tag)
+
+    def prefetch(self, pairs, country, owner=None, check_cache=True, priority=scheduler.BACKGROUND):
+        # 送出所有還沒快取、也還沒在查的路線；回傳 {pair: Future}
+        unique = list(dict.fromkeys(p for p in pairs if p[0] and p[1]))
+        if self.cache is not None and check_cache:
+            unique = [p for p in unique if self.cache.get(leg_cache_key(country, p[0], p[1], self.mode)) is None]
+        futures = {}
+        submitted = []
+        with self._lock:
+            todo = []
+            for pair in unique:
+                future = self._inflight.get((country, pair))
+                if future is not None:
+                    futures[pair] = future
+                    self._owners.setdefault(future, set()).add(owner)
+                else:
+                    todo.append(pair)
+            pool = self._background if priority == scheduler.BACKGROUND else self._executor
+            for chunk in _leg_groups(todo):
+                # 帶著目前的 context 執行，量測紀錄才會算在送出它的那次 rerun
+                tag = object()
+                future = pool.submit(
+                    contextvars.copy_context().run, scheduler.run_with, priority, tag,
+                    _fetch_chunk, chunk, country, self.api_key, self.mode, self.session, self.cache,
+                )
+                self._owners[future] = {owner}
+                self._tags[future] = tag
+                for pair in chunk:
+                    self._inflight[(country, pair)] = future
+                    futures[pair] = future
+                submitted.append((future, chunk))
+        # 已經跑完的 future 會在 add_done_callback 裡同步呼叫 _done (要拿 self._lock)，所以放在鎖外面
+        for future, chunk in submitted:
+            future.add_done_callback(lambda f, c=chunk: self._done(country, c, f))
+        return futures
+
+    def legs(self, pairs, country, timeout=5.0, owner=None):
+        # 取回指定路線；等待總時間不超過 timeout，來不及的先回傳 PENDING_TEXT
+        deadline = time.monotonic() + timeout
+        legs = {}
+        pending = {}
+        for pair in dict.fromkeys(pairs):
+            text = None
+            if self.cache is not None and pair[0] and pair[1]:
+                text = instrument.cache_result("maps", "leg", self.cache.get(leg_cache_key(country, pair[0], pair[1], self.mode)))
+            if text is not None:
+                legs[pair] = text
+            else:
+                pending[pair] = None
+        if pending:
+            futures = self.prefetch(list(pending), country, owner, check_cache=False, priority=scheduler.FOREGROUND)
+            for pair in pending:
+                future = futures.get(pair)
+                if future is None:
+                    legs[pair] = UNKNOWN_ROUTE
+                    continue
+                try:
+                    legs[pair] = future.result(timeout=max(0.0, deadline - time.monotonic())).get(pair, UNKNOWN_ROUTE)
+                except Exception:
+                    # 逾時或被取消：先顯示計算中，下次 rerun 會從快取拿到
+                    legs[pair] = PENDING_TEXT
+        return legs
+
+    def durations(self, stops, country, timeout=10.0, known=None):
+        # 一整天所有地點兩兩之間的交通秒數 (排路線用)：{(起點, 終點): 秒數}，查不到是 None。
+        # 快取有的不再查；其餘切成 BLOCK x BLOCK 的區塊並行送出，
+        # 每個區塊只帶真的缺資料的起點 / 終點
+        # known：已經估計好的路段秒數 (例如 geo 算出來的近距離步行)，這些不查
+        stops = list(dict.fromkeys(s for s in stops if s))
+        result = dict(known or {})
+        missing = set()
+        for o in stops:
+            for d in stops:
+                if o == d or (o, d) in result:
+                    continue
+                seconds = self.cache.get(duration_cache_key(country, o, d, self.mode)) if self.cache is not None else None
+                if seconds is None:
+                    missing.add((o, d))
+                else:
+                    result[(o, d)] = None if seconds == UNREACHABLE else seconds
+        if not missing:
+            return result
+
+        def fetch(origins, destinations):
+            matrix = fetch_durations(origins, destinations, country, self.api_key, self.mode, self.session)
+            if matrix is None:
+                return {}
+            block = {}
+            for i, o in enumerate(origins):
+                for j, d in enumerate(destinations):
+                    try:
+                        seconds = matrix[i][j]
+                    except IndexError:
+                        seconds = UNREACHABLE
+                    block[(o, d)] = seconds
+                    if self.cache is not None and o != d:
+                        ttl = LEG_TTL if seconds != UNREACHABLE else FAILED_LEG_TTL
+                        self.cache.set(duration_cache_key(country, o, d, self.mode), seconds, ttl)
+            return block
+
+        futures = []
+        for origin_block in _chunks(stops, BLOCK):
+            for dest_block in _chunks(stops, BLOCK):
+                destinations = [d for d in dest_block if any((o, d) in missing for o in origin_block)]
+                origins = [o for o in origin_block if any((o, d) in missing for d in destinations)]
+                if origins and destinations:
+                    futures.append(self._executor.submit(
+                        contextvars.copy_context().run, scheduler.run_with, scheduler.FOREGROUND, None, fetch, origins, destinations,
+                    ))
+        deadline = time.monotonic() + timeout
+        for future in futures:
+            try:
+                block = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception:
+                continue
+            for pair, seconds in block.items():
+                if pair in missing:
+                    result[pair] = None if seconds == UNREACHABLE else seconds
+        for pair in missing:
+            result.setdefault(pair, None)
+        return result
+
+    def cancel(self, owner):
+        # 使用者換頁 / 換旅程時，取消只屬於這個 owner、而且還沒開始的查詢
+        # 已經在執行、但還在排配額 / 等重試的，也從 scheduler 的佇列裡丟掉
+        with self._lock:
+            orphans = []
+            for future, owners in list(self._owners.items()):
+                owners.discard(owner)
+                if not owners:
+                    orphans.append((future, self._tags.get(future)))
+        # future.cancel() 會同步呼叫 _done (要拿 self._lock)，所以放在鎖外面
+        for future, tag in orphans:
+            if not future.cancel() and tag is not None:
+                scheduler.cancel(tag)
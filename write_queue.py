@@ -0,0 +1,184 @@
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from gspread.utils import a1_range_to_grid_range
+
+import instrument
+import scheduler
+
+# --- 批次寫入佇列 (write-behind) ---
+# 對話框送出時把新增工作表 / 新增列 / 更新範圍先排進佇列，
+# flush 時合併成「一次」spreadsheet.batch_update 送出。
+# 送出前的資料會疊加在讀取結果上 (optimistic)，畫面可以馬上看到新資料。
+
+
+def _cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": "" if value is None else str(value)}}
+
+
+def _row_data(rows):
+    return [{"values": [_cell(v) for v in row]} for row in rows]
+
+
+class WriteQueue:
+    def __init__(self, sheets, max_retries=5):
+        self.sheets = sheets
+        self.max_retries = max_retries
+        self._ops = []
+        self._new_sheets = {}      # title -> (sheet_id, headers)，尚未送出的新工作表
+        self._pending_rows = {}    # title -> [row, ...]，尚未送出的新增列
+        self._lock = threading.RLock()
+        # 單一 worker：每批 (含重試) 做完才換下一批，確保寫入順序
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheets-writer")
+        self._errors = []
+
+    # --- 排入操作 ---
+    def add_worksheet(self, title, headers, rows=100):
+        with self._lock:
+            sheet_id = random.randint(1, 2**31 - 1)
+            self._new_sheets[title] = (sheet_id, list(headers))
+            self._ops.append(("add_sheet", title, {
+                "sheetId": sheet_id,
+                "title": title,
+                "gridProperties": {"rowCount": int(rows), "columnCount": len(headers)},
+            }))
+        self.append_rows(title, [headers])
+
+    def append_rows(self, title, rows):
+        rows = [list(r) for r in rows]
+        with self._lock:
+            self._ops.append(("append", title, rows))
+            if title in self._new_sheets and title not in self._pending_rows:
+                # 表頭已經算在新工作表的 optimistic 內容裡
+                self._pending_rows[title] = []
+                rows = rows[1:]
+            self._pending_rows.setdefault(title, []).extend(rows)
+
+    def update_range(self, title, a1_range, values):
+        with self._lock:
+            self._ops.append(("update", title, (a1_range, [list(r) for r in values])))
+
+    def delete_worksheet(self, title):
+        with self._lock:
+            self._ops.append(("delete_sheet", title, None))
+
+    def delete_rows(self, title, sheet_rows):
+        # sheet_rows：要刪掉的列號 (1 起算，含表頭)；從下面往上刪，前面的列號才不會跑掉
+        with self._lock:
+            for row in sorted(set(sheet_rows), reverse=True):
+                self._ops.append(("delete_rows", title, row))
+
+    # --- optimistic 讀取 ---
+    def titles(self):
+        with self._lock:
+            titles = self.sheets.titles()
+            return titles + [t for t in self._new_sheets if t not in titles]
+
+    def values(self, title):
+        with self._lock:
+            if title in self._new_sheets:
+                base = [self._new_sheets[title][1]]
+            else:
+                base = self.sheets.values(title)
+            pending = self._pending_rows.get(title)
+            return base + pending if pending else base
+
+    def has_pending(self, title=None):
+        with self._lock:
+            if title is None:
+                return bool(self._ops)
+            return any(op[1] == title for op in self._ops)
+
+    def pop_errors(self):
+        with self._lock:
+            errors, self._errors = self._errors, []
+        return errors
+
+    # --- 送出 ---
+    def _sheet_id(self, title):
+        if title in self._new_sheets:
+            return self._new_sheets[title][0]
+        return self.sheets.worksheet(title).id
+
+    def _build_requests(self, ops):
+        requests = []
+        last_append = None
+        for kind, title, payload in ops:
+            if kind == "add_sheet":
+                requests.append({"addSheet": {"properties": payload}})
+                last_append = None
+            elif kind == "append":
+                sheet_id = self._sheet_id(title)
+                # 連續 append 到同一張表就合併成一個 appendCells
+                if last_append is not None and last_append["sheetId"] == sheet_id:
+                    last_append["rows"].extend(_row_data(payload))
+                    continue
+                last_append = {"sheetId": sheet_id, "rows": _row_data(payload), "fields": "userEnteredValue"}
+                requests.append({"appendCells": last_append})
+            elif kind == "update":
+                a1_range, values = payload
+                requests.append({"updateCells": {
+                    "range": a1_range_to_grid_range(a1_range, self._sheet_id(title)),
+                    "rows": _row_data(values),
+                    "fields": "userEnteredValue",
+                }})
+                last_append = None
+            elif kind == "delete_rows":
+                requests.append({"deleteDimension": {"range": {
+                    "sheetId": self._sheet_id(title), "dimension": "ROWS", "startIndex": payload - 1, "endIndex": payload,
+                }}})
+                last_append = None
+            elif kind == "delete_sheet":
+                requests.append({"deleteSheet": {"sheetId": self._sheet_id(title)}})
+                last_append = None
+        return requests
+
+    def _batch_update(self, body):
+        with instrument.track("sheets", "batch_update") as record:
+            record["bytes"] = len(json.dumps(body, ensure_ascii=False).encode("utf-8"))
+            return self.sheets.spreadsheet.batch_update(body)
+
+    def _send(self, body):
+        # 寫入是使用者按下去的，排在所有讀取前面；429 / 503 由 scheduler 退避重試
+        return scheduler.call("sheets_write", self._batch_update, body, priority=scheduler.INTERACTIVE, retries=self.max_retries)
+
+    def _run(self, ops, new_sheets, pending_rows):
+        touched = {title for _, title, _ in ops}
+        try:
+            with self._lock:
+                requests = self._build_requests(ops)
+            self._send({"requests": requests})
+        except Exception as e:
+            with self._lock:
+                self._errors.append(e)
+        finally:
+            with self._lock:
+                # 不管成功或失敗都撤掉 optimistic 資料，改從 Sheets 重抓真正的狀態
+                if new_sheets or any(kind == "delete_sheet" for kind, _, _ in ops):
+                    self.sheets.invalidate_listing()
+                self.sheets.invalidate_values(*touched)
+                for title in new_sheets:
+                    if self._new_sheets.get(title) == new_sheets[title]:
+                        del self._new_sheets[title]
+                for title, rows in pending_rows.items():
+                    current = self._pending_rows.get(title)
+                    if current is not None:
+                        del current[:len(rows)]
+                        if not current:
+                            del self._pending_rows[title]
+
+    def flush(self, wait=False):
+        with self._lock:
+            ops, self._ops = self._ops, []
+            if not ops:
+                return None
+            new_sheets = {t: v for t, v in self._new_sheets.items() if any(o[0] == "add_sheet" and o[1] == t for o in ops)}
+            pending_rows = {t: list(rows) for t, rows in self._pending_rows.items()}
+        future = self._executor.submit(self._run, ops, new_sheets, pending_rows)
+        if wait:
+            future.result()
+        return future